@@ -0,0 +1,252 @@
+"""
+Benchmarks the auth and registration commands end to end against an in-process
+stand-in homeserver (tests/fake_homeserver.py) with injected latency, so runs
+are reproducible without docker or network.
+
+Results are written as JSON, so runs from different commits can be compared.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_auth [--iterations 50] [--latency 0.005] [--jitter 0]
+        [--scenario login_password ...] [--output results.json] [--compare baseline.json]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from statistics import mean
+from typing import Any, Callable, Optional
+from unittest.mock import patch
+
+from fractal.cli.controllers.auth import AuthController
+from fractal.cli.controllers.registration import RegistrationController
+from fractal.cli.history import percentile
+from fractal.cli.utils import use_data_dir
+from tests.fake_homeserver import FakeHomeserver
+
+ADMIN_PASSWORD = "admin"
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+class Environment:
+    """
+    A local and a remote stand-in homeserver with an admin user on the local one.
+    """
+
+    def __init__(self, homeserver: FakeHomeserver, remote: FakeHomeserver):
+        self.homeserver = homeserver
+        self.remote = remote
+        self.admin_id = homeserver.add_user("admin", ADMIN_PASSWORD, admin=True)
+
+    def login_admin(self) -> None:
+        AuthController().login(
+            self.admin_id,
+            homeserver_url=self.homeserver.url,
+            access_token=self.homeserver.issue_access_token(self.admin_id),
+            silent=True,
+        )
+
+
+# every scenario does its (untimed) setup for iteration i and returns the call to time
+
+
+def login_password(env: Environment, i: int) -> Callable[[], Any]:
+    return lambda: AuthController().login(
+        env.admin_id, password=ADMIN_PASSWORD, homeserver_url=env.homeserver.url, silent=True
+    )
+
+
+def login_access_token(env: Environment, i: int) -> Callable[[], Any]:
+    access_token = env.homeserver.issue_access_token(env.admin_id)
+    return lambda: AuthController().login(
+        env.admin_id, homeserver_url=env.homeserver.url, access_token=access_token, silent=True
+    )
+
+
+def whoami(env: Environment, i: int) -> Callable[[], Any]:
+    env.login_admin()
+    return lambda: AuthController().whoami()
+
+
+def logout(env: Environment, i: int) -> Callable[[], Any]:
+    env.login_admin()
+    return lambda: AuthController().logout()
+
+
+def register(env: Environment, i: int) -> Callable[[], Any]:
+    registration_token = env.homeserver.create_registration_token()
+    matrix_id = env.homeserver.user_id(f"user{i}")
+    return lambda: RegistrationController().register(
+        matrix_id,
+        registration_token=registration_token,
+        password="password",
+        homeserver_url=env.homeserver.url,
+    )
+
+
+def register_remote(env: Environment, i: int) -> Callable[[], Any]:
+    # a new local user for every iteration, since remote matrix ids are derived from it
+    matrix_id = env.homeserver.add_user(f"remote{i}", "password")
+    AuthController().login(
+        matrix_id,
+        homeserver_url=env.homeserver.url,
+        access_token=env.homeserver.issue_access_token(matrix_id),
+        silent=True,
+    )
+    registration_token = env.remote.create_registration_token()
+
+    def run():
+        with patch("fractal.cli.controllers.registration.getpass", return_value="password"):
+            RegistrationController().register_remote(env.remote.url, registration_token)
+
+    return run
+
+
+def token_create(env: Environment, i: int) -> Callable[[], Any]:
+    env.login_admin()
+    return lambda: RegistrationController().token("create")
+
+
+SCENARIOS = {
+    "login_password": login_password,
+    "login_access_token": login_access_token,
+    "whoami": whoami,
+    "logout": logout,
+    "register": register,
+    "register_remote": register_remote,
+    "token_create": token_create,
+}
+
+
+def run_scenario(
+    env: Environment, scenario: Callable[[Environment, int], Callable[[], Any]], iterations: int
+) -> dict[str, Any]:
+    """
+    Times iterations of a scenario.
+
+    Returns:
+        Latency percentiles (in seconds), throughput (ops/s) and HTTP requests per operation.
+    """
+    timings = []
+    errors = 0
+    requests = 0
+    for i in range(iterations):
+        run = scenario(env, i)
+        requests_before = len(env.homeserver.requests) + len(env.remote.requests)
+        start = time.perf_counter()
+        try:
+            run()
+        except (Exception, SystemExit):
+            errors += 1
+            continue
+        timings.append(time.perf_counter() - start)
+        requests += len(env.homeserver.requests) + len(env.remote.requests) - requests_before
+
+    if not timings:
+        return {"count": 0, "errors": errors}
+    timings.sort()
+    return {
+        "count": len(timings),
+        "errors": errors,
+        "min": timings[0],
+        "mean": mean(timings),
+        "p50": percentile(timings, 50),
+        "p95": percentile(timings, 95),
+        "p99": percentile(timings, 99),
+        "max": timings[-1],
+        "throughput": len(timings) / sum(timings),
+        "requests_per_op": requests / len(timings),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict[str, Any], baseline: Optional[dict[str, Any]] = None) -> None:
+    header = f"{'scenario':<20} {'p50':>9} {'p95':>9} {'p99':>9} {'ops/s':>8} {'reqs':>5} {'errors':>6}"
+    if baseline:
+        header += f" {'p50 vs baseline':>16}"
+    print(header)
+    for name, result in results["results"].items():
+        if not result["count"]:
+            print(f"{name:<20} {'failed':>9} {'':>9} {'':>9} {'':>8} {'':>5} {result['errors']:>6}")
+            continue
+        line = (
+            f"{name:<20} {result['p50'] * 1000:>7.1f}ms {result['p95'] * 1000:>7.1f}ms "
+            f"{result['p99'] * 1000:>7.1f}ms {result['throughput']:>8.1f} "
+            f"{result['requests_per_op']:>5.1f} {result['errors']:>6}"
+        )
+        base = (baseline or {}).get("results", {}).get(name)
+        if base and base.get("count"):
+            change = (result["p50"] - base["p50"]) / base["p50"] * 100
+            line += f" {change:>+15.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument(
+        "--latency", type=float, default=0.005, help="seconds added to every request"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="up to this many seconds added at random"
+    )
+    parser.add_argument(
+        "--scenario", action="append", choices=SCENARIOS, help="scenarios to run (default: all)"
+    )
+    parser.add_argument("--output", help="results file (default: benchmarks/results/auth-<commit>.json)")
+    parser.add_argument("--compare", help="results file of a previous run to compare against")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results: dict[str, Any] = {
+        "benchmark": "auth",
+        "commit": commit,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "iterations": args.iterations,
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory() as data_dir, use_data_dir(data_dir), FakeHomeserver(
+        latency=args.latency, jitter=args.jitter
+    ) as homeserver, FakeHomeserver(
+        server_name="remote", latency=args.latency, jitter=args.jitter, seed=1
+    ) as remote:
+        env = Environment(homeserver, remote)
+        for name in args.scenario or SCENARIOS:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                results["results"][name] = run_scenario(env, SCENARIOS[name], args.iterations)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"auth-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    print(f"latency: {args.latency * 1000:.1f}ms, iterations: {args.iterations}")
+    print_results(results, baseline)
+    print(f"results written to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
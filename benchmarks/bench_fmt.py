@@ -0,0 +1,71 @@
+"""
+Benchmarks rendering large result sets with fractal.cli.fmt.
+
+Usage:
+    python benchmarks/bench_fmt.py [--rows 100000] [--repeat 3] [--render]
+"""
+
+import argparse
+import contextlib
+import os
+import time
+from typing import Callable
+
+from fractal.cli.fmt import json_to_table, print_json_to_table
+
+
+def make_rows(count: int) -> list[dict]:
+    """
+    Generates device-like records, including keys that are excluded by default.
+    """
+    return [
+        {
+            "id": f"{i:08x}",
+            "name": f"device-{i}",
+            "health": ("green", "yellow", "red")[i % 3],
+            "size": i * 4096,
+            "links": {"default": {"domain": f"device-{i}.example.com"}},
+            "owner": "@admin:localhost",
+            "date_created": "2024-01-01T00:00:00Z",
+            "date_modified": "2024-01-01T00:00:00Z",
+            "deleted": False,
+            "config": {"key": "value"},
+        }
+        for i in range(count)
+    ]
+
+
+def bench(func: Callable[[], object], repeat: int) -> float:
+    """
+    Returns the best wall time of repeat calls to func.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--render", action="store_true", help="also render the table to /dev/null"
+    )
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    print(f"rows: {args.rows}")
+    best = bench(lambda: json_to_table("Devices", rows), args.repeat)
+    print(f"{'json_to_table':<24} best of {args.repeat}: {best:.3f}s")
+
+    if args.render:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            best = bench(lambda: print_json_to_table("Devices", rows), 1)
+        print(f"{'print_json_to_table':<24} best of 1: {best:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
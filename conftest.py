@@ -1,13 +1,184 @@
+import asyncio
 import os
+import tempfile
 from uuid import uuid4
 import secrets
 import shutil
-from unittest.mock import patch, MagicMock
+from contextlib import contextmanager
+from unittest.mock import patch
+
+# every test process (pytest-xdist worker) gets its own data directory, set before
+# fractal.cli is imported so FRACTAL_DATA_DIR points to it. The cleanup fixture
+# deletes it after every test, so it must never be the user's real data directory.
+_TEST_DATA_ROOT = tempfile.mkdtemp(
+    prefix=f"fractal-tests-{os.environ.get('PYTEST_XDIST_WORKER', 'main')}-"
+)
+os.environ["FRACTAL_DATA_DIR"] = os.path.join(_TEST_DATA_ROOT, "data")
+
+
+def _load_worker_env() -> None:
+    """
+    Loads the environment test-config/prepare-test.py provisioned for this
+    pytest-xdist worker (its own Synapse user and room), if there is one.
+    """
+    worker = os.environ.get("PYTEST_XDIST_WORKER")
+    if not worker:
+        return
+    env_file = os.path.join(
+        os.environ.get("TEST_CONFIG_DIR", "test-config"),
+        f"fractal_cli.{os.environ.get('ENV', 'dev')}.{worker}.env",
+    )
+    try:
+        with open(env_file) as file:
+            lines = file.readlines()
+    except FileNotFoundError:
+        return
+    for line in lines:
+        if line.startswith("export ") and "=" in line:
+            key, value = line[len("export ") :].strip().split("=", 1)
+            os.environ[key] = value.strip('"')
+
+
+_load_worker_env()
+
 from fractal.cli.controllers.auth import AuthController
 from fractal.cli.controllers.registration import RegistrationController
 
 import pytest
-from fractal.cli import FRACTAL_DATA_DIR
+from fractal.cli import FRACTAL_DATA_DIR, trace
+from fractal.cli.utils import read_user_data, use_data_dir, write_user_data
+from tests.fake_homeserver import FakeHomeserver
+
+TEST_USER_USERNAME = "admin"
+TEST_USER_PASSWORD = "admin"
+
+
+def pytest_addoption(parser):
+    # the in-process fake homeserver is used unless a real one is configured
+    default = os.environ.get(
+        "TEST_HOMESERVER", "synapse" if "TEST_HOMESERVER_URL" in os.environ else "fake"
+    )
+    parser.addoption(
+        "--homeserver",
+        choices=["fake", "synapse"],
+        default=default,
+        help="homeserver to run tests against: the in-process fake or a Synapse "
+        "started by docker compose (TEST_HOMESERVER_URL)",
+    )
+
+
+def _use_fake_homeserver(request) -> bool:
+    return request.config.getoption("--homeserver") == "fake"
+
+
+@pytest.fixture(scope="session")
+def _session_fake_homeserver():
+    """
+    In-process fake homeserver shared by the tests of a session (or xdist worker).
+    """
+    with FakeHomeserver() as homeserver:
+        homeserver.add_user(TEST_USER_USERNAME, TEST_USER_PASSWORD, admin=True)
+        yield homeserver
+
+
+@pytest.fixture(scope="session")
+def session_homeserver_url(request) -> str:
+    if _use_fake_homeserver(request):
+        return request.getfixturevalue("_session_fake_homeserver").url
+    return os.environ.get("TEST_HOMESERVER_URL", "http://localhost:8008")
+
+
+@pytest.fixture(scope="session")
+def session_credentials(request, session_homeserver_url, tmp_path_factory) -> dict:
+    """
+    Logs in as the test user once per session and returns the contents of the
+    resulting credentials file, see logged_in_auth_controller.
+
+    Against Synapse, the test user is the one prepare-test.py provisioned for this
+    worker (HS_USER_ID), reusing its access token (MATRIX_ACCESS_TOKEN) if there is one.
+    """
+    matrix_id = f"@{TEST_USER_USERNAME}:localhost"
+    access_token = None
+    if not _use_fake_homeserver(request):
+        matrix_id = os.environ.get("HS_USER_ID", matrix_id)
+        access_token = os.environ.get("MATRIX_ACCESS_TOKEN")
+
+    # AuthenticatedController exports the credentials to os.environ, don't leak them
+    with use_data_dir(str(tmp_path_factory.mktemp("session"))), patch.dict(os.environ):
+        AuthController().login(
+            matrix_id,
+            password=TEST_USER_PASSWORD,
+            homeserver_url=session_homeserver_url,
+            access_token=access_token,
+            silent=True,
+        )
+        credentials, _ = read_user_data(AuthController.TOKEN_FILE)
+    return credentials
+
+
+@pytest.fixture(scope="session")
+def session_registration_token(session_credentials, tmp_path_factory) -> str:
+    """
+    Registration token (with unlimited uses) created once per session.
+    """
+    with use_data_dir(str(tmp_path_factory.mktemp("session"))), patch.dict(os.environ):
+        write_user_data(session_credentials, AuthController.TOKEN_FILE)
+        return asyncio.run(RegistrationController()._create_token())
+
+
+@pytest.fixture(scope="session")
+def _session_fake_state(_session_fake_homeserver, session_credentials, session_registration_token):
+    """
+    State of the shared fake homeserver that every test starts from, which
+    includes the session's login and registration token.
+    """
+    return _session_fake_homeserver.save_state()
+
+
+@pytest.fixture
+def fake_homeserver(monkeypatch, _session_fake_homeserver, _session_fake_state):
+    """
+    In-process fake homeserver with an admin user, used for @*:localhost Matrix IDs.
+
+    The homeserver is shared by the session, but every test starts from the same state.
+    """
+    homeserver = _session_fake_homeserver
+    homeserver.restore_state(_session_fake_state)
+    # get_homeserver_for_matrix_id resolves localhost Matrix IDs to MATRIX_HOMESERVER_URL
+    monkeypatch.setenv("MATRIX_HOMESERVER_URL", homeserver.url)
+    yield homeserver
+
+
+@pytest.fixture(autouse=True)
+def matrix_test_env(request, monkeypatch):
+    """
+    Sets up the environment that test-config/prepare-test.py writes for Synapse,
+    pointing at the fake homeserver.
+    """
+    if not _use_fake_homeserver(request):
+        yield
+        return
+    homeserver = request.getfixturevalue("fake_homeserver")
+    user_id = homeserver.user_id(TEST_USER_USERNAME)
+    monkeypatch.setenv("HS_USER_ID", user_id)
+    monkeypatch.setenv("MATRIX_ACCESS_TOKEN", homeserver.issue_access_token(user_id))
+    yield
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--homeserver") != "fake":
+        return
+    skip_synapse = pytest.mark.skip(reason="requires a Synapse container (--homeserver=synapse)")
+    for item in items:
+        if "synapse" in item.keywords:
+            item.add_marker(skip_synapse)
+
+
+@pytest.fixture
+def fake_alternate_homeserver():
+    with FakeHomeserver() as homeserver:
+        homeserver.add_user(TEST_USER_USERNAME, TEST_USER_PASSWORD, admin=True)
+        yield homeserver
 
 
 @pytest.fixture
@@ -16,38 +187,56 @@ def mock_getpass():
         yield
 
 @pytest.fixture
-def test_user_access_token():
+def test_user_access_token(request):
+    if _use_fake_homeserver(request):
+        homeserver = request.getfixturevalue("fake_homeserver")
+        return homeserver.issue_access_token(homeserver.user_id(TEST_USER_USERNAME))
     return os.environ['MATRIX_ACCESS_TOKEN']
 
 @pytest.fixture
-def test_homeserver_url() -> str:
+def test_homeserver_url(request) -> str:
+    if _use_fake_homeserver(request):
+        return request.getfixturevalue("fake_homeserver").url
     return os.environ.get("TEST_HOMESERVER_URL", "http://localhost:8008")
 
 @pytest.fixture
-def test_alternate_homeserver_url() -> str:
+def test_alternate_homeserver_url(request) -> str:
+    if _use_fake_homeserver(request):
+        return request.getfixturevalue("fake_alternate_homeserver").url
     return os.environ.get("TEST_ALTERNATE_HOMESERVER_URL", "http://localhost:8010")
 
-@pytest.fixture(scope="function")
-def logged_in_auth_controller(test_homeserver_url):
-    # create an AuthController object and login variables
-    auth_cntrl = AuthController()
-    matrix_id = "@admin:localhost"
+@pytest.fixture
+def request_budget():
+    """
+    Asserts that no more than a budget of HTTP requests is made inside a block.
 
-    # log the user in patching prompt_matrix_password to use preset password
-    with patch(
-        "fractal.cli.controllers.auth.prompt_matrix_password", new_callable=MagicMock()
-    ) as mock_password_prompt:
-        mock_password_prompt.return_value = "admin"
-        auth_cntrl.login(matrix_id=matrix_id, homeserver_url=test_homeserver_url)
+    with request_budget(1):
+        AuthController().login(...)
+    """
 
-    return auth_cntrl
+    @contextmanager
+    def budget(max_requests: int):
+        with trace.record_http() as requests:
+            yield requests
+        made = "\n".join(f"  {method} {path} -> {status}" for method, path, status in requests)
+        assert (
+            len(requests) <= max_requests
+        ), f"{len(requests)} HTTP requests made, the budget is {max_requests}:\n{made}"
+
+    return budget
 
 @pytest.fixture(scope="function")
-def test_registration_token():
-    test_registration_controller = RegistrationController()
-    registration_token = test_registration_controller.token("create")
+def logged_in_auth_controller(session_credentials):
+    """
+    Logs the test user in with a copy of the session's credentials, without a
+    login request.
+    """
+    write_user_data(session_credentials, AuthController.TOKEN_FILE)
+    return AuthController()
 
-    return registration_token
+@pytest.fixture(scope="function")
+def test_registration_token(session_registration_token):
+    return session_registration_token
 
 @pytest.fixture(scope='function')
 def test_yaml_dict():
@@ -60,6 +249,14 @@ def test_yaml_dict():
 
     return yaml_info
 
+@pytest.fixture
+def isolated_data_dir(tmp_path):
+    """
+    Gives a test its own data directory instead of the worker's FRACTAL_DATA_DIR.
+    """
+    with use_data_dir(str(tmp_path / "data")) as path:
+        yield path
+
 @pytest.fixture(autouse=True)
 def cleanup():
     yield
@@ -68,3 +265,6 @@ def cleanup():
         shutil.rmtree(FRACTAL_DATA_DIR)
     except FileNotFoundError:
         pass
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_TEST_DATA_ROOT, ignore_errors=True)
@@ -1,3 +1,12 @@
-import appdirs
+# overrides the data directory, e.g. to give every test worker its own
+DATA_DIR_ENV = "FRACTAL_DATA_DIR"
 
-FRACTAL_DATA_DIR = appdirs.user_data_dir("fractal")
+
+def __getattr__(name: str):
+    # FRACTAL_DATA_DIR is resolved on access so it follows FRACTAL_DATA_DIR
+    # and use_data_dir like fractal.cli.utils.get_data_dir
+    if name == "FRACTAL_DATA_DIR":
+        from fractal.cli.utils import get_data_dir
+
+        return get_data_dir()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,12 +1,99 @@
+import os
 import random
+import sys
+import time
 from sys import exit
+from typing import Optional
 
 from clicz import CLICZ, Color
+from fractal.cli import history, memprofile, profiling, trace, watchdog
 
 color = Color()
 
 
+def pop_option(argv: list[str], option: str) -> Optional[str]:
+    """
+    Removes a global `--option value` (or `--option=value`) from argv before
+    dispatching, so that it can be given in front of any command.
+
+    Returns the option's value, or None if it wasn't given.
+    """
+    for index, arg in enumerate(argv[1:], start=1):
+        if arg == "--":
+            break
+        if arg.startswith(f"{option}="):
+            del argv[index]
+            return arg.split("=", 1)[1]
+        if arg == option:
+            if index + 1 >= len(argv):
+                print(f"{option} requires a value")
+                exit(1)
+            value = argv[index + 1]
+            del argv[index : index + 2]
+            return value
+    return None
+
+
 def main():
+    trace_path = pop_option(sys.argv, "--trace") or os.environ.get(trace.TRACE_ENV)
+    if trace_path:
+        trace.enable(trace_path)
+    profile_path = pop_option(sys.argv, "--profile") or os.environ.get(profiling.PROFILE_ENV)
+    if profile_path:
+        profiling.enable(profile_path)
+    memprofile_path = pop_option(sys.argv, "--memprofile") or os.environ.get(
+        memprofile.MEMPROFILE_ENV
+    )
+    if memprofile_path:
+        memprofile.enable(memprofile_path)
+    watchdog_threshold = pop_option(sys.argv, "--loop-watchdog") or os.environ.get(
+        watchdog.WATCHDOG_ENV
+    )
+    if watchdog_threshold:
+        watchdog.enable(float(watchdog_threshold))
+    try:
+        _main()
+    finally:
+        if profiling.write_profile():
+            print(f"Profile written to {profile_path}", file=sys.stderr)
+        if memprofile.write_report() not in (None, "-"):
+            print(f"Memory profile written to {memprofile_path}", file=sys.stderr)
+        trace.write_trace()
+
+
+def _exit_status(code) -> int:
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    return 1
+
+
+def _record_history(cli: CLICZ, duration: float, exit_status: int) -> None:
+    # only record commands that were dispatched to a plugin (not --help or typos)
+    if len(sys.argv) < 3 or sys.argv[1] not in cli.registered_controllers:
+        return
+    # watch mode runs until interrupted, its wall time would skew the percentiles
+    if any(arg == "--watch" or arg.startswith("--watch=") for arg in sys.argv[3:]):
+        return
+    try:
+        history.record_command(
+            f"{sys.argv[1]} {sys.argv[2]}",
+            duration,
+            exit_status,
+            network_calls=trace.http_request_count,
+        )
+    except OSError as err:
+        print(f"Failed to record command history: {err}", file=sys.stderr)
+
+
+def _main():
+    start = time.perf_counter()
+    # count the command's HTTP requests for the command history. matrix-nio and
+    # fractal-matrix-client create their own sessions, so this instruments every
+    # aiohttp session and is only done when the count is recorded (--trace does it too)
+    if history.is_enabled():
+        trace.instrument_http()
     descriptions = [
         "Fractal Networks: Your data, your future.",
         "Fractal Networks: The Future of the Web.",
@@ -15,13 +102,36 @@ def main():
     ]
     description = random.choice(descriptions)
     fn, hero = description.split(":", 1)
-    cli = CLICZ(
-        cli_module="fractal.plugins",
-        description=f"{color.red(fn)}: {color.green(hero.strip())}",
-    )
+    with trace.span("load plugins"), memprofile.phase("import"):
+        cli = CLICZ(
+            cli_module="fractal.plugins",
+            description=f"{color.red(fn)}: {color.green(hero.strip())}",
+        )
     # cli.default_controller = "fractal"
 
-    cli.dispatch()
+    if os.environ.get("FRACTAL_AUTH_SYNC"):
+        from fractal.cli.controllers.auth import AuthController
+
+        # keep the token file and the local database in sync before every command
+        try:
+            with trace.span("auth sync"):
+                AuthController().sync(silent=True)
+        except Exception as err:
+            print(f"Failed to sync credentials: {err}")
+
+    exit_status = 0
+    try:
+        with trace.span("dispatch", command=" ".join(sys.argv[1:3])):
+            cli.dispatch()
+    except SystemExit as err:
+        exit_status = _exit_status(err.code)
+        raise
+    except BaseException:
+        exit_status = 1
+        raise
+    finally:
+        # sys.argv holds the resolved "<plugin> <method>" once aliases are dispatched
+        _record_history(cli, time.perf_counter() - start, exit_status)
     # except Exception as err:
     #     print(f"Error: {err}")
     #     exit(1)
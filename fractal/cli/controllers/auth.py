@@ -3,19 +3,29 @@ import os
 import sys
 from hashlib import sha256
 from sys import exit
-from typing import Any, Callable, Optional, Tuple
+from typing import Any, Callable, Iterable, Optional, Tuple
 
 from asgiref.sync import async_to_sync
 from clicz import cli_method
-from django.db import transaction
-from fractal.cli.utils import read_user_data, write_user_data
+from fractal.cli import probe
+from fractal.cli.fmt import display_data
+from fractal.cli.trace import span
+from fractal.cli.utils import (
+    db_file_identity,
+    file_identity,
+    is_db_initialized_cached,
+    normalize_homeserver_url,
+    read_user_data,
+    refresh_db_state_cache,
+    user_data_path,
+    write_user_data,
+)
 from fractal.matrix import (
     FractalAsyncClient,
     MatrixClient,
     get_homeserver_for_matrix_id,
 )
 from fractal.matrix.utils import parse_matrix_id, prompt_matrix_password
-from fractal_database.utils import is_db_initialized
 from nio import LoginError, WhoamiError
 
 
@@ -23,9 +33,86 @@ class MatrixLoginError(Exception):
     pass
 
 
+def save_matrix_credentials(credentials: Iterable[Tuple[str, str, str]]) -> None:
+    """
+    Upserts Matrix credentials into the local database in a single transaction.
+
+    Credentials are looked up per matrix id and homeserver: the access token of
+    the most recently written existing row is updated and missing credentials
+    are bulk created. Older duplicate rows are left untouched, since they can
+    carry replication targets. The number of queries doesn't depend on the
+    number of credentials.
+
+    Args:
+        credentials: (matrix_id, homeserver_url, access_token) for every login.
+    """
+    from django.db import transaction
+    from django.utils import timezone
+    from fractal_database_matrix.models import MatrixCredentials, MatrixHomeserver
+
+    # the last token wins if the same login is given more than once
+    tokens = {
+        (matrix_id, normalize_homeserver_url(homeserver_url)): access_token
+        for matrix_id, homeserver_url, access_token in credentials
+    }
+    if not tokens:
+        return
+    urls = {url for _, url in tokens}
+    matrix_ids = {matrix_id for matrix_id, _ in tokens}
+
+    with transaction.atomic():
+        homeservers = {hs.url: hs for hs in MatrixHomeserver.objects.filter(url__in=urls)}
+        missing_homeservers = urls - homeservers.keys()
+        if missing_homeservers:
+            MatrixHomeserver.objects.bulk_create(
+                [MatrixHomeserver(url=url, name="Synapse") for url in missing_homeservers]
+            )
+            homeservers = {hs.url: hs for hs in MatrixHomeserver.objects.filter(url__in=urls)}
+
+        existing = {}
+        for creds in (
+            MatrixCredentials.objects.filter(matrix_id__in=matrix_ids, homeserver__url__in=urls)
+            .select_related("homeserver")
+            # the most recently written row is the one updated
+            .order_by("-date_modified")
+        ):
+            key = (creds.matrix_id, creds.homeserver.url)
+            if key in tokens and key not in existing:
+                existing[key] = creds
+
+        to_update = []
+        now = timezone.now()
+        for key, creds in existing.items():
+            if creds.access_token != tokens[key]:
+                creds.access_token = tokens[key]
+                # bulk_update skips auto_now, sync relies on date_modified to pick the latest write
+                creds.date_modified = now
+                to_update.append(creds)
+        if to_update:
+            MatrixCredentials.objects.bulk_update(to_update, ["access_token", "date_modified"])
+
+        to_create = [
+            MatrixCredentials(
+                matrix_id=matrix_id, access_token=access_token, homeserver=homeservers[url]
+            )
+            for (matrix_id, url), access_token in tokens.items()
+            if (matrix_id, url) not in existing
+        ]
+        if to_create:
+            MatrixCredentials.objects.bulk_create(to_create)
+
+    refresh_db_state_cache()
+
+
+def _creds_hash(matrix_id: str, homeserver_url: str, access_token: str) -> str:
+    creds = f"{matrix_id}\n{normalize_homeserver_url(homeserver_url)}\n{access_token}"
+    return sha256(creds.encode("utf-8")).hexdigest()
+
+
 class AuthController:
     PLUGIN_NAME = "auth"
     TOKEN_FILE = "matrix.creds.yaml"
+    SYNC_STATE_FILE = "matrix.sync.yaml"
 
     @cli_method
     def login(
@@ -68,6 +155,18 @@ class AuthController:
                     print(f"Error logging in: {e}", file=sys.stderr)
                 exit(1)
 
+        self._save_credentials(matrix_id, homeserver_url, access_token)  # type: ignore
+
+        if not silent:
+            print(f"Successfully logged in as {matrix_id}")
+
+    login.clicz_aliases = ["login"]
+
+    def _save_credentials(self, matrix_id: str, homeserver_url: str, access_token: str) -> None:
+        """
+        Stores credentials that are known to be valid as the logged in user's,
+        without checking them against the homeserver.
+        """
         # save access token to token file
         write_user_data(
             {
@@ -77,35 +176,10 @@ class AuthController:
             },
             self.TOKEN_FILE,
         )
-        if is_db_initialized():
-            from fractal_database_matrix.models import (
-                MatrixCredentials,
-                MatrixHomeserver,
-            )
-
-            if not homeserver_url.startswith(("http://", "https://")):
-                homeserver_url = f"https://{homeserver_url}"
-
-            try:
-                hs = MatrixHomeserver.objects.get(url=homeserver_url)
-                MatrixCredentials.objects.create(
-                    matrix_id=matrix_id,
-                    access_token=access_token,
-                    homeserver=hs,
-                )
-            except MatrixHomeserver.DoesNotExist:
-                with transaction.atomic():
-                    hs = MatrixHomeserver.objects.create(url=homeserver_url, name="Synapse")
-                    MatrixCredentials.objects.create(
-                        matrix_id=matrix_id,
-                        access_token=access_token,
-                        homeserver=hs,
-                    )
-
-        if not silent:
-            print(f"Successfully logged in as {matrix_id}")
-
-    login.clicz_aliases = ["login"]
+        # Django is only set up once we know the database has to be written to
+        if is_db_initialized_cached():
+            with span("save_matrix_credentials", "db"):
+                save_matrix_credentials([(matrix_id, homeserver_url, access_token)])
 
     @cli_method
     def whoami(self):
@@ -160,6 +234,95 @@ class AuthController:
 
     logout.clicz_aliases = ["logout"]
 
+    @cli_method
+    def doctor(
+        self,
+        homeserver_url: Optional[str] = None,
+        matrix_id: Optional[str] = None,
+        count: int = 3,
+        format: str = "table",
+        watch: Optional[float] = None,
+    ):
+        """
+        Time each hop of the network path to a homeserver.
+        ---
+        Args:
+            homeserver_url: Homeserver to diagnose. Defaults to the logged in homeserver.
+            matrix_id: Matrix ID to time the homeserver discovery for. Defaults to the logged in user.
+            count: Number of times to repeat each probe.
+            format: Output format (table, json, ndjson, plain, tsv or csv).
+            watch: Probe again every this many seconds until interrupted.
+        """
+        access_token = None
+        try:
+            data, _ = read_user_data(self.TOKEN_FILE)
+        except FileNotFoundError:
+            data = {}
+        if not homeserver_url and not matrix_id:
+            homeserver_url = data.get("homeserver_url")
+            matrix_id = data.get("matrix_id")
+        # only send the stored token to the homeserver it belongs to
+        if homeserver_url and data.get("homeserver_url") == homeserver_url:
+            access_token = data.get("access_token")
+
+        if not homeserver_url:
+            if not matrix_id:
+                print(
+                    "You are not logged in. Provide a --homeserver-url or --matrix-id to diagnose.",
+                    file=sys.stderr,
+                )
+                exit(1)
+            try:
+                homeserver_url, _ = async_to_sync(get_homeserver_for_matrix_id)(matrix_id)
+            except Exception as err:
+                print(f"Failed to discover the homeserver for {matrix_id}: {err}", file=sys.stderr)
+                exit(1)
+        homeserver_url = normalize_homeserver_url(homeserver_url)
+
+        def _rows(summary: list[dict[str, Any]]) -> list[dict[str, Any]]:
+            return [
+                {
+                    "phase": row["phase"],
+                    **{
+                        stat: f"{row[stat] * 1000:.1f}ms" if row[stat] is not None else "-"
+                        for stat in ("min", "median", "max")
+                    },
+                    "errors": row["errors"],
+                    "error": row["error"],
+                }
+                for row in summary
+            ]
+
+        title = f"Network path to {homeserver_url} ({int(count)} probes)"
+        if watch:
+            async def _probe() -> list[dict[str, Any]]:
+                phases = await probe.diagnose(
+                    homeserver_url, matrix_id=matrix_id, access_token=access_token, count=int(count)  # type: ignore
+                )
+                return _rows(probe.summarize_phases(phases))
+
+            display_data(_probe, title=title, format=format, watch=watch)
+            return []
+
+        phases = async_to_sync(probe.diagnose)(
+            homeserver_url, matrix_id=matrix_id, access_token=access_token, count=int(count)
+        )
+        summary = probe.summarize_phases(phases)
+        display_data(_rows(summary), title=title, format=format)
+
+        if format in ("table", "plain"):
+            dominant = probe.dominant_phase(summary)
+            if dominant:
+                total = sum(row["median"] for row in summary if row["median"] is not None)
+                share = dominant["median"] / total * 100 if total else 100
+                print(
+                    f"{dominant['phase']} dominates: {dominant['median'] * 1000:.1f}ms median "
+                    f"({share:.0f}% of the total)."
+                )
+            if not access_token:
+                print("whoami was skipped: not logged in to this homeserver.")
+        return summary
+
     async def _login_with_access_token(
         self, access_token: str, homeserver_url: str
     ) -> Tuple[str, str, str]:
@@ -176,8 +339,21 @@ class AuthController:
         self, matrix_id: str, password: Optional[str] = None, homeserver_url: Optional[str] = None
     ) -> Tuple[str, str]:
         apex_changed = False
+        # remote credentials are derived from the discovered homeserver url, so that
+        # they don't depend on which of its candidates is the fastest
+        discovered_url = homeserver_url
+        homeserver_urls = [homeserver_url] if homeserver_url else []
         if not homeserver_url:
-            homeserver_url, apex_changed = await get_homeserver_for_matrix_id(matrix_id)
+            homeserver_urls = await probe.ranked_homeservers(matrix_id)
+            try:
+                with span("get_homeserver_for_matrix_id", "http"):
+                    discovered_url, apex_changed = await get_homeserver_for_matrix_id(matrix_id)
+            except Exception:
+                # candidates only need discovery for the apex check
+                if not homeserver_urls:
+                    raise
+            if not homeserver_urls:
+                homeserver_urls = [discovered_url]  # type: ignore
 
             if apex_changed:
                 response = input(
@@ -186,20 +362,26 @@ class AuthController:
                 if response != "y":
                     exit(1)
         if not password:
-            password = prompt_matrix_password(matrix_id, homeserver_url=homeserver_url)
-        async with MatrixClient(homeserver_url, max_timeouts=15) as client:
-            if apex_changed:
-                local, _ = parse_matrix_id(matrix_id=matrix_id)
-                unique_id = sha256(f"{local}{homeserver_url}".encode("utf-8")).hexdigest()[:4]
-                client.user = f"{local}-{unique_id}"
-                password = sha256(f"{password}{homeserver_url}".encode("utf-8")).hexdigest()
-                res = await client.login(password)
-            else:
-                client.user = matrix_id
-                res = await client.login(password)
-            if isinstance(res, LoginError):
-                raise MatrixLoginError(res.message)
-        return homeserver_url, res.access_token
+            password = prompt_matrix_password(matrix_id, homeserver_url=homeserver_urls[0])
+
+        async def _login(homeserver_url: str, has_fallback: bool) -> Tuple[str, str]:
+            # fail over to the next candidate instead of retrying an unreachable one
+            async with MatrixClient(homeserver_url, max_timeouts=0 if has_fallback else 15) as client:
+                if apex_changed:
+                    local, _ = parse_matrix_id(matrix_id=matrix_id)
+                    unique_id = sha256(f"{local}{discovered_url}".encode("utf-8")).hexdigest()[:4]
+                    client.user = f"{local}-{unique_id}"
+                    res = await client.login(
+                        sha256(f"{password}{discovered_url}".encode("utf-8")).hexdigest()
+                    )
+                else:
+                    client.user = matrix_id
+                    res = await client.login(password)
+                if isinstance(res, LoginError):
+                    raise MatrixLoginError(res.message)
+            return homeserver_url, res.access_token
+
+        return await probe.with_failover(matrix_id, homeserver_urls, _login)
 
     @cli_method
     def show(self, key: str):
@@ -226,6 +408,123 @@ class AuthController:
                 print(data["matrix_id"])
                 return data["matrix_id"]
 
+    @cli_method
+    def sync(self, direction: str = "both", silent: bool = False):
+        """
+        Syncs the logged in user's credentials between the token file and the local database.
+        ---
+        Args:
+            direction: Direction to sync. One of 'push' (file to database), 'pull' (database to file) or 'both'.
+            silent: Silently sync.
+        """
+        if direction not in ("push", "pull", "both"):
+            print(f"Invalid direction: {direction}. Must be one of 'push', 'pull' or 'both'.")
+            exit(1)
+
+        result = self._sync(direction)
+        if not silent:
+            print(f"Credentials {result}.")
+        return result
+
+    def _sync(self, direction: str) -> str:
+        """
+        Compares the token file and the local database against the state recorded
+        by the last sync and writes only what changed.
+
+        When neither the token file nor the database file changed since the last
+        sync, this returns after a couple of stats without setting up Django, so
+        it is cheap enough to run before every command.
+
+        Returns:
+            What was done: 'unchanged', 'pushed', 'pulled' or 'skipped'.
+        """
+        token_file = user_data_path(self.TOKEN_FILE)
+        try:
+            state, _ = read_user_data(self.SYNC_STATE_FILE)
+            state = state or {}
+        except FileNotFoundError:
+            state = {}
+
+        token_file_identity = file_identity(token_file)
+        db_identity = db_file_identity()
+        if (
+            db_identity
+            and state.get("file") == token_file_identity
+            and state.get("db") == db_identity
+        ):
+            return "unchanged"
+
+        if not is_db_initialized_cached():
+            return "skipped"
+
+        from fractal_database_matrix.models import MatrixCredentials
+
+        file_creds = None
+        if token_file_identity:
+            data, _ = read_user_data(self.TOKEN_FILE)
+            try:
+                file_creds = (data["matrix_id"], data["homeserver_url"], data["access_token"])
+            except (KeyError, TypeError):
+                pass
+
+        # credentials for the file's login, or the latest credentials if logged out
+        db_query = MatrixCredentials.objects.select_related("homeserver").order_by(
+            "-date_modified"
+        )
+        if file_creds:
+            db_query = db_query.filter(
+                matrix_id=file_creds[0], homeserver__url=normalize_homeserver_url(file_creds[1])
+            )
+        db_row = db_query.first()
+        db_creds = (
+            (db_row.matrix_id, db_row.homeserver.url, db_row.access_token) if db_row else None
+        )
+
+        file_hash = _creds_hash(*file_creds) if file_creds else None
+        db_hash = _creds_hash(*db_creds) if db_creds else None
+
+        result = "unchanged"
+        if file_hash != db_hash:
+            file_changed = file_hash != state.get("file_hash")
+            db_changed = db_hash != state.get("db_hash")
+            if file_changed and db_changed:
+                # both sides changed since the last sync, the most recently written wins
+                db_modified = getattr(db_row, "date_modified", None)
+                file_modified = token_file_identity[-1] / 1e9 if token_file_identity else 0
+                push = db_modified is None or file_modified >= db_modified.timestamp()
+            else:
+                push = file_changed or not db_creds
+
+            if push and file_creds and direction in ("push", "both"):
+                save_matrix_credentials([file_creds])
+                db_hash = file_hash
+                result = "pushed"
+            elif not push and db_creds and direction in ("pull", "both"):
+                write_user_data(
+                    {
+                        "access_token": db_creds[2],
+                        "homeserver_url": db_creds[1],
+                        "matrix_id": db_creds[0],
+                    },
+                    self.TOKEN_FILE,
+                )
+                file_hash = db_hash
+                result = "pulled"
+            else:
+                # nothing was reconciled, keep the last synced state so the change isn't lost
+                return result
+
+        write_user_data(
+            {
+                "file": file_identity(token_file),
+                "db": db_file_identity(),
+                "file_hash": file_hash,
+                "db_hash": db_hash,
+            },
+            self.SYNC_STATE_FILE,
+        )
+        return result
+
 
 class AuthenticatedController:
     PLUGIN_NAME = "auth_check"
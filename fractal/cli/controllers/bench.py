@@ -0,0 +1,256 @@
+import asyncio
+import secrets
+import sys
+from getpass import getpass
+from sys import exit
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from clicz import cli_method
+from fractal.cli.controllers.auth import (
+    AuthController,
+    AuthenticatedController,
+    auth_required,
+)
+from fractal.cli.controllers.registration import RegistrationController
+from fractal.cli.fmt import display_data
+from fractal.cli.loadgen import LoadResult, run_load
+from fractal.cli.utils import normalize_homeserver_url
+from fractal.matrix import MatrixClient
+from fractal.matrix.utils import parse_matrix_id
+from nio import LogoutError
+
+
+def _format_latency(seconds: Optional[float]) -> str:
+    return f"{seconds * 1000:.1f}ms" if seconds is not None else "-"
+
+
+def _progress_line(title: str, result: LoadResult) -> str:
+    latencies = sorted(result.latencies)
+    p50 = latencies[len(latencies) // 2] if latencies else None
+    return (
+        f"{title}: {result.completed} ops, {result.throughput:.1f} ops/s, "
+        f"{sum(result.errors.values())} failed, p50 {_format_latency(p50)}"
+    )
+
+
+class BenchController(AuthenticatedController):
+    PLUGIN_NAME = "bench"
+
+    def _run(
+        self,
+        title: str,
+        operation: Callable[[int], Awaitable[Any]],
+        concurrency: int,
+        rate: Optional[float],
+        count: Optional[int],
+        duration: Optional[float],
+        format: str,
+        cleanup: Optional[Callable[[Any], Awaitable[Any]]] = None,
+    ) -> dict[str, Any]:
+        """
+        Generates load with operation, showing live progress on a terminal, and
+        displays the achieved throughput, latency percentiles and error codes.
+        See run_load for cleanup.
+        """
+        concurrency = int(concurrency)
+        rate = float(rate) if rate else None
+        duration = float(duration) if duration else None
+        # a duration without a count runs for the whole duration
+        count = int(count) if count and not duration else None
+
+        async def _generate_load() -> LoadResult:
+            # progress goes to stderr, so it doesn't mix with (piped) results
+            if not sys.stderr.isatty():
+                return await run_load(
+                    operation,
+                    concurrency=concurrency,
+                    rate=rate,
+                    total=count,
+                    duration=duration,
+                    cleanup=cleanup,
+                )
+
+            from rich.console import Console
+            from rich.live import Live
+
+            with Live(console=Console(stderr=True), transient=True) as live:
+                return await run_load(
+                    operation,
+                    concurrency=concurrency,
+                    rate=rate,
+                    total=count,
+                    duration=duration,
+                    on_progress=lambda partial: live.update(_progress_line(title, partial)),
+                    cleanup=cleanup,
+                )
+
+        result = asyncio.run(_generate_load())
+        summary = {"flow": title, "concurrency": concurrency, "rate": rate, **result.summary()}
+
+        display_data(
+            [
+                {
+                    "flow": title,
+                    "operations": summary["operations"],
+                    "failed": summary["failed"],
+                    "elapsed": f"{summary['elapsed']:.2f}s",
+                    "throughput": f"{summary['throughput']:.1f}/s",
+                    "p50": _format_latency(summary["p50"]),
+                    "p95": _format_latency(summary["p95"]),
+                    "p99": _format_latency(summary["p99"]),
+                }
+            ],
+            title=f"Load Test ({concurrency} concurrent{f', {rate}/s' if rate else ''})",
+            format=format,
+        )
+        codes = [
+            {"type": "http", "code": code, "count": total}
+            for code, total in sorted(result.http_statuses.items())
+        ] + [
+            {"type": "error", "code": code, "count": total}
+            for code, total in sorted(result.errors.items())
+        ] + [
+            {"type": "cleanup error", "code": code, "count": total}
+            for code, total in sorted(result.cleanup_errors.items())
+        ]
+        if codes:
+            display_data(codes, title="Status Codes", format=format)
+
+        summary["http_statuses"] = dict(result.http_statuses)
+        summary["errors"] = dict(result.errors)
+        summary["cleanup_errors"] = dict(result.cleanup_errors)
+        return summary
+
+    @cli_method
+    def login(
+        self,
+        matrix_id: Optional[str] = None,
+        password: Optional[str] = None,
+        homeserver_url: Optional[str] = None,
+        concurrency: int = 10,
+        rate: Optional[float] = None,
+        count: int = 100,
+        duration: Optional[float] = None,
+        format: str = "table",
+    ):
+        """
+        Load test password logins. Every login is logged out again, untimed.
+        ---
+        Args:
+            matrix_id: Matrix ID to log in as. Defaults to the logged in user.
+            password: Password of the Matrix ID. Prompted for if not given.
+            homeserver_url: Homeserver to log in to. Defaults to the logged in homeserver.
+            concurrency: Maximum number of logins in flight.
+            rate: Target logins per second. Defaults to as many as concurrency allows.
+            count: Number of logins to run.
+            duration: Seconds to run for, instead of a number of logins.
+            format: Output format (table, json, ndjson, plain, tsv or csv).
+        """
+        matrix_id = matrix_id or self.matrix_id
+        homeserver_url = homeserver_url or self.homeserver_url
+        if not matrix_id or not homeserver_url:
+            print(
+                "Provide a --matrix-id and --homeserver-url or log in with fractal login.",
+                file=sys.stderr,
+            )
+            exit(1)
+        homeserver_url = normalize_homeserver_url(homeserver_url)
+        if not password:
+            password = getpass(f"Enter {matrix_id}'s password: ")
+
+        auth = AuthController()
+
+        async def _login(i: int) -> Tuple[str, str]:
+            return await auth._login_with_password(
+                matrix_id, password=password, homeserver_url=homeserver_url  # type: ignore
+            )
+
+        async def _logout(login: Tuple[str, str]) -> None:
+            # every login creates a device, don't leave them behind on the account
+            logged_in_url, access_token = login
+            async with MatrixClient(logged_in_url, access_token=access_token) as client:
+                res = await client.logout()
+            if isinstance(res, LogoutError):
+                raise Exception(res.message)
+
+        return self._run(
+            "login", _login, concurrency, rate, count, duration, format, cleanup=_logout
+        )
+
+    @auth_required
+    @cli_method
+    def token(
+        self,
+        concurrency: int = 10,
+        rate: Optional[float] = None,
+        count: int = 100,
+        duration: Optional[float] = None,
+        format: str = "table",
+    ):
+        """
+        Load test registration token creation as the logged in (admin) user.
+        ---
+        Args:
+            concurrency: Maximum number of requests in flight.
+            rate: Target tokens per second. Defaults to as many as concurrency allows.
+            count: Number of tokens to create.
+            duration: Seconds to run for, instead of a number of tokens.
+            format: Output format (table, json, ndjson, plain, tsv or csv).
+        """
+        registration = RegistrationController()
+
+        async def _create_token(i: int) -> None:
+            await registration._create_token()
+
+        return self._run("token create", _create_token, concurrency, rate, count, duration, format)
+
+    @auth_required
+    @cli_method
+    def register(
+        self,
+        registration_token: Optional[str] = None,
+        homeserver_url: Optional[str] = None,
+        concurrency: int = 10,
+        rate: Optional[float] = None,
+        count: int = 100,
+        duration: Optional[float] = None,
+        format: str = "table",
+    ):
+        """
+        Load test registering new users with a registration token.
+        ---
+        Args:
+            registration_token: Registration token to register with. Created with the logged in (admin) user if not given.
+            homeserver_url: Homeserver to register on. Defaults to the logged in homeserver.
+            concurrency: Maximum number of registrations in flight.
+            rate: Target registrations per second. Defaults to as many as concurrency allows.
+            count: Number of users to register.
+            duration: Seconds to run for, instead of a number of registrations.
+            format: Output format (table, json, ndjson, plain, tsv or csv).
+        """
+        registration = RegistrationController()
+        homeserver_url = normalize_homeserver_url(homeserver_url or self.homeserver_url)  # type: ignore
+        if not registration_token:
+            try:
+                registration_token = asyncio.run(registration._create_token())
+            except Exception as err:
+                print(f"Failed to create a registration token: {err}", file=sys.stderr)
+                exit(1)
+
+        _, server_name = parse_matrix_id(self.matrix_id)  # type: ignore
+        # unique users per run, so runs can be repeated against the same homeserver
+        run_id = secrets.token_hex(4)
+        password = secrets.token_urlsafe(16)
+
+        async def _register(i: int) -> None:
+            await registration._register(
+                f"@bench-{run_id}-{i}:{server_name}",
+                password,
+                registration_token,  # type: ignore
+                homeserver_url=homeserver_url,
+            )
+
+        return self._run("register", _register, concurrency, rate, count, duration, format)
+
+
+Controller = BenchController
@@ -1,11 +1,14 @@
 import asyncio
 import os
+import time
 from getpass import getpass
 from hashlib import sha256
 from sys import exit
-from typing import Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
+import aiohttp
 import docker
+import yaml
 from clicz import cli_method
 from docker.models.containers import Container
 from fractal.cli.controllers.auth import (
@@ -13,6 +16,10 @@ from fractal.cli.controllers.auth import (
     AuthenticatedController,
     auth_required,
 )
+from fractal.cli.fmt import display_data
+from fractal.cli.probe import fastest_homeserver, ranked_homeservers, with_failover
+from fractal.cli.trace import span
+from fractal.cli.utils import normalize_homeserver_url
 from fractal.matrix import MatrixClient, get_homeserver_for_matrix_id
 from fractal.matrix.utils import parse_matrix_id
 from nio import LoginError
@@ -39,18 +46,21 @@ class RegistrationController(AuthenticatedController):
 
         username = parse_matrix_id(matrix_id)[0]
         if not homeserver_url:
-            homeserver_url, _ = await get_homeserver_for_matrix_id(matrix_id)
+            homeserver_url = await fastest_homeserver(matrix_id)
+        if not homeserver_url:
+            with span("get_homeserver_for_matrix_id", "http"):
+                homeserver_url, _ = await get_homeserver_for_matrix_id(matrix_id)
 
         # create admin user on synapse if it doesn't exist
-        result = synapse_container.exec_run(
-            f"register_new_matrix_user -c /data/homeserver.yaml -a -u {username} -p {password} http://localhost:8008"
-        )
+        with span("docker exec_run", "docker", command="register_new_matrix_user"):
+            result = synapse_container.exec_run(
+                f"register_new_matrix_user -c /data/homeserver.yaml -a -u {username} -p {password} http://localhost:8008"
+            )
         if result.exit_code != 0:
             print(result.output.decode("utf-8"))
             raise Exception(f"Failed to create user: {result.output.decode('utf-8')}")
 
-        if not homeserver_url.startswith(("http://", "https://")):
-            homeserver_url = f"https://{homeserver_url}"
+        homeserver_url = normalize_homeserver_url(homeserver_url)
 
         async with MatrixClient(homeserver_url) as client:
             client.user = username
@@ -67,23 +77,154 @@ class RegistrationController(AuthenticatedController):
         registration_token: str,
         local: bool = False,
         homeserver_url: Optional[str] = None,
-    ) -> Tuple[str, str]:
-        if not homeserver_url:
-            homeserver_url, _ = await get_homeserver_for_matrix_id(matrix_id)
+        session: Optional[aiohttp.ClientSession] = None,
+    ) -> Tuple[str, str, str]:
+        """
+        Registers matrix_id on its homeserver.
+
+        Returns:
+            (access_token, homeserver_url, user_id): user_id is the ID the homeserver
+            registered, which is canonicalized (lowercased) and can differ from matrix_id.
+        """
+        homeserver_urls = [homeserver_url] if homeserver_url else []
+        if not homeserver_urls:
+            homeserver_urls = await ranked_homeservers(matrix_id)
+        if not homeserver_urls:
+            with span("get_homeserver_for_matrix_id", "http"):
+                discovered_url, _ = await get_homeserver_for_matrix_id(matrix_id)
+            homeserver_urls = [discovered_url]
         if local:
-            return await self._register_local(matrix_id, password, homeserver_url=homeserver_url)
-        async with MatrixClient(homeserver_url, access_token=self.access_token) as client:  # type: ignore
-            access_token = await client.register_with_token(
-                matrix_id, password, registration_token
+            access_token, homeserver_url = await self._register_local(
+                matrix_id, password, homeserver_url=homeserver_urls[0]
+            )
+            # synapse only accepts lowercase localparts
+            return access_token, homeserver_url, matrix_id.lower()
+
+        async def _register_on(homeserver_url: str, has_fallback: bool) -> Tuple[str, str, str]:
+            async with MatrixClient(homeserver_url, access_token=self.access_token) as client:  # type: ignore
+                # reuse the caller's pooled session instead of opening one per client
+                if session:
+                    client.client_session = session
+                try:
+                    access_token = await client.register_with_token(
+                        matrix_id, password, registration_token
+                    )
+                finally:
+                    # detach the pooled session so closing the client doesn't close it
+                    if session:
+                        client.client_session = None
+                # set from the register response
+                user_id = client.user_id
+            return access_token, homeserver_url, user_id
+
+        return await with_failover(matrix_id, homeserver_urls, _register_on)
+
+    @staticmethod
+    def _derive_remote_creds(matrix_id: str, password: str, homeserver_url: str) -> Tuple[str, str]:
+        """
+        Derives the matrix id and password used for the given user on a remote homeserver.
+
+        Returns:
+            (matrix_id, password): Deterministic remote matrix id and password.
+        """
+        # Generate a deterministic unique ID to append to the current user's matrix id
+        unique = sha256(f"{matrix_id}{homeserver_url}".encode("utf-8")).hexdigest()[:4]
+        remote_matrix_id = f"{matrix_id}-{unique}"
+
+        # Generate a deterministic password using the user's password and homeserver
+        remote_password = sha256(f"{password}{homeserver_url}".encode("utf-8")).hexdigest()
+        return remote_matrix_id, remote_password
+
+    @staticmethod
+    def _load_targets(
+        targets_file: str, registration_token: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Loads registration targets from a yaml file. The file should contain a list
+        of targets, each with a homeserver_url and an optional registration_token:
+
+            - homeserver_url: https://edge1.example.com
+              registration_token: <token>
+
+        Targets without a registration_token use the provided registration_token.
+        """
+        with open(targets_file, "r") as file:
+            targets = yaml.safe_load(file)
+
+        if not isinstance(targets, list):
+            raise ValueError(f"{targets_file} must contain a list of targets.")
+
+        loaded = []
+        for target in targets:
+            if not isinstance(target, dict) or "homeserver_url" not in target:
+                raise ValueError(f"Invalid target in {targets_file}: {target}")
+            token = target.get("registration_token", registration_token)
+            if not token:
+                raise ValueError(
+                    f"No registration token provided for {target['homeserver_url']}."
+                )
+            loaded.append(
+                {"homeserver_url": target["homeserver_url"], "registration_token": token}
+            )
+        return loaded
+
+    async def _register_targets(
+        self, matrix_id: str, password: str, targets: List[Dict[str, str]], concurrency: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Concurrently registers the given user on every target homeserver, sharing a
+        single connection pool between registrations.
+
+        Returns:
+            A result for every target, in the same order as the given targets.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _register_target(
+            session: aiohttp.ClientSession, target: Dict[str, str]
+        ) -> Dict[str, Any]:
+            homeserver_url = target["homeserver_url"]
+            remote_matrix_id, remote_password = self._derive_remote_creds(
+                matrix_id, password, homeserver_url
+            )
+            result: Dict[str, Any] = {
+                "homeserver_url": homeserver_url,
+                "matrix_id": remote_matrix_id,
+                "status": "registered",
+                "time": "",
+                "error": "",
+                "access_token": None,
+            }
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    result["access_token"], _, result["matrix_id"] = await self._register(
+                        matrix_id=remote_matrix_id,
+                        password=remote_password,
+                        registration_token=target["registration_token"],
+                        homeserver_url=homeserver_url,
+                        session=session,
+                    )
+                except Exception as e:
+                    result["status"] = "failed"
+                    result["error"] = str(e)
+                result["time"] = f"{time.perf_counter() - start:.2f}s"
+            return result
+
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            return await asyncio.gather(
+                *[_register_target(session, target) for target in targets]
             )
-        return access_token, homeserver_url
 
     @auth_required
     @cli_method
     def register_remote(
         self,
-        homeserver_url: str,
-        registration_token: str,
+        homeserver_url: Optional[str] = None,
+        registration_token: Optional[str] = None,
+        targets: Optional[str] = None,
+        concurrency: int = 10,
     ):
         """
         Registers the currently logged in user on a given HomeServer.
@@ -91,22 +232,40 @@ class RegistrationController(AuthenticatedController):
         Args:
             homeserver_url: Homeserver to register with.
             registration_token: Registration token to use.
+            targets: Path to a yaml file listing homeservers to register with concurrently.
+            concurrency: Maximum number of concurrent registrations when using --targets.
 
         """
+        if not targets and not (homeserver_url and registration_token):
+            print("A homeserver url and registration token or --targets are required.")
+            exit(1)
+
+        if targets:
+            try:
+                loaded_targets = self._load_targets(targets, registration_token)
+            except (OSError, ValueError, yaml.YAMLError) as e:
+                print(f"Failed to load targets: {e}")
+                exit(1)
 
         # Get the user's login creds
         matrix_id = self.matrix_id
         password = getpass(f"Enter {matrix_id}'s password: ")
 
-        # Generate a deterministic unique ID to append to the current user's matrix id
-        unique = sha256(f"{matrix_id}{homeserver_url}".encode("utf-8")).hexdigest()[:4]
-        matrix_id = f"{matrix_id}-{unique}"
+        if targets:
+            results = asyncio.run(
+                self._register_targets(
+                    matrix_id, password, loaded_targets, concurrency=int(concurrency)  # type: ignore
+                )
+            )
+            display_data(results, title="Remote Registrations", exclude=["access_token"])
+            if any(result["status"] == "failed" for result in results):
+                exit(1)
+            return results
 
-        # Generate a deterministic password using the user's password and homeserver
-        password = sha256(f"{password}{homeserver_url}".encode("utf-8")).hexdigest()
+        matrix_id, password = self._derive_remote_creds(matrix_id, password, homeserver_url)  # type: ignore
 
         # Register the user using the newly generated creds
-        access_token, homeserver_url = asyncio.run(
+        access_token, homeserver_url, _ = asyncio.run(
             self._register(
                 matrix_id=matrix_id,
                 password=password,
@@ -146,7 +305,7 @@ class RegistrationController(AuthenticatedController):
             print("Registration token is required for remote registration.")
             exit(1)
 
-        access_token, homeserver_url = asyncio.run(
+        access_token, homeserver_url, matrix_id = asyncio.run(
             self._register(
                 matrix_id,
                 password,
@@ -156,10 +315,10 @@ class RegistrationController(AuthenticatedController):
             )
         )
 
-        # login as the registered user
-        AuthController().login(
-            matrix_id, homeserver_url=homeserver_url, access_token=access_token
-        )
+        # login as the registered user. The homeserver just issued the access token
+        # for matrix_id, so there's no need to look it up again with a whoami.
+        AuthController()._save_credentials(matrix_id, homeserver_url, access_token)
+        print(f"Successfully logged in as {matrix_id}")
         self.access_token = access_token
         self.matrix_id = matrix_id
         self.homeserver_url = homeserver_url
@@ -0,0 +1,75 @@
+import sys
+import time
+from sys import exit
+from typing import Any, Optional
+
+from clicz import cli_method
+from fractal.cli import history
+from fractal.cli.fmt import display_data
+
+
+class StatsController:
+    PLUGIN_NAME = "metrics"
+
+    @cli_method
+    def stats(
+        self,
+        window: str = "7d",
+        format: str = "table",
+        prometheus: Optional[str] = None,
+        watch: Optional[float] = None,
+    ) -> list[dict[str, Any]]:
+        """
+        Summarize the latency of recently run commands.
+        ---
+        Args:
+            window: Only include commands run within this window (ie 30m, 24h, 7d or all).
+            format: Output format (table, json, ndjson, plain, tsv or csv).
+            prometheus: Also write the summary to this file in Prometheus textfile format.
+            watch: Refresh the summary every this many seconds until interrupted.
+        """
+        try:
+            seconds = history.parse_window(window)
+        except ValueError as err:
+            print(err, file=sys.stderr)
+            exit(1)
+
+        def _summarize() -> list[dict[str, Any]]:
+            since = time.time() - seconds if seconds is not None else None
+            summary = history.summarize(history.read_history(since=since))
+            if prometheus:
+                history.write_prometheus_textfile(summary, prometheus)
+            return summary
+
+        def _rows(summary: list[dict[str, Any]]) -> list[dict[str, Any]]:
+            return [
+                {
+                    "command": row["command"],
+                    "count": row["count"],
+                    "errors": row["errors"],
+                    **{
+                        f"p{percent}": f"{row[f'p{percent}']:.3f}s"
+                        for percent in history.PERCENTILES
+                    },
+                    "network_calls": f"{row['network_calls']:.1f}",
+                }
+                for row in summary
+            ]
+
+        title = f"Command Latency ({window})"
+        if watch:
+            display_data(lambda: _rows(_summarize()), title=title, format=format, watch=watch)
+            return []
+
+        summary = _summarize()
+        if not summary:
+            print(f"No commands recorded in the last {window}.")
+            return summary
+
+        display_data(_rows(summary), title=title, format=format)
+        return summary
+
+    stats.clicz_aliases = ["stats"]
+
+
+Controller = StatsController
@@ -1,8 +1,28 @@
+import csv
+import functools
+import heapq
+import inspect
 import json
+import sys
+import time
+from itertools import chain, islice
+from operator import itemgetter
+from typing import TYPE_CHECKING, Any, AsyncIterable, Callable, Iterable, Iterator, Optional
 
-from rich.console import Console
-from rich.table import Table
-from rich.text import Text
+from fractal.cli import memprofile
+
+# rich is imported lazily so that json and plain output don't pay for its import
+if TYPE_CHECKING:
+    from asyncio import AbstractEventLoop
+
+    from rich.console import Console
+    from rich.table import Table
+    from rich.text import Text
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 KEYS_TO_EXCLUDE = [
     "deleted",
@@ -23,16 +43,33 @@ KEYS_TO_EXCLUDE = [
     "pinned",
 ]
 
+# number of rows rendered per table when streaming
+DEFAULT_CHUNK_SIZE = 500
+
+# number of rows scanned for columns when the input is an iterator
+DEFAULT_SCHEMA_SAMPLE = 1000
+
+# formats written without rich
+PLAIN_FORMATS = ("plain", "tsv", "csv")
+
+Rows = list[dict] | dict | Iterable[dict] | AsyncIterable[dict]
+
+
+def _green(text: str) -> "Text":
+    from rich.text import Text
 
-def _green(text: str) -> Text:
     return Text.assemble((text, "bold green"))
 
 
-def _red(text: str) -> Text:
+def _red(text: str) -> "Text":
+    from rich.text import Text
+
     return Text.assemble((text, "bold blink red"))
 
 
-def _yellow(text: str) -> Text:
+def _yellow(text: str) -> "Text":
+    from rich.text import Text
+
     return Text.assemble((text, "bold yellow"))
 
 
@@ -44,7 +81,7 @@ def pretty_bytes(num: float, suffix: str = "B") -> str:
     return f"{num:.1f}{suffix}"
 
 
-def render_health(status: str) -> Text:
+def render_health(status: str) -> "Text":
     match status:
         case "green":
             return _green(status)
@@ -70,76 +107,712 @@ def _pretty_link(link_obj: dict) -> str:
         raise Exception(f"Failed to pretty print link domain: {e}")
 
 
-def json_to_table(title: str, data: list[dict] | dict, exclude: list[str] = []) -> Table:
+def _iter_async_rows(data: AsyncIterable[dict]) -> Iterator[dict]:
     """
-    Pretty prints given data using a table.
+    Drives an async iterable from synchronous code on a private event loop,
+    yielding rows one at a time as they arrive.
     """
-    table = Table(title=title)
-    exclude_list = KEYS_TO_EXCLUDE + exclude
+    import asyncio
 
-    # if given dictionary wrap it in list
+    loop = asyncio.new_event_loop()
+    iterator = data.__aiter__()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(iterator.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        # close the async generator if the consumer stopped early
+        if hasattr(iterator, "aclose"):
+            loop.run_until_complete(iterator.aclose())
+        loop.close()
+
+
+def _iter_rows(data: Rows) -> Iterator[dict]:
+    """
+    Iterates over rows of the given data without materializing it.
+    Accepts a single dict, a list, any iterable or an async iterable of dicts.
+    """
+    if isinstance(data, dict):
+        yield data
+    elif hasattr(data, "__aiter__"):
+        yield from _iter_async_rows(data)  # type: ignore
+    else:
+        yield from data  # type: ignore
+
+
+def _chunks(rows: Iterable[dict], size: int) -> Iterator[list[dict]]:
+    """
+    Splits rows into lists of at most size rows.
+    """
+    iterator = iter(rows)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _pretty_size(size: Any) -> str:
+    return pretty_bytes(float(size))
+
+
+# health only takes a handful of values, so rendered cells are shared between rows
+_render_health_cell = functools.lru_cache(maxsize=16)(render_health)
+
+# columns that need more than str() to render, any other column is rendered with str()
+COLUMN_RENDERERS: dict[str, Callable[[Any], Any]] = {
+    "links": _pretty_link,
+    "health": _render_health_cell,
+    "size": _pretty_size,
+}
+
+# renderers for plain output, which never produce rich renderables
+PLAIN_COLUMN_RENDERERS: dict[str, Callable[[Any], str]] = {
+    "links": _pretty_link,
+    "size": _pretty_size,
+}
+
+
+class _ColumnPlan:
+    """
+    Columns to render and the renderer for each column, computed once per table
+    so that rendering a row is a single pass over its cells.
+    """
+
+    __slots__ = ("columns", "excluded", "renderers", "_getter")
+
+    def __init__(
+        self,
+        keys: Iterable[str],
+        exclude: list[str] = [],
+        renderers: dict[str, Callable[[Any], Any]] = COLUMN_RENDERERS,
+        fields: Optional[list[str]] = None,
+    ):
+        # explicitly requested fields are shown even if they are excluded by default
+        self.excluded = frozenset(KEYS_TO_EXCLUDE).union(exclude).difference(fields or [])
+        self.columns = tuple(key for key in keys if key not in self.excluded)
+        self.renderers = tuple(renderers.get(key, str) for key in self.columns)
+        # itemgetter returns a bare value instead of a tuple for a single key
+        if len(self.columns) == 1:
+            key = self.columns[0]
+            self._getter = lambda row: (row[key],)
+        else:
+            self._getter = itemgetter(*self.columns)
+
+    def render_row(self, row: dict) -> list[Any]:
+        """
+        Renders the cells of a row in column order. Missing cells are left empty.
+        """
+        try:
+            values = self._getter(row)
+        except KeyError:
+            return [
+                render(row[key]) if key in row else ""
+                for key, render in zip(self.columns, self.renderers)
+            ]
+        return [render(value) for render, value in zip(self.renderers, values)]
+
+
+def infer_schema(
+    data: Rows, sample: Optional[int] = None, iterator_sample: int = DEFAULT_SCHEMA_SAMPLE
+) -> tuple[list[str], Iterator[dict]]:
+    """
+    Computes the union of keys over rows, in order of first appearance.
+
+    Lists are scanned in place without being copied. Iterators (or lists when
+    sample is given) are scanned over their first sample rows only (defaults
+    to iterator_sample), which are buffered and chained back in front of the
+    remaining rows.
+
+    Returns:
+        (columns, rows): Inferred columns and an iterator over all rows.
+    """
     if isinstance(data, dict):
         data = [data]
 
-    [
+    if isinstance(data, list) and sample is None:
+        scanned: Iterable[dict] = data
+        rows: Iterator[dict] = iter(data)
+    else:
+        rows = _iter_rows(data)
+        scanned = list(islice(rows, int(sample or iterator_sample)))
+        rows = chain(scanned, rows)
+
+    columns = list(dict.fromkeys(chain.from_iterable(scanned)))
+    return columns, rows
+
+
+def _split_option(option: Optional[list[str] | str]) -> list[str]:
+    """
+    Splits a comma separated CLI option into a list.
+    """
+    if not option:
+        return []
+    if isinstance(option, str):
+        option = option.split(",")
+    return [value.strip() for value in option if value.strip()]
+
+
+def _parse_where(where: list[str]) -> list[tuple[str, bool, str]]:
+    """
+    Parses key=value and key!=value conditions.
+
+    Returns:
+        (key, negate, value) for every condition.
+    """
+    conditions = []
+    for condition in where:
+        key, sep, value = condition.partition("=")
+        if not sep or not key:
+            raise ValueError(f"Invalid condition: {condition}. Expected key=value.")
+        negate = key.endswith("!")
+        conditions.append((key.rstrip("!").strip(), negate, value.strip()))
+    return conditions
+
+
+def _sort_key(key: str) -> Callable[[dict], tuple]:
+    """
+    Returns a sort key for rows that have the given key. Numbers sort before
+    strings, so mixed values never fail to compare.
+    """
+
+    def sort_key(row: dict) -> tuple:
+        value = row[key]
+        if isinstance(value, (int, float)):
+            return (0, value)
+        return (1, str(value))
+
+    return sort_key
+
+
+def _sort_rows(rows: Iterable[dict], sort: str, limit: Optional[int]) -> Iterable[dict]:
+    """
+    Sorts rows by key (descending if prefixed with -), keeping at most limit rows.
+    Rows missing the key sort last in both directions.
+    """
+    descending = sort.startswith("-")
+    sort_by = sort.lstrip("-")
+    missing: list[dict] = []
+
+    def with_key() -> Iterator[dict]:
+        for row in rows:
+            if row.get(sort_by) is not None:
+                yield row
+            # only the first limit rows missing the key can ever be shown
+            elif limit is None or len(missing) < limit:
+                missing.append(row)
+
+    key = _sort_key(sort_by)
+    if limit is not None:
+        select = heapq.nlargest if descending else heapq.nsmallest
+        return islice(chain(select(limit, with_key(), key=key), missing), limit)
+    return chain(sorted(with_key(), key=key, reverse=descending), missing)
+
+
+def query_rows(
+    data: Rows,
+    fields: Optional[list[str] | str] = None,
+    where: Optional[list[str] | str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int | str] = None,
+) -> Iterator[dict]:
+    """
+    Filters, sorts, limits and projects rows lazily.
+
+    Args:
+        fields: Keys to keep in each row, in order.
+        where: key=value or key!=value conditions that rows must all match.
+        sort: Key to sort by, prefixed with - to sort in descending order.
+        limit: Maximum number of rows to return.
+
+    When both sort and limit are given, a bounded heap of limit rows is used
+    so that memory stays O(limit) regardless of the number of rows.
+    """
+    rows: Iterable[dict] = _iter_rows(data)
+
+    conditions = _parse_where(_split_option(where))
+    if conditions:
+        rows = (
+            row
+            for row in rows
+            if all(
+                (str(row.get(key)) == value) != negate for key, negate, value in conditions
+            )
+        )
+
+    if limit is not None:
+        limit = int(limit)
+
+    if sort:
+        rows = _sort_rows(rows, sort, limit)
+    elif limit is not None:
+        rows = islice(rows, limit)
+
+    projection = _split_option(fields)
+    if projection:
+        rows = ({key: row[key] for key in projection if key in row} for row in rows)
+
+    return iter(rows)
+
+
+def _new_table(title: str, columns: Iterable[str], show_header: bool = True) -> "Table":
+    from rich.table import Table
+
+    table = Table(title=title or None, show_header=show_header)
+    for key in columns:
         table.add_column(key, justify="left", overflow="fold")
-        for key in data[0].keys()
-        if key not in exclude_list
-    ]
-    for row in data:
-        col = []
-        for key in row.keys():
-            if key in exclude_list:
-                continue
+    return table
+
 
-            match key:
-                case "links":
-                    link_domain = _pretty_link(row[key])
-                    col.append(link_domain)
-                case "health":
-                    col.append(render_health(row[key]))
-                case "size":
-                    col.append(pretty_bytes(float(row[key])))
-                case _:
-                    col.append(str(row[key]))
+def json_to_table(
+    title: str, data: Rows, exclude: list[str] = [], schema_sample: Optional[int] = None
+) -> "Table":
+    """
+    Pretty prints given data using a table.
+    """
+    from rich.table import Table
 
-        table.add_row(*col, end_section=True)
+    columns, rows = infer_schema(data, schema_sample)
+    if not columns:
+        return Table(title=title)
+
+    plan = _ColumnPlan(columns, exclude)
+    table = _new_table(title, plan.columns)
+    render_row = plan.render_row
+    add_row = table.add_row
+    for row in rows:
+        add_row(*render_row(row), end_section=True)
 
     return table
 
 
-def print_json_to_table(title: str, data: list[dict] | dict, exclude: list[str] = []) -> None:
+def _prompt_next_page(console: "Console") -> bool:
+    """
+    Waits for the user before rendering the next page.
+
+    Returns:
+        False if the user asked to stop paging.
+    """
+    try:
+        response = console.input("[dim]-- More -- (enter to continue, q to quit)[/dim] ")
+    except (KeyboardInterrupt, EOFError):
+        print()
+        return False
+    return response.strip().lower() != "q"
+
+
+def print_json_to_table(
+    title: str,
+    data: Rows,
+    exclude: list[str] = [],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    paged: bool = False,
+    fields: Optional[list[str]] = None,
+    schema_sample: Optional[int] = None,
+) -> None:
     """
     Pretty prints given data using a table.
+
+    Rows are rendered in tables of chunk_size rows as they are consumed, so
+    output starts after the first chunk and memory stays bounded by the chunk
+    size. When paged, the user is prompted before each subsequent chunk.
     """
-    table = json_to_table(title, data, exclude)
+    from rich.console import Console
+    from rich.table import Table
+
     c = Console()
-    c.print(table)
+    # sample a single chunk of iterators so output still starts after the first chunk
+    columns, rows = infer_schema(data, schema_sample, iterator_sample=int(chunk_size))
+    if not columns:
+        c.print(Table(title=title))
+        return
 
+    plan = _ColumnPlan(columns, exclude, fields=fields)
+    interactive = paged and c.is_terminal
+    for index, chunk in enumerate(_chunks(rows, int(chunk_size))):
+        if index and interactive and not _prompt_next_page(c):
+            break
+        # only the first chunk carries the title and, unless paging, the header
+        table = _new_table(
+            title if index == 0 else "", plan.columns, show_header=index == 0 or paged
+        )
+        for row in chunk:
+            table.add_row(*plan.render_row(row), end_section=True)
+        c.print(table)
 
-def print_json(data: list[dict] | dict, indent: int = 4) -> None:
+
+def _escape_tsv(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def print_plain(
+    data: Rows,
+    format: str = "plain",
+    exclude: list[str] = [],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    fields: Optional[list[str]] = None,
+    schema_sample: Optional[int] = None,
+) -> None:
+    """
+    Prints data without rich, for pipes and scripts. Formats:
+        plain: whitespace aligned columns (aligned per chunk of chunk_size rows)
+        tsv: tab separated values, with tabs and newlines in values escaped
+        csv: comma separated values
+    """
+    columns, rows = infer_schema(data, schema_sample, iterator_sample=int(chunk_size))
+    if not columns:
+        return
+
+    plan = _ColumnPlan(columns, exclude, renderers=PLAIN_COLUMN_RENDERERS, fields=fields)
+    stdout = sys.stdout
+
+    match format:
+        case "csv":
+            writer = csv.writer(stdout, lineterminator="\n")
+            writer.writerow(plan.columns)
+            writer.writerows(map(plan.render_row, rows))
+        case "tsv":
+            stdout.write("\t".join(plan.columns) + "\n")
+            for row in rows:
+                stdout.write("\t".join(map(_escape_tsv, plan.render_row(row))) + "\n")
+        case "plain":
+            for index, chunk in enumerate(_chunks(rows, int(chunk_size))):
+                lines = [plan.render_row(row) for row in chunk]
+                if index == 0:
+                    lines.insert(0, list(plan.columns))
+                widths = [max(map(len, column)) for column in zip(*lines)]
+                for line in lines:
+                    cells = [cell.ljust(width) for cell, width in zip(line, widths)]
+                    stdout.write("  ".join(cells).rstrip() + "\n")
+        case _:
+            raise ValueError(f"Invalid plain format: {format}")
+
+
+def _stdout_is_terminal() -> bool:
+    try:
+        return sys.stdout.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+def _dumps(data: Any) -> str:
+    """
+    Encodes data as compact JSON, using orjson when it is installed.
+    """
+    if orjson is not None:
+        try:
+            # pass datetimes through to default so both encoders format them the same way
+            return orjson.dumps(
+                data,
+                default=str,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            ).decode("utf-8")
+        except TypeError:
+            # orjson is stricter than json (ie integers over 64 bits), fall back
+            pass
+    return json.dumps(data, default=str, separators=(",", ":"))
+
+
+def _print_json_stream(rows: Iterable[dict], indent: int = 4) -> None:
+    """
+    Prints rows as a JSON array, encoding one row at a time.
+    Produces the same output as json.dumps on the full list.
+    """
+    write = sys.stdout.write
+    empty = True
+    for row in rows:
+        if indent:
+            encoded = json.dumps(row, indent=indent, default=str)
+            encoded = "\n".join(f"{' ' * indent}{line}" for line in encoded.splitlines())
+            write(f"[\n{encoded}" if empty else f",\n{encoded}")
+        else:
+            encoded = json.dumps(row, default=str)
+            write(f"[{encoded}" if empty else f", {encoded}")
+        empty = False
+
+    if empty:
+        write("[]\n")
+    else:
+        write("\n]\n" if indent else "]\n")
+
+
+def print_json(data: Rows, indent: int = 4) -> None:
     """
     Prints data as JSON (human readable).
+
+    Iterators are encoded and written one row at a time instead of being
+    materialized into a single string.
     """
-    if indent:
+    if not isinstance(data, (list, dict)):
+        _print_json_stream(_iter_rows(data), indent=indent)
+    elif indent:
         print(json.dumps(data, indent=indent, default=str))
     else:
         print(json.dumps(data, default=str))
 
 
+def print_ndjson(data: Rows) -> None:
+    """
+    Prints data as newline delimited JSON, one compact record per line.
+
+    Records are written and flushed as they are consumed so that downstream
+    tools (ie jq, log shippers) can process output incrementally.
+    """
+    stdout = sys.stdout
+    for row in _iter_rows(data):
+        stdout.write(_dumps(row))
+        stdout.write("\n")
+        stdout.flush()
+
+
+def _row_identity(row: dict, index: int) -> Any:
+    """
+    Returns a stable identity for a row across refreshes, falling back to its position.
+    """
+    for key in ("id", "uuid", "name"):
+        value = row.get(key)
+        if isinstance(value, (str, int)):
+            return value
+    return index
+
+
+class _WatchTable:
+    """
+    Renders successive snapshots of rows, reusing the rendered cells of rows
+    whose values did not change and highlighting rows that did.
+    """
+
+    def __init__(self, title: str, exclude: list[str] = [], fields: Optional[list[str]] = None):
+        self.title = title
+        self.exclude = exclude
+        self.fields = fields
+        self.plan: Optional[_ColumnPlan] = None
+        # row identity -> (raw values, rendered cells)
+        self.rendered: dict[Any, tuple[list[Any], list[Any]]] = {}
+        self.highlighted: set[Any] = set()
+
+    def update(self, rows: list[dict]) -> Optional["Table"]:
+        """
+        Renders a new snapshot of rows.
+
+        Returns:
+            The table to display, or None if nothing changed since the last snapshot.
+        """
+        columns, _ = infer_schema(rows)
+        plan = _ColumnPlan(columns, self.exclude, fields=self.fields)
+        first_render = self.plan is None or plan.columns != self.plan.columns
+        if first_render:
+            # columns changed, every row has to be rendered again
+            self.plan = plan
+            self.rendered = {}
+        else:
+            plan = self.plan  # type: ignore
+
+        rendered: dict[Any, tuple[list[Any], list[Any]]] = {}
+        changed: set[Any] = set()
+        for index, row in enumerate(rows):
+            identity = _row_identity(row, index)
+            if identity in rendered:
+                identity = (identity, index)
+            values = [row.get(column) for column in plan.columns]
+            previous = self.rendered.get(identity)
+            if previous is not None and previous[0] == values:
+                rendered[identity] = previous
+                continue
+            rendered[identity] = (values, plan.render_row(row))
+            if not first_render:
+                changed.add(identity)
+
+        # rows were added, removed or reordered
+        moved = list(rendered) != list(self.rendered)
+        # repaint when rows changed, or to clear the highlight of previously changed rows
+        if not (first_render or changed or moved or self.highlighted):
+            return None
+
+        self.rendered = rendered
+        self.highlighted = changed
+
+        table = _new_table(self.title, plan.columns)
+        table.caption = f"Updated {time.strftime('%H:%M:%S')}"
+        for identity, (_, cells) in rendered.items():
+            table.add_row(*cells, style="bold" if identity in changed else None, end_section=True)
+        return table
+
+
+def watch_data(
+    fetch: Callable[[], Any],
+    interval: float,
+    title: str = "",
+    format: str = "table",
+    exclude: list[str] = [],
+    fields: Optional[list[str] | str] = None,
+    where: Optional[list[str] | str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int | str] = None,
+) -> None:
+    """
+    Periodically calls fetch and displays its result until interrupted.
+
+    fetch may be a regular or an async function. Async fetches all run on the
+    same event loop, so connections can be reused between refreshes. On a
+    terminal, tables are shown in a live view that is only repainted when rows
+    change, with changed rows highlighted. Otherwise, every refresh is
+    displayed in full with the given format.
+    """
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+
+    async def _collect(rows: AsyncIterable[dict]) -> list[dict]:
+        return [row async for row in rows]
+
+    def _fetch_rows() -> list[dict]:
+        data = fetch()
+        if inspect.isawaitable(data):
+            data = loop.run_until_complete(data)
+        if hasattr(data, "__aiter__"):
+            # iterate on the watch's loop rather than a private one, see above
+            data = loop.run_until_complete(_collect(data))
+        # a dict (or a dict with projected fields) is a single row
+        return list(_iter_rows(_prepare_rows(data, fields, where, sort, limit)))
+
+    try:
+        if format == "table" and _stdout_is_terminal():
+            _watch_table(_fetch_rows, interval, title, exclude, _split_option(fields))
+        else:
+            while True:
+                display_data(
+                    _fetch_rows(), title=title, format=format, exclude=exclude, fields=fields
+                )
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+
+
+def _watch_table(
+    fetch_rows: Callable[[], list[dict]],
+    interval: float,
+    title: str,
+    exclude: list[str],
+    fields: list[str],
+) -> None:
+    from rich.console import Console
+    from rich.live import Live
+
+    watch_table = _WatchTable(title, exclude, fields=fields)
+    with Live(console=Console(), auto_refresh=False) as live:
+        while True:
+            table = watch_table.update(fetch_rows())
+            if table is not None:
+                live.update(table, refresh=True)
+            time.sleep(interval)
+
+
+def _prepare_rows(
+    data: Rows,
+    fields: Optional[list[str] | str] = None,
+    where: Optional[list[str] | str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int | str] = None,
+) -> Rows:
+    """
+    Applies the query options of display_data to data, if any were given.
+    """
+    projection = _split_option(fields)
+    if isinstance(data, dict) and projection and not (where or sort or limit is not None):
+        # a single object stays an object when only its fields are projected
+        return next(query_rows(data, fields=projection))
+    elif projection or where or sort or limit is not None:
+        return query_rows(data, fields=projection, where=where, sort=sort, limit=limit)
+    return data
+
+
 def display_data(
-    data: list[dict] | dict,
+    data: Rows,
     title: str = "",
     format: str = "table",
     exclude: list[str] = [],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    paged: bool = False,
+    fields: Optional[list[str] | str] = None,
+    where: Optional[list[str] | str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int | str] = None,
+    schema_sample: Optional[int] = None,
+    watch: Optional[float | str] = None,
 ):
     """
     Displays provided data with the specified format
+
+    Data can be a dict, a list, or a (async) iterator of dicts. Tables are
+    rendered progressively in chunks of chunk_size rows, optionally paged.
+    Supported formats are table, json, ndjson, plain, tsv and csv. Tables are
+    written as plain text when stdout is not a terminal.
+
+    Rows can be projected (fields), filtered (where), sorted and limited
+    before anything is rendered. See query_rows.
+
+    Table columns are the union of the keys of all rows for lists, or of the
+    first schema_sample (defaults to chunk_size) rows for iterators. See
+    infer_schema.
+
+    When watch is given, data must be a (async) function that fetches the
+    rows, which is called every watch seconds. See watch_data.
     """
-    if format == "json":
-        print_json(data)
-    elif format == "table":
-        print_json_to_table(title, data, exclude)
-    else:
-        print(f"Got unsupport display format: {format}. Defaulting to pretty print.")
-        print_json_to_table(title, data, exclude)
+    if watch:
+        if not callable(data):
+            raise ValueError("Watching requires data to be a function that fetches the data.")
+        return watch_data(
+            data,
+            float(watch),
+            title=title,
+            format=format,
+            exclude=exclude,
+            fields=fields,
+            where=where,
+            sort=sort,
+            limit=limit,
+        )
+
+    with memprofile.phase("render"):
+        if format == "table" and not _stdout_is_terminal():
+            format = "plain"
+
+        projection = _split_option(fields)
+        data = _prepare_rows(data, fields, where, sort, limit)
+
+        if format == "json":
+            print_json(data)
+        elif format == "ndjson":
+            print_ndjson(data)
+        elif format in PLAIN_FORMATS:
+            print_plain(
+                data,
+                format,
+                exclude,
+                chunk_size=chunk_size,
+                fields=projection,
+                schema_sample=schema_sample,
+            )
+        elif format == "table":
+            print_json_to_table(
+                title,
+                data,
+                exclude,
+                chunk_size=chunk_size,
+                paged=paged,
+                fields=projection,
+                schema_sample=schema_sample,
+            )
+        else:
+            print(f"Got unsupport display format: {format}. Defaulting to pretty print.")
+            print_json_to_table(
+                title,
+                data,
+                exclude,
+                chunk_size=chunk_size,
+                paged=paged,
+                fields=projection,
+                schema_sample=schema_sample,
+            )
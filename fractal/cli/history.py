@@ -0,0 +1,202 @@
+"""
+Append-only log of command latencies in the user's appdir, summarized by
+`fractal stats`.
+
+Every command appends a single tab separated line:
+
+    <unix timestamp> <command> <duration in ms> <exit status> <network calls>
+
+The log is rotated once it grows past HISTORY_MAX_BYTES, keeping one previous
+generation (<file>.1), so it never takes more than twice that on disk.
+"""
+
+import math
+import os
+import re
+import time
+from collections import defaultdict
+from typing import Any, Iterator, Optional
+
+from fractal.cli.utils import get_data_dir, user_data_path
+
+HISTORY_FILE = "history.log"
+HISTORY_MAX_BYTES = 1024 * 1024
+# set to disable recording command history
+HISTORY_DISABLE_ENV = "FRACTAL_NO_HISTORY"
+
+PERCENTILES = (50, 95, 99)
+WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def is_enabled() -> bool:
+    return not os.environ.get(HISTORY_DISABLE_ENV)
+
+
+def record_command(
+    command: str, duration: float, exit_status: int, network_calls: int = 0
+) -> None:
+    """
+    Appends a command's latency to the history log.
+
+    Args:
+        command: Command that was run (ie "auth login").
+        duration: Duration in seconds.
+        exit_status: Exit status of the command.
+        network_calls: Number of HTTP requests made by the command.
+    """
+    if not is_enabled():
+        return
+
+    os.makedirs(get_data_dir(), exist_ok=True)
+    path = user_data_path(HISTORY_FILE)
+    try:
+        if os.path.getsize(path) >= HISTORY_MAX_BYTES:
+            os.replace(path, f"{path}.1")
+    except FileNotFoundError:
+        pass
+
+    # tabs and newlines would break the line format
+    command = " ".join(command.split())
+    line = f"{time.time():.3f}\t{command}\t{duration * 1000:.1f}\t{exit_status}\t{network_calls}\n"
+    # a single write to a file opened for appending keeps concurrent commands' lines intact
+    with open(path, "a") as file:
+        file.write(line)
+
+
+def read_history(since: Optional[float] = None) -> Iterator[dict[str, Any]]:
+    """
+    Yields recorded commands, oldest first, skipping malformed lines.
+
+    Args:
+        since: Only yield commands recorded at or after this unix timestamp.
+    """
+    path = user_data_path(HISTORY_FILE)
+    for log_file in (f"{path}.1", path):
+        try:
+            file = open(log_file, "r")
+        except FileNotFoundError:
+            continue
+        with file:
+            for line in file:
+                try:
+                    timestamp, command, duration, exit_status, network_calls = line.rstrip(
+                        "\n"
+                    ).split("\t")
+                    entry = {
+                        "timestamp": float(timestamp),
+                        "command": command,
+                        "duration": float(duration) / 1000,
+                        "exit_status": int(exit_status),
+                        "network_calls": int(network_calls),
+                    }
+                except ValueError:
+                    continue
+                if since is not None and entry["timestamp"] < since:
+                    continue
+                yield entry
+
+
+def parse_window(window: str) -> Optional[float]:
+    """
+    Parses a time window like 30m, 24h or 7d.
+
+    Returns:
+        Window in seconds, or None for "all".
+    """
+    if window == "all":
+        return None
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhdw])", window.strip())
+    if not match:
+        raise ValueError(f"Invalid window: {window}. Expected ie 30m, 24h, 7d or all.")
+    return float(match.group(1)) * WINDOW_UNITS[match.group(2)]
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    """
+    Nearest-rank percentile of already sorted values.
+    """
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(entries: Iterator[dict[str, Any]]) -> list[dict[str, Any]]:
+    """
+    Aggregates history entries per command.
+
+    Returns:
+        One row per command with its count, errors, p50, p95, p99 and total
+        duration (in seconds) and the average number of network calls.
+    """
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    network_calls = defaultdict(int)
+    for entry in entries:
+        command = entry["command"]
+        durations[command].append(entry["duration"])
+        network_calls[command] += entry["network_calls"]
+        if entry["exit_status"] != 0:
+            errors[command] += 1
+
+    summary = []
+    for command in sorted(durations):
+        values = sorted(durations[command])
+        row: dict[str, Any] = {
+            "command": command,
+            "count": len(values),
+            "errors": errors[command],
+        }
+        for percent in PERCENTILES:
+            row[f"p{percent}"] = percentile(values, percent)
+        row["sum"] = sum(values)
+        row["network_calls"] = network_calls[command] / len(values)
+        summary.append(row)
+    return summary
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def to_prometheus(summary: list[dict[str, Any]]) -> str:
+    """
+    Renders a summary in the Prometheus text exposition format.
+    """
+    lines = [
+        "# HELP fractal_cli_command_duration_seconds Fractal CLI command latency.",
+        "# TYPE fractal_cli_command_duration_seconds summary",
+    ]
+    for row in summary:
+        label = f'command="{_escape_label(row["command"])}"'
+        for percent in PERCENTILES:
+            lines.append(
+                f'fractal_cli_command_duration_seconds{{{label},quantile="{percent / 100}"}} '
+                f'{row[f"p{percent}"]:.6f}'
+            )
+        lines.append(f"fractal_cli_command_duration_seconds_sum{{{label}}} {row['sum']:.6f}")
+        lines.append(f"fractal_cli_command_duration_seconds_count{{{label}}} {row['count']}")
+
+    lines.append("# HELP fractal_cli_command_errors Fractal CLI commands that exited non-zero.")
+    lines.append("# TYPE fractal_cli_command_errors gauge")
+    for row in summary:
+        label = f'command="{_escape_label(row["command"])}"'
+        lines.append(f"fractal_cli_command_errors{{{label}}} {row['errors']}")
+
+    lines.append(
+        "# HELP fractal_cli_command_network_calls Average HTTP requests per Fractal CLI command."
+    )
+    lines.append("# TYPE fractal_cli_command_network_calls gauge")
+    for row in summary:
+        label = f'command="{_escape_label(row["command"])}"'
+        lines.append(f"fractal_cli_command_network_calls{{{label}}} {row['network_calls']:.2f}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_textfile(summary: list[dict[str, Any]], path: str) -> None:
+    """
+    Writes a summary for node_exporter's textfile collector. The file is
+    replaced atomically so the collector never reads a partial file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as file:
+        file.write(to_prometheus(summary))
+    os.replace(tmp_path, path)
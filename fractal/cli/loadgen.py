@@ -0,0 +1,182 @@
+"""
+Load generator that drives CLI flows (login, registration tokens, register)
+against a homeserver at a target concurrency or rate.
+"""
+
+import asyncio
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional
+
+from fractal.cli import trace
+from fractal.cli.history import percentile
+
+PROGRESS_INTERVAL = 0.5
+
+# set while an operation's cleanup runs, so its requests aren't counted as the operation's
+_cleaning_up: ContextVar[bool] = ContextVar("cleaning_up", default=False)
+
+
+def error_code(err: BaseException) -> str:
+    """
+    Returns a short code for a failed operation: the Matrix errcode or HTTP status
+    if the error carries one, otherwise the exception's name.
+    """
+    for attribute in ("status_code", "status"):
+        code = getattr(err, attribute, None)
+        if code:
+            return str(code)
+    message = str(err)
+    if message.startswith("M_"):
+        return message.split(" ", 1)[0].rstrip(":")
+    return type(err).__name__
+
+
+class LoadResult:
+    def __init__(self):
+        self.latencies: list[float] = []
+        # error code -> number of failed operations
+        self.errors: Counter = Counter()
+        # HTTP status (or exception name) -> number of responses
+        self.http_statuses: Counter = Counter()
+        # error code -> number of failed cleanups of succeeded operations
+        self.cleanup_errors: Counter = Counter()
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    @property
+    def completed(self) -> int:
+        return len(self.latencies) + sum(self.errors.values())
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> dict[str, Any]:
+        latencies = sorted(self.latencies)
+        summary: dict[str, Any] = {
+            "operations": self.completed,
+            "succeeded": len(latencies),
+            "failed": sum(self.errors.values()),
+            "elapsed": self.elapsed,
+            "throughput": self.throughput,
+        }
+        for percent in (50, 95, 99):
+            summary[f"p{percent}"] = percentile(latencies, percent) if latencies else None
+        return summary
+
+
+async def run_load(
+    operation: Callable[[int], Awaitable[Any]],
+    concurrency: int = 10,
+    rate: Optional[float] = None,
+    total: Optional[int] = None,
+    duration: Optional[float] = None,
+    on_progress: Optional[Callable[[LoadResult], None]] = None,
+    cleanup: Optional[Callable[[Any], Awaitable[Any]]] = None,
+) -> LoadResult:
+    """
+    Calls operation(i) until total operations completed or duration seconds passed.
+
+    Args:
+        operation: Async callable run for every operation, given its sequence number.
+        cleanup: Async callable run with the result of every succeeded operation,
+            ie to log out a session it created. It is neither timed nor counted.
+        concurrency: Maximum number of operations in flight.
+        rate: Target operations per second. Operations are started on a fixed
+            schedule (open loop) instead of as soon as a previous one finishes.
+        total: Number of operations to run.
+        duration: Seconds to generate load for.
+        on_progress: Called with the partial result every PROGRESS_INTERVAL seconds.
+    """
+    if total is None and duration is None:
+        raise ValueError("Either a total number of operations or a duration is required.")
+
+    result = LoadResult()
+    deadline = result.started + duration if duration else None
+    semaphore = asyncio.Semaphore(concurrency)
+    sequence = 0
+
+    def record_http(method: str, url: str, status: Any, elapsed: float) -> None:
+        if not _cleaning_up.get():
+            result.http_statuses[str(status)] += 1
+
+    def next_operation() -> Optional[int]:
+        nonlocal sequence
+        if total is not None and sequence >= total:
+            return None
+        if deadline is not None and time.perf_counter() >= deadline:
+            return None
+        sequence += 1
+        return sequence - 1
+
+    async def timed_operation(i: int) -> None:
+        start = time.perf_counter()
+        try:
+            value = await operation(i)
+        except Exception as err:
+            result.errors[error_code(err)] += 1
+            return
+        result.latencies.append(time.perf_counter() - start)
+
+        if cleanup:
+            # workers and open loop operations run in their own tasks, so this is never
+            # seen by operations running concurrently
+            _cleaning_up.set(True)
+            try:
+                await cleanup(value)
+            except Exception as err:
+                result.cleanup_errors[error_code(err)] += 1
+            finally:
+                _cleaning_up.set(False)
+
+    async def closed_loop_worker() -> None:
+        while (i := next_operation()) is not None:
+            await timed_operation(i)
+
+    async def limited_operation(i: int) -> None:
+        try:
+            await timed_operation(i)
+        finally:
+            semaphore.release()
+
+    async def open_loop() -> None:
+        tasks = set()
+        interval = 1 / rate  # type: ignore
+        next_start = time.perf_counter()
+        while (i := next_operation()) is not None:
+            delay = next_start - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_start += interval
+            # operations beyond the concurrency limit wait (and fall behind the target rate)
+            await semaphore.acquire()
+            task = asyncio.create_task(limited_operation(i))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def report_progress() -> None:
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            on_progress(result)  # type: ignore
+
+    trace.add_http_listener(record_http)
+    progress = asyncio.create_task(report_progress()) if on_progress else None
+    try:
+        if rate:
+            await open_loop()
+        else:
+            await asyncio.gather(*(closed_loop_worker() for _ in range(concurrency)))
+    finally:
+        result.finished = time.perf_counter()
+        trace.remove_http_listener(record_http)
+        if progress:
+            progress.cancel()
+    return result
@@ -0,0 +1,198 @@
+"""
+Memory profiling of CLI commands with tracemalloc.
+
+Enabled with `fractal --memprofile <path> ...` or by setting the
+FRACTAL_MEMPROFILE environment variable to a path. A JSON report is written to
+the path, or a summary is printed to stderr if the path is "-".
+
+Allocations are attributed to the phase they happened in: "import" (loading
+plugins), "command" (running the command, including fetching its data) and
+"render" (formatting output with display_data). For every phase the report has
+the peak traced memory, the net allocated memory, the peak RSS of the process
+at the end of the phase and the allocation sites that allocated the most.
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Any, Optional
+
+MEMPROFILE_ENV = "FRACTAL_MEMPROFILE"
+# number of allocation sites reported per phase
+TOP_SITES = 10
+
+# phase name -> accumulated statistics, None while memory profiling is disabled
+_phases: Optional[dict[str, dict[str, Any]]] = None
+_report_path: Optional[str] = None
+# phase allocations are currently attributed to, and its snapshot at the time it started
+_current: Optional[str] = None
+_current_snapshot: Optional[tracemalloc.Snapshot] = None
+_started: float = 0.0
+
+_NULL_PHASE = nullcontext()
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Returns the peak resident set size of the process in bytes, or None if the
+    platform doesn't report it.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+    )
+
+
+def _switch_phase(name: Optional[str]) -> None:
+    """
+    Ends the current phase, accumulating its statistics, and starts phase name.
+    """
+    global _current, _current_snapshot
+    snapshot = _snapshot()
+    if _current is not None and _current_snapshot is not None:
+        _, peak = tracemalloc.get_traced_memory()
+        phase = _phases.setdefault(  # type: ignore
+            _current, {"peak_traced": 0, "allocated": 0, "peak_rss": None, "sites": {}}
+        )
+        phase["peak_traced"] = max(phase["peak_traced"], peak)
+        phase["peak_rss"] = peak_rss()
+        for diff in snapshot.compare_to(_current_snapshot, "lineno"):
+            if not diff.size_diff:
+                continue
+            phase["allocated"] += diff.size_diff
+            frame = diff.traceback[0]
+            site = phase["sites"].setdefault(f"{frame.filename}:{frame.lineno}", [0, 0])
+            site[0] += diff.size_diff
+            site[1] += diff.count_diff
+    _current = name
+    _current_snapshot = snapshot
+    tracemalloc.reset_peak()
+
+
+def enable(path: str) -> None:
+    """
+    Starts tracing allocations, attributed to the "command" phase until another
+    phase starts, to be reported to path by write_report.
+    """
+    global _phases, _report_path, _started
+    _report_path = path
+    if _phases is not None:
+        return
+    _phases = {}
+    _started = time.perf_counter()
+    tracemalloc.start()
+    _switch_phase("command")
+
+
+def is_enabled() -> bool:
+    return _phases is not None
+
+
+@contextmanager
+def _phase(name: str):
+    previous = _current
+    _switch_phase(name)
+    try:
+        yield
+    finally:
+        _switch_phase(previous)
+
+
+def phase(name: str):
+    """
+    Context manager that attributes allocations to phase name while memory
+    profiling is enabled, returning to the enclosing phase afterwards.
+    """
+    if _phases is None:
+        return _NULL_PHASE
+    return _phase(name)
+
+
+def stop() -> Optional[dict[str, Any]]:
+    """
+    Stops tracing allocations.
+
+    Returns:
+        The report, or None if memory profiling is disabled.
+    """
+    global _phases, _current, _current_snapshot
+    if _phases is None:
+        return None
+    _switch_phase(None)
+    tracemalloc.stop()
+    phases = []
+    for name, stats in _phases.items():
+        sites = sorted(stats["sites"].items(), key=lambda site: site[1][0], reverse=True)
+        phases.append(
+            {
+                "phase": name,
+                "peak_traced": stats["peak_traced"],
+                "allocated": stats["allocated"],
+                "peak_rss": stats["peak_rss"],
+                "top_sites": [
+                    {"site": site, "size": size, "count": count}
+                    for site, (size, count) in sites[:TOP_SITES]
+                ],
+            }
+        )
+    report = {
+        "command": " ".join(sys.argv[1:3]),
+        "duration": time.perf_counter() - _started,
+        "peak_rss": peak_rss(),
+        "phases": phases,
+    }
+    _phases = None
+    _current = None
+    _current_snapshot = None
+    return report
+
+
+def format_summary(report: dict[str, Any]) -> str:
+    from fractal.cli.fmt import pretty_bytes
+
+    def size(num: Optional[int]) -> str:
+        return pretty_bytes(num) if num is not None else "-"
+
+    lines = [f"Memory profile of '{report['command']}' (peak RSS {size(report['peak_rss'])})"]
+    for phase in report["phases"]:
+        lines.append(
+            f"{phase['phase']}: peak traced {size(phase['peak_traced'])}, "
+            f"allocated {size(phase['allocated'])}, peak RSS {size(phase['peak_rss'])}"
+        )
+        for site in phase["top_sites"]:
+            lines.append(f"  {size(site['size']):>10} {site['count']:>8} blocks  {site['site']}")
+    return "\n".join(lines)
+
+
+def write_report(path: Optional[str] = None) -> Optional[str]:
+    """
+    Stops memory profiling and writes the report to path (defaults to the path
+    profiling was enabled with), or prints a summary to stderr if path is "-".
+
+    Returns:
+        Path the report was written to, or None if memory profiling is disabled.
+    """
+    path = path or _report_path
+    report = stop()
+    if report is None or not path:
+        return None
+    if path == "-":
+        print(format_summary(report), file=sys.stderr)
+    else:
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+    return path
@@ -0,0 +1,392 @@
+"""
+Timing probes for the network path to a Matrix homeserver, and selection of
+the fastest of several candidate homeservers.
+"""
+
+import asyncio
+import os
+import socket
+import ssl
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+from urllib.parse import urlparse
+
+import aiohttp
+from fractal.cli.trace import span
+from fractal.cli.utils import normalize_homeserver_url, read_user_data, write_user_data
+from fractal.matrix import get_homeserver_for_matrix_id
+from fractal.matrix.exceptions import InvalidMatrixIdException
+from fractal.matrix.utils import parse_matrix_id
+
+PROBE_TIMEOUT = 10
+
+# candidate homeserver urls per server name, ie edge nodes of the same homeserver
+HOMESERVERS_FILE = "homeservers.yaml"
+HOMESERVER_CANDIDATES_ENV = "FRACTAL_HOMESERVER_CANDIDATES"
+HOMESERVER_RANKING_FILE = "homeservers.ranking.yaml"
+HOMESERVER_RANKING_TTL = 3600
+
+T = TypeVar("T")
+
+
+class ProbeError(Exception):
+    pass
+
+
+async def timed(probe: Callable[[], Awaitable[Any]]) -> float:
+    """
+    Awaits probe and returns how long it took in seconds.
+    """
+    start = time.perf_counter()
+    await asyncio.wait_for(probe(), PROBE_TIMEOUT)
+    return time.perf_counter() - start
+
+
+def _host_and_port(homeserver_url: str) -> tuple[str, int, bool]:
+    parsed = urlparse(homeserver_url)
+    use_tls = parsed.scheme == "https"
+    if not parsed.hostname:
+        raise ProbeError(f"Invalid homeserver url: {homeserver_url}")
+    return parsed.hostname, parsed.port or (443 if use_tls else 80), use_tls
+
+
+async def probe_connect(homeserver_url: str) -> dict[str, float]:
+    """
+    Opens a connection to the homeserver, timing each step separately.
+
+    Returns:
+        Durations of the "dns", "tcp connect" and (for https) "tls handshake" phases.
+    """
+    host, port, use_tls = _host_and_port(homeserver_url)
+    loop = asyncio.get_running_loop()
+    timings = {}
+
+    start = time.perf_counter()
+    addresses = await asyncio.wait_for(
+        loop.getaddrinfo(host, port, type=socket.SOCK_STREAM), PROBE_TIMEOUT
+    )
+    timings["dns"] = time.perf_counter() - start
+    if not addresses:
+        raise ProbeError(f"Could not resolve {host}")
+    address = addresses[0][4]
+
+    start = time.perf_counter()
+    transport, protocol = await asyncio.wait_for(
+        loop.create_connection(asyncio.Protocol, host=address[0], port=address[1]),
+        PROBE_TIMEOUT,
+    )
+    timings["tcp connect"] = time.perf_counter() - start
+
+    try:
+        if use_tls:
+            start = time.perf_counter()
+            transport = await asyncio.wait_for(
+                loop.start_tls(
+                    transport, protocol, ssl.create_default_context(), server_hostname=host
+                ),
+                PROBE_TIMEOUT,
+            )
+            timings["tls handshake"] = time.perf_counter() - start
+    finally:
+        transport.close()
+    return timings
+
+
+async def probe_request(
+    session: aiohttp.ClientSession,
+    url: str,
+    access_token: Optional[str] = None,
+) -> float:
+    """
+    Times a GET request, raising ProbeError for non 200 responses.
+    """
+    headers = {"Authorization": f"Bearer {access_token}"} if access_token else {}
+
+    async def request():
+        async with session.get(url, headers=headers) as response:
+            await response.read()
+            if response.status != 200:
+                raise ProbeError(f"{response.status} {response.reason}")
+
+    return await timed(request)
+
+
+async def probe_discovery(matrix_id: str) -> float:
+    """
+    Times the DNS and .well-known lookup of the homeserver for a Matrix ID.
+    """
+    return await timed(lambda: get_homeserver_for_matrix_id(matrix_id))
+
+
+def _error(err: Exception) -> str:
+    return str(err) or type(err).__name__
+
+
+async def diagnose(
+    homeserver_url: str,
+    matrix_id: Optional[str] = None,
+    access_token: Optional[str] = None,
+    count: int = 3,
+) -> dict[str, dict[str, Any]]:
+    """
+    Probes every phase of the network path to a homeserver count times.
+
+    Requests are made over an already established connection, so that their
+    timings don't include the connection setup measured by the connect phases.
+
+    Returns:
+        Mapping of phase to {"timings": [...], "errors": [...]}, in path order.
+    """
+    phases: dict[str, dict[str, Any]] = {}
+
+    def record(phase: str, timing: Optional[float] = None, error: Optional[str] = None):
+        result = phases.setdefault(phase, {"timings": [], "errors": []})
+        if error is not None:
+            result["errors"].append(error)
+        else:
+            result["timings"].append(timing)
+
+    base_url = homeserver_url.rstrip("/")
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=PROBE_TIMEOUT)) as session:
+        # establish the pooled connection before timing requests over it
+        try:
+            await probe_request(session, f"{base_url}/_matrix/client/versions")
+        except Exception:
+            pass
+
+        for _ in range(count):
+            if matrix_id:
+                try:
+                    record("discovery", await probe_discovery(matrix_id))
+                except Exception as err:
+                    record("discovery", error=_error(err))
+
+            try:
+                for phase, timing in (await probe_connect(homeserver_url)).items():
+                    record(phase, timing)
+            except Exception as err:
+                record("connect", error=_error(err))
+
+            try:
+                record(
+                    "versions",
+                    await probe_request(session, f"{base_url}/_matrix/client/versions"),
+                )
+            except Exception as err:
+                record("versions", error=_error(err))
+
+            if access_token:
+                try:
+                    record(
+                        "whoami",
+                        await probe_request(
+                            session,
+                            f"{base_url}/_matrix/client/v3/account/whoami",
+                            access_token=access_token,
+                        ),
+                    )
+                except Exception as err:
+                    record("whoami", error=_error(err))
+    return phases
+
+
+def summarize_phases(phases: dict[str, dict[str, Any]]) -> list[dict[str, Any]]:
+    """
+    Returns min, median and max (in seconds) per phase.
+    """
+    summary = []
+    for phase, result in phases.items():
+        timings = result["timings"]
+        summary.append(
+            {
+                "phase": phase,
+                "min": min(timings) if timings else None,
+                "median": statistics.median(timings) if timings else None,
+                "max": max(timings) if timings else None,
+                "errors": len(result["errors"]),
+                "error": result["errors"][-1] if result["errors"] else "",
+            }
+        )
+    return summary
+
+
+def dominant_phase(summary: list[dict[str, Any]]) -> Optional[dict[str, Any]]:
+    """
+    Returns the phase with the highest median.
+    """
+    timed_phases = [row for row in summary if row["median"] is not None]
+    if not timed_phases:
+        return None
+    return max(timed_phases, key=lambda row: row["median"])
+
+
+async def probe_latency(
+    session: aiohttp.ClientSession, homeserver_url: str, samples: int = 2
+) -> Optional[float]:
+    """
+    Returns the lowest /versions round trip of a homeserver in seconds, or None
+    if it isn't healthy.
+    """
+    url = f"{homeserver_url.rstrip('/')}/_matrix/client/versions"
+    best = None
+    for _ in range(samples):
+        try:
+            timing = await probe_request(session, url)
+        except Exception:
+            return None
+        best = timing if best is None else min(best, timing)
+    return best
+
+
+async def rank_homeservers(candidates: list[str]) -> list[tuple[str, float]]:
+    """
+    Probes candidate homeservers concurrently.
+
+    Returns:
+        (homeserver_url, latency) of the healthy candidates, fastest first.
+    """
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=PROBE_TIMEOUT)) as session:
+        latencies = await asyncio.gather(
+            *(probe_latency(session, candidate) for candidate in candidates)
+        )
+    healthy = [
+        (candidate, latency)
+        for candidate, latency in zip(candidates, latencies)
+        if latency is not None
+    ]
+    return sorted(healthy, key=lambda ranked: ranked[1])
+
+
+def _env_candidates(server_name: str) -> Optional[list[str]]:
+    """
+    Returns the candidates configured for server_name in the
+    FRACTAL_HOMESERVER_CANDIDATES environment variable
+    (`server_name=url1,url2;other.server=url3`), or None if it has none.
+    """
+    for entry in os.environ.get(HOMESERVER_CANDIDATES_ENV, "").split(";"):
+        name, separator, urls = entry.partition("=")
+        if separator and name.strip() == server_name:
+            return urls.split(",")
+    return None
+
+
+def homeserver_candidates(server_name: str) -> list[str]:
+    """
+    Returns the candidate homeserver urls configured for a server name, either in
+    the FRACTAL_HOMESERVER_CANDIDATES environment variable or in HOMESERVERS_FILE
+    ({server_name: [urls]}). Candidates are only ever used for the server name they
+    are configured for, so credentials aren't sent to unrelated homeservers.
+    """
+    candidates = _env_candidates(server_name)
+    if candidates is None:
+        try:
+            configured, _ = read_user_data(HOMESERVERS_FILE)
+        except FileNotFoundError:
+            return []
+        candidates = (configured or {}).get(server_name) or []
+    return [normalize_homeserver_url(url.strip()) for url in candidates if url.strip()]
+
+
+def _server_name(matrix_id: str) -> Optional[str]:
+    try:
+        _, server_name = parse_matrix_id(matrix_id)
+    except InvalidMatrixIdException:
+        return None
+    return server_name
+
+
+def _read_rankings() -> dict[str, Any]:
+    try:
+        rankings, _ = read_user_data(HOMESERVER_RANKING_FILE)
+    except FileNotFoundError:
+        rankings = None
+    return rankings or {}
+
+
+async def ranked_homeservers(matrix_id: str) -> list[str]:
+    """
+    Ranks the candidates configured for a Matrix ID's server name by latency. The
+    ranking is cached in HOMESERVER_RANKING_FILE for HOMESERVER_RANKING_TTL seconds.
+
+    Returns:
+        Healthy candidate homeserver urls, fastest first. Empty if no candidates
+        are configured (or none of them is healthy).
+    """
+    server_name = _server_name(matrix_id)
+    if not server_name:
+        return []
+    candidates = homeserver_candidates(server_name)
+    if len(candidates) <= 1:
+        return candidates
+
+    rankings = _read_rankings()
+    cached = rankings.get(server_name)
+    if (
+        cached
+        and sorted(cached["candidates"]) == sorted(candidates)
+        and time.time() - cached["checked"] < HOMESERVER_RANKING_TTL
+        and cached["ranking"]
+    ):
+        return [ranked["homeserver_url"] for ranked in cached["ranking"]]
+
+    with span("rank homeservers", "http", server_name=server_name):
+        ranking = await rank_homeservers(candidates)
+    rankings[server_name] = {
+        "candidates": candidates,
+        "checked": time.time(),
+        "ranking": [
+            {"homeserver_url": url, "latency": round(latency, 6)} for url, latency in ranking
+        ],
+    }
+    write_user_data(rankings, HOMESERVER_RANKING_FILE)
+    return [url for url, _ in ranking]
+
+
+def forget_ranking(matrix_id: str) -> None:
+    """
+    Drops the cached ranking of a Matrix ID's server name, so that its candidates
+    are ranked again.
+    """
+    server_name = _server_name(matrix_id)
+    rankings = _read_rankings()
+    if server_name in rankings:
+        del rankings[server_name]
+        write_user_data(rankings, HOMESERVER_RANKING_FILE)
+
+
+async def fastest_homeserver(matrix_id: str) -> Optional[str]:
+    """
+    Picks the lowest latency healthy homeserver of the candidates configured for a
+    Matrix ID's server name.
+
+    Returns:
+        Fastest homeserver url, or None if no candidates are configured (or none
+        of them is healthy), in which case the homeserver should be discovered.
+    """
+    ranked = await ranked_homeservers(matrix_id)
+    return ranked[0] if ranked else None
+
+
+async def with_failover(
+    matrix_id: str,
+    homeserver_urls: list[str],
+    request: Callable[[str, bool], Awaitable[T]],
+) -> T:
+    """
+    Awaits request(homeserver_url, has_fallback) with each of homeserver_urls in
+    turn, until one of them can be connected to. After a connection error the
+    cached ranking is dropped, so that the unreachable homeserver isn't picked again.
+
+    has_fallback is False for the last homeserver url, where request should retry
+    on its own instead.
+    """
+    for index, homeserver_url in enumerate(homeserver_urls):
+        has_fallback = index < len(homeserver_urls) - 1
+        try:
+            return await request(homeserver_url, has_fallback)
+        except aiohttp.ClientConnectorError:
+            forget_ranking(matrix_id)
+            if not has_fallback:
+                raise
+    raise ProbeError("No homeserver to connect to")
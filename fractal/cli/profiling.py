@@ -0,0 +1,157 @@
+"""
+CPU profiling of a whole CLI invocation with cProfile, including plugin imports
+and the worker threads that async_to_sync runs coroutines on.
+
+Profiling is enabled with `fractal --profile <path> ...` or by setting the
+FRACTAL_PROFILE environment variable to a path. The profile is written in the
+pstats format (`python -m pstats <path>`, snakeviz), or as collapsed stacks
+for flamegraph.pl and speedscope if the path ends with .folded or .collapsed.
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+from collections import Counter, defaultdict
+from typing import Optional
+
+PROFILE_ENV = "FRACTAL_PROFILE"
+COLLAPSED_EXTENSIONS = (".folded", ".collapsed")
+# stacks deeper than this are truncated in collapsed output
+MAX_STACK_DEPTH = 200
+# stacks with less time than this (in seconds) are left out of collapsed output
+MIN_STACK_TIME = 1e-5
+
+_profiler: Optional[cProfile.Profile] = None
+_profile_path: Optional[str] = None
+# profilers of threads started while profiling
+_thread_profilers: list[cProfile.Profile] = []
+
+
+def _profile_thread(frame, event, arg) -> None:
+    """
+    Installed with threading.setprofile, so it runs once at the start of every
+    new thread and replaces itself with a profiler for that thread.
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # on Python 3.12+ the profiler already covers every thread
+        sys.setprofile(None)
+        return
+    _thread_profilers.append(profiler)
+
+
+def enable(path: str) -> None:
+    """
+    Starts profiling the current thread and every thread started from now on,
+    to be written to path by write_profile.
+    """
+    global _profiler, _profile_path
+    _profile_path = path
+    if _profiler is not None:
+        return
+    _profiler = cProfile.Profile()
+    threading.setprofile(_profile_thread)
+    _profiler.enable()
+
+
+def is_enabled() -> bool:
+    return _profiler is not None
+
+
+def stop() -> Optional[pstats.Stats]:
+    """
+    Stops profiling.
+
+    Returns:
+        Stats of the main thread merged with those of every profiled thread, or
+        None if profiling is disabled.
+    """
+    global _profiler
+    if _profiler is None:
+        return None
+    # disable first: collecting a thread's stats disables profiling on the calling thread
+    _profiler.disable()
+    threading.setprofile(None)  # type: ignore
+    stats = pstats.Stats(_profiler)
+    for profiler in _thread_profilers:
+        stats.add(profiler)
+    _profiler = None
+    _thread_profilers.clear()
+    return stats
+
+
+def _label(func: tuple[str, int, str]) -> str:
+    filename, line, name = func
+    # built-in functions have no file
+    if filename == "~":
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def collapsed_stacks(stats: pstats.Stats) -> list[str]:
+    """
+    Converts stats to collapsed stacks (`caller;callee;... microseconds`).
+
+    cProfile only records caller/callee pairs, not whole stacks, so the time of
+    a function called from several places is split between its callers' stacks
+    in proportion to the time spent under each of them.
+    """
+    entries = stats.stats  # type: ignore
+    callees: dict[tuple, list[tuple[float, tuple]]] = defaultdict(list)
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees[caller].append((cumulative, func))
+    # slowest first, so walking the callees can stop at the first one below MIN_STACK_TIME
+    for calls in callees.values():
+        calls.sort(key=lambda call: call[0], reverse=True)
+
+    folded: Counter = Counter()
+
+    def walk(func: tuple, stack: str, path: set, share: float) -> None:
+        stack = f"{stack};{_label(func)}" if stack else _label(func)
+        own_time = entries[func][2] * share
+        if own_time >= MIN_STACK_TIME:
+            folded[stack] += own_time
+        if len(path) >= MAX_STACK_DEPTH:
+            return
+        for cumulative, callee in callees[func]:
+            # time spent in callee when called from this stack
+            if cumulative * share < MIN_STACK_TIME:
+                break
+            total = entries[callee][3]
+            # skip recursion, its time is already in the outermost call
+            if callee in path or total <= 0:
+                continue
+            path.add(callee)
+            walk(callee, stack, path, min(cumulative * share / total, 1.0))
+            path.remove(callee)
+
+    for func, (_, _, _, _, callers) in entries.items():
+        if not callers:
+            walk(func, "", {func}, 1.0)
+
+    return [f"{stack} {round(seconds * 1e6)}" for stack, seconds in folded.items()]
+
+
+def write_profile(path: Optional[str] = None) -> Optional[str]:
+    """
+    Stops profiling and writes the profile to path (defaults to the path
+    profiling was enabled with).
+
+    Returns:
+        Path the profile was written to, or None if profiling is disabled.
+    """
+    path = path or _profile_path
+    stats = stop()
+    if stats is None or not path:
+        return None
+    if path.endswith(COLLAPSED_EXTENSIONS):
+        with open(path, "w") as file:
+            file.writelines(f"{line}\n" for line in collapsed_stacks(stats))
+    else:
+        stats.dump_stats(path)
+    return path
@@ -0,0 +1,272 @@
+"""
+Timed spans around the phases of CLI commands, written in the Chrome trace
+event format (open with chrome://tracing or https://ui.perfetto.dev).
+
+Tracing is enabled with `fractal --trace <path> ...` or by setting the
+FRACTAL_TRACE environment variable to a path. When disabled, spans are no-ops.
+"""
+
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Optional
+from urllib.parse import urlparse
+
+TRACE_ENV = "FRACTAL_TRACE"
+
+# recorded trace events, None while tracing is disabled
+_events: Optional[list[dict[str, Any]]] = None
+_trace_path: Optional[str] = None
+_origin_ns = time.perf_counter_ns()
+_http_instrumented = False
+# number of HTTP requests started since instrument_http, recorded in the command history
+http_request_count = 0
+# callbacks notified of every finished HTTP request, see add_http_listener
+_http_listeners: list[Callable[[str, str, Any, float], None]] = []
+
+
+def enable(path: str) -> None:
+    """
+    Starts recording spans, to be written to path by write_trace.
+    """
+    global _events, _trace_path
+    _trace_path = path
+    if _events is None:
+        _events = []
+        _event("process_name", "M", args={"name": "fractal"})
+    instrument_http()
+
+
+def is_enabled() -> bool:
+    return _events is not None
+
+
+def _event(name: str, phase: str, **fields: Any) -> None:
+    if _events is None:
+        return
+    _events.append(
+        {
+            "name": name,
+            "ph": phase,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            **fields,
+        }
+    )
+
+
+def _timestamp_us(ns: int) -> float:
+    return (ns - _origin_ns) / 1000
+
+
+def add_span(
+    name: str,
+    start_ns: int,
+    end_ns: int,
+    category: str = "cli",
+    args: Optional[dict[str, Any]] = None,
+) -> None:
+    """
+    Records a complete span from perf_counter_ns timestamps.
+    """
+    _event(
+        name,
+        "X",
+        cat=category,
+        ts=_timestamp_us(start_ns),
+        dur=(end_ns - start_ns) / 1000,
+        args=args or {},
+    )
+
+
+class _Span:
+    __slots__ = ("name", "category", "args", "start_ns")
+
+    def __init__(self, name: str, category: str, args: dict[str, Any]):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self) -> "_Span":
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        add_span(self.name, self.start_ns, time.perf_counter_ns(), self.category, self.args)
+
+
+_NULL_SPAN = nullcontext()
+
+
+def span(name: str, category: str = "cli", **args: Any):
+    """
+    Context manager that records a timed span while tracing is enabled.
+
+    with span("read_user_data", filename=filename):
+        ...
+    """
+    if _events is None:
+        return _NULL_SPAN
+    return _Span(name, category, args)
+
+
+def traced(name: Optional[str] = None, category: str = "cli") -> Callable:
+    """
+    Decorator that records a span around every call of a (async) function.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, category):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, category):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+async def _on_request_start(session, context, params) -> None:
+    global http_request_count
+    http_request_count += 1
+    context.start_ns = time.perf_counter_ns()
+
+
+async def _on_request_end(session, context, params) -> None:
+    _record_http(context, params.method, str(params.url), params.response.status)
+
+
+async def _on_request_exception(session, context, params) -> None:
+    _record_http(context, params.method, str(params.url), type(params.exception).__name__)
+
+
+async def _on_dns_start(session, context, params) -> None:
+    context.dns_start_ns = time.perf_counter_ns()
+
+
+async def _on_dns_end(session, context, params) -> None:
+    add_span(f"dns {params.host}", context.dns_start_ns, time.perf_counter_ns(), "http")
+
+
+async def _on_connection_start(session, context, params) -> None:
+    context.connection_start_ns = time.perf_counter_ns()
+
+
+async def _on_connection_end(session, context, params) -> None:
+    add_span("connect", context.connection_start_ns, time.perf_counter_ns(), "http")
+
+
+def _record_http(context, method: str, url: str, status: Any) -> None:
+    start_ns = getattr(context, "start_ns", None)
+    if start_ns is None:
+        return
+    end_ns = time.perf_counter_ns()
+    for listener in _http_listeners:
+        listener(method, url, status, (end_ns - start_ns) / 1e9)
+    parsed = urlparse(url)
+    # never record query strings, they can contain access tokens
+    add_span(
+        f"{method} {parsed.path}",
+        start_ns,
+        end_ns,
+        "http",
+        {"host": parsed.netloc, "status": status},
+    )
+
+
+def add_http_listener(listener: Callable[[str, str, Any, float], None]) -> None:
+    """
+    Calls listener(method, url, status, duration) for every finished HTTP request.
+    status is the response status, or the exception's name if the request failed.
+    """
+    instrument_http()
+    _http_listeners.append(listener)
+
+
+def remove_http_listener(listener: Callable[[str, str, Any, float], None]) -> None:
+    _http_listeners.remove(listener)
+
+
+@contextmanager
+def record_http():
+    """
+    Records (method, path, status) of every HTTP request finished inside the block.
+
+    with record_http() as requests:
+        AuthController().login(...)
+    assert len(requests) == 1
+    """
+    requests: list[tuple[str, str, Any]] = []
+
+    def record(method: str, url: str, status: Any, duration: float) -> None:
+        requests.append((method, urlparse(url).path, status))
+
+    add_http_listener(record)
+    try:
+        yield requests
+    finally:
+        remove_http_listener(record)
+
+
+def instrument_http() -> None:
+    """
+    Adds a trace config to every aiohttp ClientSession created from now on, so
+    that Matrix requests, including those made by matrix-nio and
+    fractal-matrix-client's own sessions, are counted and recorded as spans.
+    """
+    global _http_instrumented
+    if _http_instrumented:
+        return
+
+    import aiohttp
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_request_exception.append(_on_request_exception)
+    trace_config.on_dns_resolvehost_start.append(_on_dns_start)
+    trace_config.on_dns_resolvehost_end.append(_on_dns_end)
+    trace_config.on_connection_create_start.append(_on_connection_start)
+    trace_config.on_connection_create_end.append(_on_connection_end)
+
+    original_init = aiohttp.ClientSession.__init__
+
+    @functools.wraps(original_init)
+    def __init__(self, *args, trace_configs=None, **kwargs):
+        trace_configs = [*(trace_configs or []), trace_config]
+        original_init(self, *args, trace_configs=trace_configs, **kwargs)
+
+    aiohttp.ClientSession.__init__ = __init__  # type: ignore
+    _http_instrumented = True
+
+
+def write_trace(path: Optional[str] = None) -> Optional[str]:
+    """
+    Writes recorded spans to path (defaults to the path tracing was enabled with).
+
+    Returns:
+        Path the trace was written to, or None if tracing is disabled.
+    """
+    path = path or _trace_path
+    if _events is None or not path:
+        return None
+    with open(path, "w") as file:
+        json.dump({"traceEvents": _events, "displayTimeUnit": "ms"}, file)
+    return path
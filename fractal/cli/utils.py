@@ -1,25 +1,72 @@
 import json
 import os
 import re
+from contextlib import contextmanager
+from contextvars import ContextVar
 from getpass import getpass
 from os import makedirs
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Optional, Tuple
 
 import appdirs
 import yaml
+from fractal.cli import DATA_DIR_ENV
+from fractal.cli.trace import traced
 
+# default data directory, used unless overridden with use_data_dir or FRACTAL_DATA_DIR
 data_dir = appdirs.user_data_dir("fractal")
+_data_dir_override: ContextVar[Optional[str]] = ContextVar("data_dir_override", default=None)
+
+# caches whether the local database is initialized, keyed by the database file's identity
+DB_STATE_FILE = "db.state.yaml"
 
 
 class InvalidMatrixIdException(Exception):
     pass
 
 
+def normalize_homeserver_url(homeserver_url: str) -> str:
+    """
+    Ensures a homeserver url has a scheme, defaulting to https.
+    """
+    if not homeserver_url.startswith(("http://", "https://")):
+        return f"https://{homeserver_url}"
+    return homeserver_url
+
+
+def get_data_dir() -> str:
+    """
+    Returns the data directory: the one set with use_data_dir, FRACTAL_DATA_DIR
+    or the user's appdir (ie ~/.local/share/fractal), in that order.
+    """
+    return _data_dir_override.get() or os.environ.get(DATA_DIR_ENV) or data_dir
+
+
+@contextmanager
+def use_data_dir(path: str):
+    """
+    Reads and writes user data in path instead of the data directory within
+    the block (and the threads and tasks started from it).
+    """
+    token = _data_dir_override.set(path)
+    try:
+        yield path
+    finally:
+        _data_dir_override.reset(token)
+
+
+def user_data_path(filename: str) -> str:
+    """
+    Returns the path of <filename> in the data directory (see get_data_dir)
+    """
+    return os.path.join(get_data_dir(), filename)
+
+
+@traced()
 def write_user_data(data: Dict[str, Any], filename: str, format: str = "yaml") -> str:
     """
     Write data to yaml file <filename> in user's appdir (ie ~/.local/share/fractal)
     """
-    makedirs(data_dir, exist_ok=True)
+    makedirs(get_data_dir(), exist_ok=True)
 
     match format:
         case "yaml":
@@ -29,13 +76,14 @@ def write_user_data(data: Dict[str, Any], filename: str, format: str = "yaml") -
         case _:
             raise ValueError(f"Invalid format: {format}")
 
-    data_file = os.path.join(data_dir, filename)
+    data_file = user_data_path(filename)
     with open(data_file, "w") as file:
         file.write(data_to_write)
 
     return data_file
 
 
+@traced()
 def read_user_data(filename: str) -> Tuple[Dict[str, Any], str]:
     """
     Reads data from <filename> in user's appdir (ie ~/.local/share/fractal)
@@ -45,7 +93,7 @@ def read_user_data(filename: str) -> Tuple[Dict[str, Any], str]:
     Returns:
         (user_data, data_file_path): Data in file (as dict), path to file (str).
     """
-    data_file_path = os.path.join(data_dir, filename)
+    data_file_path = user_data_path(filename)
 
     try:
         with open(data_file_path, "r") as file:
@@ -59,3 +107,101 @@ def read_user_data(filename: str) -> Tuple[Dict[str, Any], str]:
         raise error
 
     return user_data, data_file_path
+
+
+def _local_project_dir() -> Optional[str]:
+    """
+    Returns the directory of the local Fractal Database project (as selected by
+    fractal-database: FRACTAL_PROJECT_NAME or the only project in projects.yaml).
+
+    Returns:
+        Project directory, or None if there is no local project.
+    """
+    project_name = os.environ.get("FRACTAL_PROJECT_NAME")
+    if not project_name:
+        try:
+            projects, _ = read_user_data("projects.yaml")
+        except FileNotFoundError:
+            return None
+        if not projects:
+            return None
+        if len(projects) > 1:
+            raise ValueError("Multiple projects found.")
+        project_name = list(projects.keys())[0]
+    return os.path.join(get_data_dir(), project_name)
+
+
+def file_identity(path: str) -> Optional[list]:
+    """
+    Returns a cheap identity for a file that changes whenever the file is written.
+
+    Returns:
+        [path, device, inode, size, mtime] or None if the file doesn't exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [path, stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def db_file_identity() -> Optional[list]:
+    """
+    Returns the file identity of the local project's sqlite database.
+
+    Returns:
+        See file_identity. None if there is no local project or database file.
+    """
+    try:
+        project_dir = _local_project_dir()
+    except (ValueError, yaml.YAMLError):
+        return None
+    if not project_dir:
+        return None
+    return file_identity(os.path.join(project_dir, "db.sqlite3"))
+
+
+def is_db_initialized_cached() -> bool:
+    """
+    Checks if the local database is initialized without setting up Django when
+    the answer is already known.
+
+    If there is no local project, the database can't be initialized and Django
+    is never imported. Otherwise the answer is cached in DB_STATE_FILE, keyed by
+    the identity (path, inode, size, mtime) of the project's sqlite file, and
+    only recomputed with fractal-database when that file changes.
+    """
+    try:
+        project_dir = _local_project_dir()
+    except (ValueError, yaml.YAMLError):
+        project_dir = ""
+
+    # a settings module in the environment can point anywhere, so don't shortcut it
+    if project_dir is None and not os.environ.get("DJANGO_SETTINGS_MODULE"):
+        return False
+
+    identity = db_file_identity() if project_dir else None
+    if identity:
+        try:
+            state, _ = read_user_data(DB_STATE_FILE)
+            if state and state.get("identity") == identity:
+                return state["initialized"]
+        except (FileNotFoundError, KeyError, yaml.YAMLError):
+            pass
+
+    from fractal_database.utils import is_db_initialized
+
+    initialized = is_db_initialized()
+    if identity:
+        write_user_data({"identity": identity, "initialized": initialized}, DB_STATE_FILE)
+    return initialized
+
+
+def refresh_db_state_cache(initialized: bool = True) -> None:
+    """
+    Updates the cached database state after writing to the database, since
+    writes change the identity of the database file.
+    """
+    identity = db_file_identity()
+    if identity:
+        write_user_data({"identity": identity, "initialized": initialized}, DB_STATE_FILE)
@@ -0,0 +1,148 @@
+"""
+Watchdog that reports blocking calls on the event loops the CLI runs coroutines
+on (asyncio.run and async_to_sync), such as docker SDK calls or prompts made
+from async code.
+
+Enabled with `fractal --loop-watchdog <seconds> ...` or by setting the
+FRACTAL_LOOP_WATCHDOG environment variable to a threshold in seconds. Every
+time a loop doesn't get to run its callbacks for longer than the threshold, the
+stack of the blocking code is printed to stderr (and recorded as a span when
+tracing is enabled).
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Optional
+
+from fractal.cli import trace
+
+WATCHDOG_ENV = "FRACTAL_LOOP_WATCHDOG"
+# seconds between checks of the monitor thread while no loop is watched
+IDLE_POLL_INTERVAL = 0.05
+
+_threshold: Optional[float] = None
+# loops being watched, removed once closed
+_watched: list["_WatchedLoop"] = []
+_lock = threading.Lock()
+_monitor: Optional[threading.Thread] = None
+_original_new_event_loop = None
+# every stall that was reported
+reports: list[dict[str, Any]] = []
+
+
+class _WatchedLoop:
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold: float):
+        self.loop = loop
+        self.threshold = threshold
+        # the loop checks in this often, a late check-in means it was blocked
+        self.interval = threshold / 2
+        self.thread_id: Optional[int] = None
+        self.last_beat = time.monotonic()
+        # stack of the blocking code, captured by the monitor thread during a stall
+        self.stall: Optional[str] = None
+
+    def beat(self) -> None:
+        now = time.monotonic()
+        # only stalls seen by the monitor thread count, a late check-in can also
+        # mean that the loop wasn't running (between run_until_complete calls)
+        if self.stall is not None:
+            self._report(now - self.last_beat - self.interval, self.stall)
+        self.thread_id = threading.get_ident()
+        self.last_beat = now
+        self.stall = None
+        self.loop.call_later(self.interval, self.beat)
+
+    def check(self) -> None:
+        """
+        Called from the monitor thread, captures the loop thread's stack while
+        the loop is blocked.
+        """
+        if self.stall is not None or self.thread_id is None or not self.loop.is_running():
+            return
+        if time.monotonic() - self.last_beat - self.interval <= self.threshold:
+            return
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is not None:
+            self.stall = "".join(traceback.format_stack(frame))
+
+    def _report(self, blocked: float, stack: str) -> None:
+        reports.append({"blocked": blocked, "stack": stack})
+        end_ns = time.perf_counter_ns()
+        trace.add_span(
+            "event loop blocked", end_ns - int(blocked * 1e9), end_ns, "loop", {"stack": stack}
+        )
+        print(
+            f"Event loop blocked for {blocked:.3f}s (threshold {self.threshold:.3f}s) at:\n"
+            f"{stack}",
+            file=sys.stderr,
+        )
+
+
+def _monitor_loops() -> None:
+    while True:
+        with _lock:
+            _watched[:] = [watched for watched in _watched if not watched.loop.is_closed()]
+            watched_loops = list(_watched)
+        for watched in watched_loops:
+            watched.check()
+        time.sleep(
+            min((watched.interval / 2 for watched in watched_loops), default=IDLE_POLL_INTERVAL)
+        )
+
+
+def watch(loop: asyncio.AbstractEventLoop, threshold: float) -> None:
+    """
+    Reports every time loop is blocked for longer than threshold seconds.
+    """
+    global _monitor
+    watched = _WatchedLoop(loop, threshold)
+    loop.call_soon(watched.beat)
+    with _lock:
+        _watched.append(watched)
+        if _monitor is None:
+            _monitor = threading.Thread(
+                target=_monitor_loops, name="fractal-loop-watchdog", daemon=True
+            )
+            _monitor.start()
+
+
+def enable(threshold: float) -> None:
+    """
+    Watches every event loop created from now on.
+    """
+    global _threshold, _original_new_event_loop
+    enabled = _threshold is not None
+    _threshold = threshold
+    if enabled:
+        return
+
+    policy = asyncio.get_event_loop_policy()
+    _original_new_event_loop = policy.new_event_loop
+
+    def new_event_loop() -> asyncio.AbstractEventLoop:
+        loop = _original_new_event_loop()  # type: ignore
+        if _threshold is not None:
+            watch(loop, _threshold)
+        return loop
+
+    policy.new_event_loop = new_event_loop  # type: ignore
+
+
+def disable() -> None:
+    """
+    Stops watching new event loops. Loops that are already watched stay watched.
+    """
+    global _threshold, _original_new_event_loop
+    if _threshold is None:
+        return
+    _threshold = None
+    # remove the wrapper set on the policy instance, uncovering the policy's own method
+    del asyncio.get_event_loop_policy().new_event_loop
+    _original_new_event_loop = None
+
+
+def is_enabled() -> bool:
+    return _threshold is not None
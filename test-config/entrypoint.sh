@@ -3,6 +3,7 @@
 # expected environment variables:
 # ENV - environment name (e.g. test, dev, prod)
 # TEST_CONFIG_DIR - path to the test-config directory
+# TEST_WORKERS - number of parallel test workers (optional, defaults to 1)
 
 set -e
 
@@ -15,4 +16,10 @@ source "$TEST_CONFIG_DIR/fractal_cli.$ENV.env"
 
 cd /code
 
-pytest -v -s --asyncio-mode=auto --cov=/code/fractal --cov-report=lcov --cov-report=term tests/
+# every worker uses the user and room provisioned for it (fractal_cli.$ENV.gw<n>.env)
+PARALLEL=""
+if [ "${TEST_WORKERS:-1}" -gt 1 ]; then
+    PARALLEL="-n $TEST_WORKERS"
+fi
+
+pytest -v -s $PARALLEL --asyncio-mode=auto --cov=/code/fractal --cov-report=lcov --cov-report=term tests/
@@ -1,8 +1,14 @@
 """
 This script is intended to be ran by the test container's entrypoint.
 
-Ensures that the provided test user exists and creates a room for testing.
-On Success, writes necessary environment variables to .env.testing.
+Ensures that a test user exists for every test worker and creates a room for
+each of them, concurrently. On Success, writes the environment variables of the
+first worker to fractal_cli.<ENV>.env and those of every worker to
+fractal_cli.<ENV>.<worker>.env, where workers are named like pytest-xdist's
+(gw0, gw1, ...).
+
+Running it again is safe: existing users are detected and their logins (from
+the worker's previous env file) are reused while they are still valid.
 """
 
 import asyncio
@@ -13,7 +19,7 @@ import docker
 from aiofiles import open
 from docker.models.containers import Container
 from fractal.matrix.async_client import FractalAsyncClient
-from nio import LoginError, RoomCreateError
+from nio import LoginError, RoomCreateError, WhoamiResponse
 
 ENV = os.environ.get("ENV", "dev")
 TEST_CONFIG_DIR = os.environ.get("TEST_CONFIG_DIR", ".")
@@ -22,10 +28,122 @@ TEST_HOMESERVER_URL = os.environ.get("TEST_HOMESERVER_URL", "http://localhost:80
 TEST_ALTERNATE_HOMESERVER_URL = os.environ.get("TEST_ALTERNATE_HOMESERVER_URL", "http://localhost:8010")
 TEST_USER_USERNAME = os.environ.get("TEST_USER_USERNAME", "admin")
 TEST_USER_PASSWORD = os.environ.get("TEST_USER_PASSWORD", "admin")
+TEST_WORKERS = int(os.environ.get("TEST_WORKERS", "1"))
 SYNAPSE_DOCKER_LABEL = os.environ.get("SYNAPSE_DOCKER_LABEL", "org.homeserver=true")
 PYTHON_BIN = os.environ.get("PYTHON_BIN", "venv/bin/python")
 
 
+def worker_env_file(worker: str) -> str:
+    return f"{TEST_CONFIG_DIR}/fractal_cli.{ENV}.{worker}.env"
+
+
+def worker_username(index: int) -> str:
+    # the first worker keeps the configured user, so single worker runs are unchanged
+    return TEST_USER_USERNAME if index == 0 else f"{TEST_USER_USERNAME}-gw{index}"
+
+
+async def read_env_file(path: str) -> dict[str, str]:
+    """
+    Reads the `export KEY="value"` lines of an env file written by this script.
+    """
+    try:
+        async with open(path) as f:
+            lines = await f.readlines()
+    except FileNotFoundError:
+        return {}
+    env = {}
+    for line in lines:
+        if line.startswith("export ") and "=" in line:
+            key, value = line[len("export ") :].strip().split("=", 1)
+            env[key] = value.strip('"')
+    return env
+
+
+async def write_env_file(path: str, env: dict[str, str]) -> None:
+    async with open(path, "w") as f:
+        await f.write("".join(f'export {key}="{value}"\n' for key, value in env.items()))
+
+
+async def register_user(synapse_container: Container, username: str) -> None:
+    """
+    Creates an admin user on synapse if it doesn't exist.
+    """
+    # the docker SDK is blocking, run it in a thread so users are created concurrently
+    result = await asyncio.to_thread(
+        synapse_container.exec_run,
+        f"register_new_matrix_user -c /data/homeserver.yaml -a -u {username} -p {TEST_USER_PASSWORD} http://localhost:8008",
+    )
+
+    if "User ID already taken" in result.output.decode("utf-8"):
+        print(f"User {username} already exists")
+    elif result.exit_code != 0:
+        raise RuntimeError(result.output.decode("utf-8"))
+
+
+async def login(username: str, previous_env: dict[str, str]) -> FractalAsyncClient:
+    """
+    Reuses the access token of the worker's previous env file if it is still
+    valid, otherwise logs in with the password.
+    """
+    access_token = previous_env.get("MATRIX_ACCESS_TOKEN")
+    if access_token and previous_env.get("MATRIX_HOMESERVER_URL") == TEST_HOMESERVER_URL:
+        matrix_client = FractalAsyncClient(TEST_HOMESERVER_URL, access_token=access_token)
+        whoami_res = await matrix_client.whoami()
+        if isinstance(whoami_res, WhoamiResponse) and whoami_res.user_id == previous_env.get(
+            "HS_USER_ID"
+        ):
+            print(f"Reusing login of {whoami_res.user_id}")
+            matrix_client.user_id = whoami_res.user_id
+            return matrix_client
+        await matrix_client.close()
+
+    matrix_client = FractalAsyncClient(TEST_HOMESERVER_URL, access_token="", user=username)
+    print(f"Logging in to homeserver: {TEST_HOMESERVER_URL} as {username}")
+    login_res = await matrix_client.login(TEST_USER_PASSWORD)
+    if isinstance(login_res, LoginError):
+        await matrix_client.close()
+        raise RuntimeError(f"Error logging in as {username}: {login_res.message}")
+    return matrix_client
+
+
+async def prepare_worker(synapse_container: Container, index: int) -> dict[str, str]:
+    """
+    Provisions the user and room of a test worker.
+
+    Returns:
+        The worker's environment variables.
+    """
+    worker = f"gw{index}"
+    username = worker_username(index)
+    await register_user(synapse_container, username)
+
+    matrix_client = await login(username, await read_env_file(worker_env_file(worker)))
+    try:
+        # disable rate limiting for the created test user
+        print(f"Disabling rate limiting for user: {matrix_client.user_id}")
+        await matrix_client.disable_ratelimiting(matrix_client.user_id)
+
+        # This always creates a new room. This is okay since we want a fresh start
+        print(f"Creating room for {worker}")
+        room_create_res = await matrix_client.room_create(name=f"Test Room {worker}")
+        if isinstance(room_create_res, RoomCreateError):
+            raise RuntimeError(f"Error creating room: {room_create_res.message}")
+    finally:
+        await matrix_client.close()
+
+    env = {
+        "HS_USER_ID": matrix_client.user_id,
+        "MATRIX_ROOM_ID": room_create_res.room_id,
+        "MATRIX_ACCESS_TOKEN": matrix_client.access_token,
+        "MATRIX_HOMESERVER_URL": TEST_HOMESERVER_URL,
+        "PYTHON_BIN": PYTHON_BIN,
+        "HS_OWNER_ID": matrix_client.user_id,
+        "HS_DEVICE_ID": matrix_client.user_id,
+    }
+    await write_env_file(worker_env_file(worker), env)
+    return env
+
+
 async def main():
     # this is blocking but doesn't matter since this is an entrypoint
     try:
@@ -41,46 +159,20 @@ async def main():
         print("Launch synapse container in /synapse")
         exit(1)
 
-    # create admin user on synapse if it doesn't exist
-    result = synapse_container.exec_run(
-        f"register_new_matrix_user -c /data/homeserver.yaml -a -u {TEST_USER_USERNAME} -p {TEST_USER_PASSWORD} http://localhost:8008"
+    results = await asyncio.gather(
+        *(prepare_worker(synapse_container, index) for index in range(TEST_WORKERS)),
+        return_exceptions=True,
     )
-
-    if "User ID already taken" not in result.output.decode("utf-8") and result.exit_code != 0:
-        print(result.output.decode("utf-8"))
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        for error in errors:
+            print(error)
         exit(1)
 
-    # login
-    matrix_client = FractalAsyncClient(
-        TEST_HOMESERVER_URL, access_token="", user=TEST_USER_USERNAME
-    )
-
-    print(f"Logging in to homeserver: {TEST_HOMESERVER_URL} as {TEST_USER_USERNAME}")
-    login_res = await matrix_client.login(TEST_USER_PASSWORD)
-    if isinstance(login_res, LoginError):
-        print(f"Error logging in: {login_res.message}")
-        exit(1)
-
-    # disable rate limiting for the created test user
-    print(f"Disabling rate limiting for user: {matrix_client.user_id}")
-    await matrix_client.disable_ratelimiting(matrix_client.user_id)
-
-    # This always creates a new room. This is okay since we want a fresh start
-    print("Creating room")
-    room_create_res = await matrix_client.room_create(name="Test Room")
-    if isinstance(room_create_res, RoomCreateError):
-        print(f"Error creating room: {room_create_res.message}")
-        exit(1)
-
-    # write environment file
-    async with open(TEST_ENV_FILE, "w") as f:
-        await f.write(
-            f'export HS_USER_ID="{matrix_client.user_id}"\nexport MATRIX_ROOM_ID="{room_create_res.room_id}"\nexport MATRIX_ACCESS_TOKEN="{matrix_client.access_token}"\nexport MATRIX_HOMESERVER_URL="{TEST_HOMESERVER_URL}"\nexport PYTHON_BIN="{PYTHON_BIN}"\nexport HS_OWNER_ID="{matrix_client.user_id}"\nexport HS_DEVICE_ID="{matrix_client.user_id}"\n'
-        )
-
-    await matrix_client.close()
+    # the first worker's environment is also the default for runs without pytest-xdist
+    await write_env_file(TEST_ENV_FILE, results[0])  # type: ignore
 
-    print("Successfully prepared")
+    print(f"Successfully prepared {TEST_WORKERS} test worker(s)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,354 @@
+"""
+In-process stand-in for the parts of a Synapse homeserver that the CLI uses.
+
+Implements .well-known discovery, /versions, password login, whoami, logout,
+token authenticated registration and the Synapse admin endpoints for
+registration tokens and ratelimit overrides. Every request can be delayed by
+an injected latency, so runs are reproducible without docker or network.
+
+    with FakeHomeserver(latency=0.01) as homeserver:
+        homeserver.add_user("admin", "admin", admin=True)
+        AuthController().login("@admin:localhost", password="admin", homeserver_url=homeserver.url)
+"""
+
+import asyncio
+import copy
+import random
+import secrets
+import threading
+from typing import Any, Optional
+
+from aiohttp import web
+
+# the registration flow offered by Synapse when registration requires a token
+REGISTRATION_FLOWS = [{"stages": ["m.login.registration_token", "m.login.dummy"]}]
+
+
+def _error(status: int, errcode: str, error: str) -> web.Response:
+    return web.json_response({"errcode": errcode, "error": error}, status=status)
+
+
+class FakeHomeserver:
+    def __init__(
+        self,
+        server_name: str = "localhost",
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            server_name: Server name of the Matrix IDs on this homeserver.
+            latency: Seconds every request is delayed by.
+            jitter: Up to this many seconds are randomly added to the latency.
+            seed: Seed for the jitter, so delays are the same on every run.
+        """
+        self.server_name = server_name
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self.url = ""
+
+        # user_id -> {"password": str, "admin": bool}
+        self.users: dict[str, dict[str, Any]] = {}
+        # access token -> user_id
+        self.access_tokens: dict[str, str] = {}
+        # registration token -> {"uses_allowed": Optional[int], "pending": int, "completed": int}
+        self.registration_tokens: dict[str, dict[str, Any]] = {}
+        # registration session -> completed stages
+        self.sessions: dict[str, list[str]] = {}
+        self.ratelimit_overrides: set[str] = set()
+        # (method, path) of every request, in order
+        self.requests: list[tuple[str, str]] = []
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def user_id(self, localpart: str) -> str:
+        return f"@{localpart}:{self.server_name}"
+
+    def add_user(self, localpart: str, password: str, admin: bool = False) -> str:
+        """
+        Creates a user, returning its Matrix ID.
+        """
+        user_id = self.user_id(localpart)
+        self.users[user_id] = {"password": password, "admin": admin}
+        return user_id
+
+    def issue_access_token(self, user_id: str) -> str:
+        """
+        Returns a new access token for an existing user, without a login request.
+        """
+        if user_id not in self.users:
+            raise KeyError(f"Unknown user: {user_id}")
+        access_token = f"syt_{secrets.token_urlsafe(24)}"
+        self.access_tokens[access_token] = user_id
+        return access_token
+
+    def create_registration_token(self, uses_allowed: Optional[int] = None) -> str:
+        token = secrets.token_urlsafe(12)
+        self.registration_tokens[token] = {
+            "uses_allowed": uses_allowed,
+            "pending": 0,
+            "completed": 0,
+        }
+        return token
+
+    def save_state(self) -> dict[str, Any]:
+        """
+        Returns a copy of the users, access tokens and registration tokens, to
+        be restored with restore_state.
+        """
+        return copy.deepcopy(
+            {
+                "users": self.users,
+                "access_tokens": self.access_tokens,
+                "registration_tokens": self.registration_tokens,
+                "ratelimit_overrides": self.ratelimit_overrides,
+            }
+        )
+
+    def restore_state(self, state: dict[str, Any]) -> None:
+        """
+        Restores a state returned by save_state, forgetting everything that
+        happened since, including registration sessions and recorded requests.
+        """
+        state = copy.deepcopy(state)
+        self.users = state["users"]
+        self.access_tokens = state["access_tokens"]
+        self.registration_tokens = state["registration_tokens"]
+        self.ratelimit_overrides = state["ratelimit_overrides"]
+        self.sessions = {}
+        self.requests = []
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        client = "/_matrix/client/{version:(r0|v3)}"
+        admin = "/_synapse/admin/v1"
+        app.router.add_get("/.well-known/matrix/client", self.well_known)
+        app.router.add_get("/_matrix/client/versions", self.versions)
+        app.router.add_post(f"{client}/login", self.login)
+        app.router.add_get(f"{client}/account/whoami", self.whoami)
+        app.router.add_post(f"{client}/logout", self.logout)
+        app.router.add_post(f"{client}/register", self.register)
+        app.router.add_post(f"{admin}/users/{{user_id}}/override_ratelimit", self.override_ratelimit)
+        app.router.add_get(f"{admin}/registration_tokens", self.list_registration_tokens)
+        app.router.add_post(f"{admin}/registration_tokens/new", self.new_registration_token)
+        app.router.add_put(f"{admin}/registration_tokens/{{token}}", self.update_registration_token)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        self.requests.append((request.method, request.path))
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        return await handler(request)
+
+    def _access_token(self, request: web.Request) -> str:
+        authorization = request.headers.get("Authorization", "")
+        if authorization.startswith("Bearer "):
+            return authorization[len("Bearer ") :]
+        return request.query.get("access_token", "")
+
+    def _authenticated_user(self, request: web.Request) -> Optional[str]:
+        return self.access_tokens.get(self._access_token(request))
+
+    def _admin_user(self, request: web.Request) -> tuple[Optional[str], Optional[web.Response]]:
+        user_id = self._authenticated_user(request)
+        if not user_id:
+            return None, _error(401, "M_UNKNOWN_TOKEN", "Invalid access token passed.")
+        if not self.users[user_id]["admin"]:
+            return None, _error(403, "M_FORBIDDEN", "You are not a server admin")
+        return user_id, None
+
+    async def well_known(self, request: web.Request) -> web.Response:
+        return web.json_response({"m.homeserver": {"base_url": self.url}})
+
+    async def versions(self, request: web.Request) -> web.Response:
+        return web.json_response({"versions": ["r0.6.1", "v1.1", "v1.2", "v1.3"]})
+
+    async def login(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get("type") != "m.login.password":
+            return _error(400, "M_UNKNOWN", "Unknown login type")
+        user = body.get("identifier", {}).get("user") or body.get("user", "")
+        user_id = user if user.startswith("@") else self.user_id(user)
+        account = self.users.get(user_id)
+        if not account or account["password"] != body.get("password"):
+            return _error(403, "M_FORBIDDEN", "Invalid username or password")
+        return web.json_response(
+            {
+                "user_id": user_id,
+                "access_token": self.issue_access_token(user_id),
+                "device_id": secrets.token_hex(5).upper(),
+            }
+        )
+
+    async def whoami(self, request: web.Request) -> web.Response:
+        user_id = self._authenticated_user(request)
+        if not user_id:
+            return _error(401, "M_UNKNOWN_TOKEN", "Invalid access token passed.")
+        return web.json_response({"user_id": user_id, "is_guest": False})
+
+    async def logout(self, request: web.Request) -> web.Response:
+        if not self._authenticated_user(request):
+            return _error(401, "M_UNKNOWN_TOKEN", "Invalid access token passed.")
+        del self.access_tokens[self._access_token(request)]
+        return web.json_response({})
+
+    async def register(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        auth = body.get("auth") or {}
+        session = auth.get("session")
+
+        if not session or session not in self.sessions:
+            # start of user interactive authentication
+            session = secrets.token_urlsafe(16)
+            self.sessions[session] = []
+            return self._registration_flows(session)
+
+        completed = self.sessions[session]
+        if auth.get("type") == "m.login.registration_token":
+            token = self.registration_tokens.get(auth.get("token", ""))
+            if not token or (
+                token["uses_allowed"] is not None
+                and token["pending"] + token["completed"] >= token["uses_allowed"]
+            ):
+                return _error(401, "M_UNAUTHORIZED", "Invalid registration token")
+            token["pending"] += 1
+            completed.append(f"m.login.registration_token:{auth['token']}")
+            return self._registration_flows(session)
+
+        token_stage = next(
+            (stage for stage in completed if stage.startswith("m.login.registration_token:")),
+            None,
+        )
+        if auth.get("type") != "m.login.dummy" or not token_stage:
+            return self._registration_flows(session)
+
+        user_id = self.user_id(body["username"].lower())
+        if user_id in self.users:
+            return _error(400, "M_USER_IN_USE", "User ID already taken.")
+
+        token = self.registration_tokens[token_stage.split(":", 1)[1]]
+        token["pending"] -= 1
+        token["completed"] += 1
+        del self.sessions[session]
+        self.add_user(body["username"].lower(), body.get("password", ""))
+        return web.json_response(
+            {
+                "user_id": user_id,
+                "access_token": self.issue_access_token(user_id),
+                "device_id": secrets.token_hex(5).upper(),
+            }
+        )
+
+    def _registration_flows(self, session: str) -> web.Response:
+        completed = [stage.split(":", 1)[0] for stage in self.sessions[session]]
+        return web.json_response(
+            {
+                "flows": REGISTRATION_FLOWS,
+                "params": {},
+                "session": session,
+                "completed": completed,
+            },
+            status=401,
+        )
+
+    async def override_ratelimit(self, request: web.Request) -> web.Response:
+        _, error = self._admin_user(request)
+        if error:
+            return error
+        self.ratelimit_overrides.add(request.match_info["user_id"])
+        return web.json_response({"messages_per_second": 0, "burst_count": 0})
+
+    def _registration_token_info(self, token: str) -> dict[str, Any]:
+        return {"token": token, "expiry_time": None, **self.registration_tokens[token]}
+
+    async def list_registration_tokens(self, request: web.Request) -> web.Response:
+        _, error = self._admin_user(request)
+        if error:
+            return error
+        return web.json_response(
+            {
+                "registration_tokens": [
+                    self._registration_token_info(token) for token in self.registration_tokens
+                ]
+            }
+        )
+
+    async def new_registration_token(self, request: web.Request) -> web.Response:
+        _, error = self._admin_user(request)
+        if error:
+            return error
+        body = await request.json()
+        token = self.create_registration_token(uses_allowed=body.get("uses_allowed"))
+        return web.json_response(self._registration_token_info(token))
+
+    async def update_registration_token(self, request: web.Request) -> web.Response:
+        _, error = self._admin_user(request)
+        if error:
+            return error
+        token = request.match_info["token"]
+        if token not in self.registration_tokens:
+            return _error(404, "M_NOT_FOUND", "No such registration token")
+        body = await request.json()
+        if "uses_allowed" in body:
+            self.registration_tokens[token]["uses_allowed"] = body["uses_allowed"]
+        return web.json_response(self._registration_token_info(token))
+
+    async def start_async(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Starts serving on the running event loop.
+
+        Returns:
+            Url of the homeserver.
+        """
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]  # type: ignore
+        self.url = f"http://{host}:{bound_port}"
+        return self.url
+
+    async def stop_async(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Starts serving on a background thread, so that blocking code (such as CLI
+        commands that call asyncio.run or async_to_sync) can reach the homeserver.
+
+        Returns:
+            Url of the homeserver.
+        """
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self.start_async(host, port))
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="fake-homeserver", daemon=True
+        )
+        self._thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        if not self._loop:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop_async(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread:
+            self._thread.join()
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+
+    def __enter__(self) -> "FakeHomeserver":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
@@ -1,17 +1,26 @@
 import os
+import sys
+from contextlib import nullcontext
+from copy import copy
+from datetime import datetime, timedelta, timezone
+from itertools import count
 from hashlib import sha256
+from types import ModuleType
 from unittest.mock import AsyncMock, MagicMock, patch
+from uuid import uuid4
 
 import pytest
 from asgiref.sync import async_to_sync
+from django.utils import timezone as django_timezone
 from fractal.cli import FRACTAL_DATA_DIR
 from fractal.cli.controllers.auth import (
     AuthController,
     LoginError,
     MatrixLoginError,
     WhoamiError,
+    save_matrix_credentials,
 )
-from fractal.cli.utils import read_user_data
+from fractal.cli.utils import file_identity, read_user_data, user_data_path, write_user_data
 from fractal.matrix.utils import parse_matrix_id
 
 
@@ -631,3 +640,380 @@ def test_authcontroller_show_key_cases(test_homeserver_url):
     # non-matching case
     key = "invalid_key"
     assert auth_cntrl.show(key) == None
+
+
+def test_authcontroller_login_saves_credentials_when_db_initialized():
+    """
+    Tests that login upserts the credentials into the local database only when the
+    database is initialized.
+    """
+
+    # create an AuthController object and login variables
+    auth_cntrl = AuthController()
+    matrix_id = "@admin:localhost"
+    homeserver_url = "localhost:8008"
+    access_token = "test token"
+
+    with patch(
+        "fractal.cli.controllers.auth.AuthController._login_with_access_token",
+        new_callable=AsyncMock,
+    ) as mock_login_with_access_token:
+        mock_login_with_access_token.return_value = (matrix_id, homeserver_url, access_token)
+        with patch("fractal.cli.controllers.auth.save_matrix_credentials") as mock_save:
+            # database isn't initialized
+            with patch(
+                "fractal.cli.controllers.auth.is_db_initialized_cached", return_value=False
+            ):
+                auth_cntrl.login(
+                    matrix_id, homeserver_url=homeserver_url, access_token=access_token
+                )
+            mock_save.assert_not_called()
+
+            # database is initialized
+            with patch(
+                "fractal.cli.controllers.auth.is_db_initialized_cached", return_value=True
+            ):
+                auth_cntrl.login(
+                    matrix_id, homeserver_url=homeserver_url, access_token=access_token
+                )
+            mock_save.assert_called_once_with([(matrix_id, homeserver_url, access_token)])
+
+
+def test_authcontroller_sync_skipped_without_database():
+    """
+    Tests that sync does nothing when the local database isn't initialized.
+    """
+
+    auth_cntrl = AuthController()
+
+    with patch(
+        "fractal.cli.controllers.auth.is_db_initialized_cached", return_value=False
+    ) as mock_initialized:
+        assert auth_cntrl.sync(silent=True) == "skipped"
+
+    mock_initialized.assert_called_once()
+
+
+def test_authcontroller_sync_unchanged_is_cheap():
+    """
+    Tests that sync returns without checking the database when neither the token file
+    nor the database file changed since the last sync.
+    """
+
+    auth_cntrl = AuthController()
+    db_identity = ["db.sqlite3", 1, 2, 3, 4]
+
+    # record a sync state matching the current files
+    write_user_data(
+        {"matrix_id": "@admin:localhost", "homeserver_url": "test", "access_token": "test"},
+        auth_cntrl.TOKEN_FILE,
+    )
+    write_user_data(
+        {
+            "file": file_identity(user_data_path(auth_cntrl.TOKEN_FILE)),
+            "db": db_identity,
+        },
+        auth_cntrl.SYNC_STATE_FILE,
+    )
+
+    with patch("fractal.cli.controllers.auth.db_file_identity", return_value=db_identity):
+        with patch("fractal.cli.controllers.auth.is_db_initialized_cached") as mock_initialized:
+            assert auth_cntrl.sync(silent=True) == "unchanged"
+
+    mock_initialized.assert_not_called()
+
+
+def test_authcontroller_sync_invalid_direction():
+    """
+    Tests that a SystemExit exception is raised for an invalid sync direction.
+    """
+
+    auth_cntrl = AuthController()
+
+    with pytest.raises(SystemExit):
+        auth_cntrl.sync(direction="sideways")
+
+
+class _FakeQuerySet:
+    """
+    Just enough of a Django QuerySet for save_matrix_credentials and sync.
+    """
+
+    def __init__(self, model, records):
+        self.model = model
+        self.records = records
+
+    @staticmethod
+    def _matches(record, lookup, value):
+        *path, last = lookup.split("__")
+        if last != "in":
+            path.append(last)
+        for attr in path:
+            record = getattr(record, attr)
+        return record in value if last == "in" else record == value
+
+    def filter(self, **lookups):
+        return _FakeQuerySet(
+            self.model,
+            [
+                record
+                for record in self.records
+                if all(self._matches(record, lookup, value) for lookup, value in lookups.items())
+            ],
+        )
+
+    def select_related(self, *fields):
+        return self
+
+    def order_by(self, field):
+        attr = field.lstrip("-")
+        return _FakeQuerySet(
+            self.model,
+            sorted(self.records, key=lambda record: getattr(record, attr), reverse=field.startswith("-")),
+        )
+
+    def first(self):
+        return next(iter(self), None)
+
+    def delete(self):
+        pks = {record.pk for record in self.records}
+        self.model.rows[:] = [row for row in self.model.rows if row.pk not in pks]
+
+    def __iter__(self):
+        # like the database, queries return copies of the stored rows
+        return (copy(record) for record in self.records)
+
+
+class _FakeManager:
+    def __init__(self, model):
+        self.model = model
+
+    def filter(self, **lookups):
+        return _FakeQuerySet(self.model, self.model.rows).filter(**lookups)
+
+    def select_related(self, *fields):
+        return _FakeQuerySet(self.model, self.model.rows)
+
+    def bulk_create(self, objs):
+        for obj in objs:
+            # auto_now fields are set on insert
+            obj.date_modified = django_timezone.now()
+            self.model.rows.append(copy(obj))
+
+    def bulk_update(self, objs, fields):
+        rows = {row.pk: row for row in self.model.rows}
+        for obj in objs:
+            for field in fields:
+                setattr(rows[obj.pk], field, getattr(obj, field))
+
+
+class _FakeModel:
+    rows: list
+
+    def __init__(self, **fields):
+        # primary keys are UUIDs, so they don't order rows by insertion
+        self.pk = uuid4()
+        self.date_modified = None
+        self.__dict__.update(fields)
+
+
+@pytest.fixture
+def fake_matrix_models():
+    """
+    Replaces the fractal_database_matrix models with in-memory fakes, so the
+    credentials queries run without a Django project.
+    """
+
+    class MatrixHomeserver(_FakeModel):
+        rows = []
+
+    class MatrixCredentials(_FakeModel):
+        rows = []
+
+    MatrixHomeserver.objects = _FakeManager(MatrixHomeserver)  # type: ignore
+    MatrixCredentials.objects = _FakeManager(MatrixCredentials)  # type: ignore
+    models = ModuleType("fractal_database_matrix.models")
+    models.MatrixHomeserver = MatrixHomeserver  # type: ignore
+    models.MatrixCredentials = MatrixCredentials  # type: ignore
+    # a clock that always moves forward, since there are no settings for django's
+    seconds = count()
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    with patch.dict(sys.modules, {"fractal_database_matrix.models": models}), patch(
+        "django.db.transaction.atomic", return_value=nullcontext()
+    ), patch(
+        "django.utils.timezone.now", side_effect=lambda: start + timedelta(seconds=next(seconds))
+    ):
+        yield models
+
+
+def _stored_credentials(models):
+    return sorted(
+        (creds.matrix_id, creds.homeserver.url, creds.access_token)
+        for creds in models.MatrixCredentials.rows
+    )
+
+
+def test_save_matrix_credentials_inserts(fake_matrix_models):
+    """
+    Tests that new credentials are created along with their homeserver.
+    """
+
+    save_matrix_credentials([("@admin:localhost", "http://localhost:8008", "token")])
+
+    assert _stored_credentials(fake_matrix_models) == [
+        ("@admin:localhost", "http://localhost:8008", "token")
+    ]
+    assert [hs.url for hs in fake_matrix_models.MatrixHomeserver.rows] == ["http://localhost:8008"]
+
+
+def test_save_matrix_credentials_updates_existing(fake_matrix_models):
+    """
+    Tests that logging in again updates the access token and modification date of
+    the existing row instead of inserting another one.
+    """
+
+    save_matrix_credentials([("@admin:localhost", "http://localhost:8008", "old token")])
+    created = fake_matrix_models.MatrixCredentials.rows[0].date_modified
+
+    save_matrix_credentials([("@admin:localhost", "http://localhost:8008", "new token")])
+
+    assert _stored_credentials(fake_matrix_models) == [
+        ("@admin:localhost", "http://localhost:8008", "new token")
+    ]
+    assert fake_matrix_models.MatrixCredentials.rows[0].date_modified > created
+    assert len(fake_matrix_models.MatrixHomeserver.rows) == 1
+
+
+def test_save_matrix_credentials_keeps_duplicates(fake_matrix_models):
+    """
+    Tests that only the most recently written duplicate row is updated and the
+    older rows left behind by previous logins are kept.
+    """
+
+    homeserver = fake_matrix_models.MatrixHomeserver(url="http://localhost:8008")
+    fake_matrix_models.MatrixHomeserver.rows.append(homeserver)
+    now = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    for minutes, token in [(2, "older"), (0, "latest"), (1, "old")]:
+        fake_matrix_models.MatrixCredentials.rows.append(
+            fake_matrix_models.MatrixCredentials(
+                matrix_id="@admin:localhost",
+                homeserver=homeserver,
+                access_token=token,
+                date_modified=now - timedelta(minutes=minutes),
+            )
+        )
+    latest_pk = fake_matrix_models.MatrixCredentials.rows[1].pk
+
+    save_matrix_credentials(
+        [
+            ("@admin:localhost", "http://localhost:8008", "token"),
+            ("@other:localhost", "http://localhost:8008", "other token"),
+        ]
+    )
+
+    assert _stored_credentials(fake_matrix_models) == [
+        ("@admin:localhost", "http://localhost:8008", "old"),
+        ("@admin:localhost", "http://localhost:8008", "older"),
+        ("@admin:localhost", "http://localhost:8008", "token"),
+        ("@other:localhost", "http://localhost:8008", "other token"),
+    ]
+    tokens = {creds.pk: creds.access_token for creds in fake_matrix_models.MatrixCredentials.rows}
+    assert tokens[latest_pk] == "token"
+
+
+@pytest.fixture
+def sync_db(fake_matrix_models):
+    """
+    Initialized database for sync, whose file identity changes on every call so
+    sync never takes the unchanged shortcut.
+    """
+    identities = count()
+    with patch("fractal.cli.controllers.auth.is_db_initialized_cached", return_value=True), patch(
+        "fractal.cli.controllers.auth.db_file_identity",
+        side_effect=lambda: ["db.sqlite3", next(identities)],
+    ):
+        yield fake_matrix_models
+
+
+def _write_token_file(access_token: str, matrix_id: str = "@admin:localhost") -> None:
+    write_user_data(
+        {
+            "access_token": access_token,
+            "homeserver_url": "http://localhost:8008",
+            "matrix_id": matrix_id,
+        },
+        AuthController.TOKEN_FILE,
+    )
+
+
+def test_authcontroller_sync_pushes_file_to_database(sync_db):
+    """
+    Tests that credentials only in the token file are pushed to the database.
+    """
+
+    _write_token_file("token")
+
+    assert AuthController().sync(silent=True) == "pushed"
+    assert _stored_credentials(sync_db) == [("@admin:localhost", "http://localhost:8008", "token")]
+
+    # nothing changed since
+    assert AuthController().sync(silent=True) == "unchanged"
+
+
+def test_authcontroller_sync_pulls_database_to_file(sync_db):
+    """
+    Tests that credentials changed in the database are pulled into the token file.
+    """
+
+    _write_token_file("token")
+    AuthController().sync(silent=True)
+    save_matrix_credentials([("@admin:localhost", "http://localhost:8008", "new token")])
+
+    assert AuthController().sync(silent=True) == "pulled"
+    data, _ = read_user_data(AuthController.TOKEN_FILE)
+    assert data["access_token"] == "new token"
+
+
+def test_authcontroller_sync_pulls_latest_credentials_when_logged_out(sync_db):
+    """
+    Tests that the most recently written credentials are pulled when there is no token file.
+    """
+
+    save_matrix_credentials([("@latest:localhost", "http://localhost:8008", "latest token")])
+    save_matrix_credentials([("@older:localhost", "http://localhost:8008", "older token")])
+    # the row with the highest (UUID) primary key isn't necessarily the latest
+    latest, older = sorted(sync_db.MatrixCredentials.rows, key=lambda creds: creds.matrix_id)
+    latest.date_modified, older.date_modified = older.date_modified, latest.date_modified
+
+    assert AuthController().sync(direction="pull", silent=True) == "pulled"
+    data, _ = read_user_data(AuthController.TOKEN_FILE)
+    assert data["matrix_id"] == "@latest:localhost"
+
+
+@pytest.mark.parametrize("file_is_newer", [True, False])
+def test_authcontroller_sync_conflict_most_recent_wins(sync_db, file_is_newer):
+    """
+    Tests that when both the token file and the database changed since the last
+    sync, the most recently written side wins.
+    """
+
+    _write_token_file("token")
+    AuthController().sync(silent=True)
+
+    # both sides change, one minute apart
+    _write_token_file("file token")
+    save_matrix_credentials([("@admin:localhost", "http://localhost:8008", "db token")])
+    db_modified = sync_db.MatrixCredentials.rows[0].date_modified
+    file_modified = db_modified + timedelta(minutes=1 if file_is_newer else -1)
+    os.utime(
+        user_data_path(AuthController.TOKEN_FILE),
+        (file_modified.timestamp(), file_modified.timestamp()),
+    )
+
+    result = AuthController().sync(silent=True)
+
+    data, _ = read_user_data(AuthController.TOKEN_FILE)
+    winner = "file token" if file_is_newer else "db token"
+    assert result == ("pushed" if file_is_newer else "pulled")
+    assert data["access_token"] == winner
+    assert _stored_credentials(sync_db) == [("@admin:localhost", "http://localhost:8008", winner)]
@@ -0,0 +1,169 @@
+import asyncio
+
+import pytest
+from fractal.cli.controllers.auth import AuthController
+from fractal.cli.controllers.bench import BenchController
+from fractal.cli.loadgen import error_code, run_load
+
+
+def test_bench_run_load_total_and_concurrency():
+    """
+    Tests that run_load runs the given number of operations with at most the
+    given concurrency and counts failed operations by error.
+    """
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def operation(i):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.001)
+        in_flight -= 1
+        if i % 5 == 0:
+            raise ValueError("boom")
+
+    result = asyncio.run(run_load(operation, concurrency=4, total=20))
+
+    assert result.completed == 20
+    assert len(result.latencies) == 16
+    assert result.errors == {"ValueError": 4}
+    assert max_in_flight == 4
+    assert result.summary()["p50"] is not None
+
+
+def test_bench_run_load_rate():
+    """
+    Tests that run_load starts operations in order at the given rate.
+    """
+
+    started = []
+
+    async def operation(i):
+        started.append(i)
+
+    result = asyncio.run(run_load(operation, concurrency=2, rate=200, total=10))
+
+    assert started == list(range(10))
+    # 10 operations at 200/s are spread over at least 45ms
+    assert result.elapsed >= 0.045
+
+
+def test_bench_run_load_requires_a_limit():
+    """
+    Tests that run_load raises a ValueError when neither a total nor a duration
+    is given.
+    """
+
+    async def operation(i):
+        pass
+
+    with pytest.raises(ValueError):
+        asyncio.run(run_load(operation))
+
+
+def test_bench_error_code():
+    """
+    Tests that errors are reported by HTTP status, Matrix error code or
+    exception type, in that order.
+    """
+
+    class HttpError(Exception):
+        status_code = 429
+
+    assert error_code(HttpError()) == "429"
+    assert error_code(Exception("M_FORBIDDEN: nope")) == "M_FORBIDDEN"
+    assert error_code(KeyError("x")) == "KeyError"
+
+
+def test_bench_run_load_cleanup():
+    """
+    Tests that run_load cleans up after every succeeded operation and counts
+    cleanup failures separately.
+    """
+
+    cleaned_up = []
+
+    async def operation(i):
+        if i == 3:
+            raise ValueError("boom")
+        return i
+
+    async def cleanup(i):
+        cleaned_up.append(i)
+        if i == 4:
+            raise KeyError("x")
+
+    result = asyncio.run(run_load(operation, concurrency=2, total=6, cleanup=cleanup))
+
+    # only succeeded operations are cleaned up, and cleanup failures don't fail them
+    assert sorted(cleaned_up) == [0, 1, 2, 4, 5]
+    assert len(result.latencies) == 5
+    assert result.errors == {"ValueError": 1}
+    assert result.cleanup_errors == {"KeyError": 1}
+
+
+def test_bench_login(fake_homeserver):
+    """
+    Tests that bench login reports the logins and logs out every session it
+    created without counting the logouts.
+    """
+
+    sessions_before = len(fake_homeserver.access_tokens)
+    summary = BenchController().login(
+        matrix_id="@admin:localhost",
+        password="admin",
+        homeserver_url=fake_homeserver.url,
+        concurrency="3",
+        count="9",
+        format="json",
+    )
+
+    assert summary["succeeded"] == 9
+    # the logouts after every login aren't counted
+    assert summary["http_statuses"] == {"200": 9}
+    assert summary["cleanup_errors"] == {}
+    assert [path.rsplit("/", 1)[-1] for _, path in fake_homeserver.requests].count("logout") == 9
+    # every session the benchmark created was logged out
+    assert len(fake_homeserver.access_tokens) == sessions_before
+
+
+def test_bench_login_reports_failures(fake_homeserver):
+    """
+    Tests that bench login reports failed logins by HTTP status and error.
+    """
+
+    summary = BenchController().login(
+        matrix_id="@admin:localhost",
+        password="wrong",
+        homeserver_url=fake_homeserver.url,
+        count="3",
+        format="json",
+    )
+
+    assert summary["failed"] == 3
+    assert summary["http_statuses"] == {"403": 3}
+    assert summary["errors"] == {"MatrixLoginError": 3}
+
+
+def test_bench_token_and_register(fake_homeserver):
+    """
+    Tests that bench token and bench register create the given number of
+    registration tokens and users.
+    """
+
+    AuthController().login(
+        "@admin:localhost", password="admin", homeserver_url=fake_homeserver.url, silent=True
+    )
+
+    tokens_before = len(fake_homeserver.registration_tokens)
+    users_before = len(fake_homeserver.users)
+
+    summary = BenchController().token(count="5", format="json")
+    assert summary["succeeded"] == 5
+    assert len(fake_homeserver.registration_tokens) == tokens_before + 5
+
+    summary = BenchController().register(count="4", concurrency="2", format="json")
+    assert summary["succeeded"] == 4
+    assert len(fake_homeserver.users) == users_before + 4
@@ -0,0 +1,382 @@
+import json
+import subprocess
+import sys
+from unittest.mock import patch
+
+import pytest
+from fractal.cli.fmt import (
+    KEYS_TO_EXCLUDE,
+    _ColumnPlan,
+    _WatchTable,
+    _pretty_link,
+    display_data,
+    infer_schema,
+    json_to_table,
+    print_json,
+    print_json_to_table,
+    query_rows,
+)
+
+
+def _devices(count: int):
+    for i in range(count):
+        yield {"name": f"device-{i}", "health": "green", "size": 1024 * i}
+
+
+def test_fmt_json_to_table_accepts_generator():
+    """
+    Tests that json_to_table builds a table from a generator of rows.
+    """
+
+    table = json_to_table("Devices", _devices(3))
+
+    assert [column.header for column in table.columns] == ["name", "health", "size"]
+    assert table.row_count == 3
+
+
+def test_fmt_json_to_table_empty_data():
+    """
+    Tests that an empty table is returned when there are no rows.
+    """
+
+    table = json_to_table("Devices", [])
+
+    assert table.row_count == 0
+
+
+def test_fmt_print_json_to_table_streams_chunks():
+    """
+    Tests that rows are consumed and rendered chunk by chunk instead of all at once.
+    """
+
+    consumed = []
+
+    def rows():
+        for row in _devices(5):
+            consumed.append(row)
+            yield row
+
+    # record how many rows were consumed whenever a table is printed
+    printed = []
+    with patch("rich.console.Console.print", autospec=True) as mock_print:
+        mock_print.side_effect = lambda _, table: printed.append((len(consumed), table.row_count))
+        print_json_to_table("Devices", rows(), chunk_size=2)
+
+    # each table is printed before the following rows are consumed
+    assert printed == [(2, 2), (4, 2), (5, 1)]
+
+
+def test_fmt_display_data_async_iterator(capsys):
+    """
+    Tests that display_data renders rows from an async iterator.
+    """
+
+    async def rows():
+        for row in _devices(2):
+            yield row
+
+    display_data(rows(), format="json")
+
+    assert len(json.loads(capsys.readouterr().out)) == 2
+
+
+@pytest.mark.parametrize("fast_encoder", [True, False])
+def test_fmt_display_data_ndjson(capsys, fast_encoder):
+    """
+    Tests that ndjson output has one compact record per line with and without orjson.
+    """
+
+    rows = list(_devices(3))
+
+    if fast_encoder:
+        pytest.importorskip("orjson")
+        display_data(iter(rows), format="ndjson")
+    else:
+        with patch("fractal.cli.fmt.orjson", None):
+            display_data(iter(rows), format="ndjson")
+
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(line) for line in lines] == rows
+    assert all(": " not in line and ", " not in line for line in lines)
+
+
+@pytest.mark.parametrize("indent", [4, 0])
+def test_fmt_print_json_streams_iterators(capsys, indent):
+    """
+    Tests that printing an iterator produces the same JSON as printing a list.
+    """
+
+    rows = list(_devices(3))
+
+    print_json(rows, indent=indent)
+    expected = capsys.readouterr().out
+
+    print_json(iter(rows), indent=indent)
+    assert capsys.readouterr().out == expected
+
+
+def test_fmt_column_plan_excludes_and_dispatches_renderers():
+    """
+    Tests that the column plan drops excluded keys and picks a renderer per column.
+    """
+
+    keys = ["name", KEYS_TO_EXCLUDE[0], "links", "size", "secret", "health"]
+    plan = _ColumnPlan(keys, exclude=["secret"])
+
+    assert plan.columns == ("name", "links", "size", "health")
+    assert {KEYS_TO_EXCLUDE[0], "secret"} <= plan.excluded
+    assert plan.renderers[:2] == (str, _pretty_link)
+
+    row = {
+        "health": "green",
+        "size": "2048",
+        "links": {"default": {"domain": "example.com"}},
+        "name": 1,
+    }
+    name, link, size, health = plan.render_row(row)
+    assert (name, link, size) == ("1", "https://example.com", "2.0 KiB")
+    assert health.plain == "green"
+
+
+def test_fmt_column_plan_single_column():
+    """
+    Tests that a plan with a single column renders rows as a single cell.
+    """
+
+    plan = _ColumnPlan(["name", "owner"])
+
+    assert plan.render_row({"name": "device", "owner": "admin"}) == ["device"]
+
+
+def test_fmt_display_data_plain_when_not_a_terminal(capsys):
+    """
+    Tests that tables are written as aligned plain text when stdout is not a terminal.
+    """
+
+    display_data(list(_devices(2)), title="Devices", exclude=["size"])
+
+    assert capsys.readouterr().out.splitlines() == [
+        "name      health",
+        "device-0  green",
+        "device-1  green",
+    ]
+
+
+def test_fmt_display_data_tsv_and_csv(capsys):
+    """
+    Tests that tsv output escapes separators and csv output quotes them.
+    """
+
+    rows = [{"name": "tab\there", "note": "a,b"}]
+
+    display_data(rows, format="tsv")
+    assert capsys.readouterr().out == "name\tnote\ntab\\there\ta,b\n"
+
+    display_data(rows, format="csv")
+    assert capsys.readouterr().out == 'name,note\ntab\there,"a,b"\n'
+
+
+def test_fmt_plain_output_does_not_import_rich():
+    """
+    Tests that plain and json output never import rich.
+    """
+
+    code = (
+        "import sys\n"
+        "from fractal.cli.fmt import display_data\n"
+        "display_data([{'name': 'device', 'health': 'green'}], format='tsv')\n"
+        "display_data([{'name': 'device', 'health': 'green'}], format='json')\n"
+        "assert 'rich' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True, capture_output=True)
+
+
+def test_fmt_query_rows_filter_sort_limit_project():
+    """
+    Tests that rows are filtered, sorted, limited and projected.
+    """
+
+    rows = [
+        {"name": "a", "health": "green", "size": 3},
+        {"name": "b", "health": "red", "size": 1},
+        {"name": "c", "health": "green", "size": 2},
+        {"name": "d", "health": "green"},
+    ]
+
+    result = query_rows(iter(rows), fields="name", where="health=green", sort="size", limit=2)
+    assert list(result) == [{"name": "c"}, {"name": "a"}]
+
+    # descending sort, negated condition and rows missing the sort key
+    result = query_rows(rows, where=["health!=red"], sort="-size")
+    assert [row["name"] for row in result] == ["a", "c", "d"]
+
+    result = query_rows(rows, limit="1")
+    assert list(result) == rows[:1]
+
+
+def test_fmt_query_rows_top_k_uses_bounded_heap():
+    """
+    Tests that sort with limit selects rows with a bounded heap instead of sorting.
+    """
+
+    with patch("fractal.cli.fmt.sorted") as mock_sorted:
+        result = list(query_rows(_devices(1000), sort="-size", limit=3))
+
+    mock_sorted.assert_not_called()
+    assert [row["name"] for row in result] == ["device-999", "device-998", "device-997"]
+
+
+def test_fmt_query_rows_missing_sort_key_sorts_last():
+    """
+    Tests that rows missing the sort key sort last in both directions, with and without limit.
+    """
+
+    rows = [{"n": 1}, {"n": 3}, {}, {"n": 2}]
+
+    assert list(query_rows(rows, sort="-n", limit=2)) == [{"n": 3}, {"n": 2}]
+    assert list(query_rows(rows, sort="-n")) == [{"n": 3}, {"n": 2}, {"n": 1}, {}]
+    assert list(query_rows(rows, sort="n", limit=2)) == [{"n": 1}, {"n": 2}]
+    assert list(query_rows(rows, sort="n")) == [{"n": 1}, {"n": 2}, {"n": 3}, {}]
+    # missing rows fill up the limit when there aren't enough rows with the key
+    assert list(query_rows(rows, sort="-n", limit=5)) == [{"n": 3}, {"n": 2}, {"n": 1}, {}]
+
+
+def test_fmt_query_rows_invalid_where():
+    """
+    Tests that a ValueError is raised for conditions without a key=value pair.
+    """
+
+    with pytest.raises(ValueError):
+        list(query_rows([{"name": "a"}], where="name"))
+
+
+def test_fmt_display_data_fields_override_default_exclusion(capsys):
+    """
+    Tests that explicitly requested fields are displayed even if excluded by default.
+    """
+
+    rows = [{"name": "a", "owner": "@admin:localhost", "size": 1}]
+
+    display_data(rows, format="tsv", fields="name,owner")
+
+    assert capsys.readouterr().out == "name\towner\na\t@admin:localhost\n"
+
+
+def test_fmt_infer_schema_heterogeneous_rows(capsys):
+    """
+    Tests that columns are the union of keys and that missing cells are left empty.
+    """
+
+    rows = [{"name": "a"}, {"health": "red", "name": "b"}, {"size": 1024}]
+
+    columns, _ = infer_schema(rows)
+    assert columns == ["name", "health", "size"]
+
+    display_data(rows, format="csv")
+    assert capsys.readouterr().out.splitlines() == [
+        "name,health,size",
+        "a,,",
+        "b,red,",
+        ",,1.0 KiB",
+    ]
+
+
+def test_fmt_infer_schema_samples_iterators():
+    """
+    Tests that only the sampled rows of an iterator are scanned and none are lost.
+    """
+
+    rows = [{"name": "a"}, {"health": "red"}, {"size": 1}]
+
+    columns, remaining = infer_schema(iter(rows), sample=2)
+
+    assert columns == ["name", "health"]
+    assert list(remaining) == rows
+
+
+def test_fmt_watch_table_only_repaints_changes():
+    """
+    Tests that the watch table reuses unchanged rows and highlights changed rows.
+    """
+
+    watch_table = _WatchTable("Devices")
+    rows = [{"name": "a", "health": "green"}, {"name": "b", "health": "green"}]
+
+    # first snapshot renders every row
+    table = watch_table.update(rows)
+    assert table is not None and table.row_count == 2
+
+    # an identical snapshot doesn't need a repaint
+    assert watch_table.update([dict(row) for row in rows]) is None
+
+    # a health transition only renders and highlights the changed row
+    with patch("fractal.cli.fmt._ColumnPlan.render_row", autospec=True) as mock_render:
+        mock_render.return_value = ["b", "red"]
+        table = watch_table.update([rows[0], {"name": "b", "health": "red"}])
+    mock_render.assert_called_once()
+    assert table is not None
+    assert [row.style for row in table.rows] == [None, "bold"]
+
+    # the highlight is cleared on the next snapshot, then nothing changes anymore
+    rows = [rows[0], {"name": "b", "health": "red"}]
+    table = watch_table.update(rows)
+    assert table is not None and [row.style for row in table.rows] == [None, None]
+    assert watch_table.update(rows) is None
+
+
+def test_fmt_display_data_watch_refetches(capsys):
+    """
+    Tests that watching calls the fetch function every interval until interrupted.
+    """
+
+    async def fetch():
+        return list(_devices(1))
+
+    with patch("fractal.cli.fmt.time.sleep") as mock_sleep:
+        mock_sleep.side_effect = [None, KeyboardInterrupt()]
+        display_data(fetch, format="ndjson", watch="2")
+
+    mock_sleep.assert_called_with(2.0)
+    assert len(capsys.readouterr().out.splitlines()) == 2
+
+
+def test_fmt_display_data_watch_dict_fetch(capsys):
+    """
+    Tests that watching a fetch function that returns a single dict displays it as one row.
+    """
+
+    def fetch():
+        return {"name": "device-0", "health": "green"}
+
+    with patch("fractal.cli.fmt.time.sleep") as mock_sleep:
+        mock_sleep.side_effect = KeyboardInterrupt()
+        display_data(fetch, format="ndjson", watch=1)
+
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert rows == [{"name": "device-0", "health": "green"}]
+
+
+def test_fmt_display_data_watch_async_generator_fetch(capsys):
+    """
+    Tests that watching a fetch function that returns an async generator displays its rows.
+    """
+
+    async def fetch():
+        for row in _devices(2):
+            yield row
+
+    with patch("fractal.cli.fmt.time.sleep") as mock_sleep:
+        mock_sleep.side_effect = KeyboardInterrupt()
+        display_data(fetch, format="ndjson", watch=1, fields="name")
+
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert rows == [{"name": "device-0"}, {"name": "device-1"}]
+
+
+def test_fmt_display_data_watch_requires_callable():
+    """
+    Tests that a ValueError is raised when watching data that can't be fetched again.
+    """
+
+    with pytest.raises(ValueError):
+        display_data([], watch=1)
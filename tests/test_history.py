@@ -0,0 +1,213 @@
+import json
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+from clicz import CLICZ
+from fractal.cli import history
+from fractal.cli.controllers.stats import StatsController
+from fractal.cli.utils import user_data_path
+
+
+def test_history_record_and_read():
+    """
+    Tests that recorded commands are read back with their duration, exit status
+    and number of network calls.
+    """
+
+    history.record_command("auth login", 0.25, 0, network_calls=3)
+    history.record_command("auth whoami", 0.1, 1)
+
+    entries = list(history.read_history())
+    assert [entry["command"] for entry in entries] == ["auth login", "auth whoami"]
+    assert entries[0]["duration"] == pytest.approx(0.25)
+    assert entries[0]["network_calls"] == 3
+    assert entries[1]["exit_status"] == 1
+
+
+def test_history_record_disabled(monkeypatch):
+    """
+    Tests that nothing is recorded when the history is disabled with
+    FRACTAL_NO_HISTORY.
+    """
+
+    monkeypatch.setenv(history.HISTORY_DISABLE_ENV, "1")
+    history.record_command("auth login", 0.25, 0)
+    assert not os.path.exists(user_data_path(history.HISTORY_FILE))
+
+
+def test_history_read_since_skips_old_and_malformed_lines():
+    """
+    Tests that reading the history since a time skips older entries and lines
+    that can't be parsed.
+    """
+
+    history.record_command("auth login", 0.25, 0)
+    with open(user_data_path(history.HISTORY_FILE), "a") as file:
+        file.write("not a history line\n")
+        file.write(f"{time.time() - 3600}\tauth whoami\t100.0\t0\t1\n")
+
+    entries = list(history.read_history(since=time.time() - 60))
+    assert [entry["command"] for entry in entries] == ["auth login"]
+
+
+def test_history_rotates():
+    """
+    Tests that the history file is rotated once it gets too big and that both
+    generations are read.
+    """
+
+    with patch.object(history, "HISTORY_MAX_BYTES", 100):
+        for _ in range(5):
+            history.record_command("auth whoami", 0.1, 0)
+
+    path = user_data_path(history.HISTORY_FILE)
+    assert os.path.exists(f"{path}.1")
+    assert os.path.getsize(path) < 100
+    # both generations are read
+    assert len(list(history.read_history())) == 5
+
+
+def test_history_parse_window():
+    """
+    Tests that time windows are parsed to seconds, with all meaning no window.
+    """
+
+    assert history.parse_window("30m") == 1800
+    assert history.parse_window("24h") == 86400
+    assert history.parse_window("all") is None
+    with pytest.raises(ValueError):
+        history.parse_window("yesterday")
+
+
+def test_history_summarize_percentiles():
+    """
+    Tests that the summary has the latency percentiles, errors and network calls
+    of every command.
+    """
+
+    entries = [
+        {"command": "auth login", "duration": duration / 100, "exit_status": 0, "network_calls": 2}
+        for duration in range(1, 101)
+    ]
+    entries.append({"command": "auth whoami", "duration": 0.5, "exit_status": 1, "network_calls": 1})
+
+    login, whoami = history.summarize(iter(entries))
+    assert login["count"] == 100
+    assert login["p50"] == 0.5
+    assert login["p95"] == 0.95
+    assert login["p99"] == 0.99
+    assert login["network_calls"] == 2
+    assert whoami["errors"] == 1
+    assert whoami["p99"] == 0.5
+
+
+def test_history_prometheus_textfile(tmp_path):
+    """
+    Tests that the summary is written atomically as a Prometheus textfile.
+    """
+
+    summary = history.summarize(
+        iter([{"command": "auth login", "duration": 0.5, "exit_status": 0, "network_calls": 2}])
+    )
+    path = tmp_path / "fractal.prom"
+    history.write_prometheus_textfile(summary, str(path))
+
+    text = path.read_text()
+    assert "# TYPE fractal_cli_command_duration_seconds summary" in text
+    assert 'fractal_cli_command_duration_seconds{command="auth login",quantile="0.95"} 0.500000' in text
+    assert 'fractal_cli_command_duration_seconds_count{command="auth login"} 1' in text
+    assert 'fractal_cli_command_errors{command="auth login"} 0' in text
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_history_stats_command(capsys, tmp_path):
+    """
+    Tests that the stats command prints the summary of the recorded commands and
+    writes the Prometheus textfile.
+    """
+
+    history.record_command("auth login", 0.25, 0, network_calls=3)
+
+    cli = CLICZ(autodiscover=False)
+    cli.register_controller(StatsController)
+    prom_path = str(tmp_path / "fractal.prom")
+    summary = cli.dispatch(["fractal", "stats", "--window", "1h", "--format", "json", "--prometheus", prom_path])
+
+    assert summary[0]["command"] == "auth login"
+    assert '"p95": "0.250s"' in capsys.readouterr().out
+    assert os.path.exists(prom_path)
+
+
+def test_history_stats_command_no_history(capsys):
+    """
+    Tests that the stats command says so when no commands were recorded in the
+    window.
+    """
+
+    StatsController().stats(window="1h")
+    assert "No commands recorded in the last 1h." in capsys.readouterr().out
+
+
+def test_history_stats_command_watch(capsys):
+    """
+    Tests that stats --watch refreshes the summary with the commands recorded
+    between refreshes.
+    """
+
+    history.record_command("auth login", 0.25, 0)
+
+    def record_more(seconds):
+        # a command run between refreshes shows up in the next one
+        if mock_sleep.call_count == 1:
+            history.record_command("auth login", 0.25, 0)
+        else:
+            raise KeyboardInterrupt()
+
+    with patch("fractal.cli.fmt.time.sleep", side_effect=record_more) as mock_sleep:
+        StatsController().stats(window="1h", format="ndjson", watch=1)
+
+    counts = [json.loads(line)["count"] for line in capsys.readouterr().out.splitlines()]
+    assert counts == [1, 2]
+
+
+def test_history_main_records_dispatched_commands():
+    """
+    Tests that only commands dispatched to a plugin are recorded, and not the
+    ones run in watch mode.
+    """
+
+    from fractal.cli.__main__ import _record_history
+
+    cli = CLICZ(autodiscover=False)
+    cli.register_controller(StatsController)
+    with patch("sys.argv", ["fractal", "metrics", "stats"]):
+        _record_history(cli, 0.5, 0)
+    with patch("sys.argv", ["fractal", "--help"]):
+        _record_history(cli, 0.5, 0)
+    # watch mode invocations are not recorded
+    with patch("sys.argv", ["fractal", "metrics", "stats", "--watch", "2"]):
+        _record_history(cli, 60.0, 0)
+    with patch("sys.argv", ["fractal", "metrics", "stats", "--watch=2"]):
+        _record_history(cli, 60.0, 0)
+
+    assert [entry["command"] for entry in history.read_history()] == ["metrics stats"]
+
+
+@pytest.mark.parametrize("disabled", [False, True])
+def test_history_main_only_instruments_http_for_history(monkeypatch, disabled):
+    """
+    Tests that aiohttp is only instrumented when the history is enabled.
+    """
+
+    from fractal.cli.__main__ import _main
+
+    if disabled:
+        monkeypatch.setenv(history.HISTORY_DISABLE_ENV, "1")
+    with patch("fractal.cli.__main__.CLICZ"), patch(
+        "fractal.cli.trace.instrument_http"
+    ) as mock_instrument, patch("sys.argv", ["fractal", "metrics", "stats"]):
+        _main()
+
+    assert mock_instrument.called != disabled
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+from fractal.cli import memprofile
+from fractal.cli.fmt import display_data
+
+
+@pytest.fixture(autouse=True)
+def stop_memprofile():
+    yield
+    memprofile.stop()
+
+
+def test_memprofile_disabled():
+    """
+    Tests that phases record nothing and no report is written when memory
+    profiling is not enabled.
+    """
+
+    assert not memprofile.is_enabled()
+    with memprofile.phase("render"):
+        pass
+    assert memprofile.write_report() is None
+
+
+def test_memprofile_phases_attribute_allocations(tmp_path):
+    """
+    Tests that allocations are attributed to the phase they happen in, with the
+    top allocation sites of every phase.
+    """
+
+    memprofile.enable(str(tmp_path / "report.json"))
+    with memprofile.phase("import"):
+        imported = [bytearray(1024) for _ in range(100)]
+    rows = [{"name": f"row {i}", "value": i} for i in range(2000)]
+    display_data(rows, format="json")
+
+    report = memprofile.stop()
+
+    assert report is not None
+    assert not memprofile.is_enabled()
+    phases = {phase["phase"]: phase for phase in report["phases"]}
+    assert list(phases) == ["command", "import", "render"]
+    assert phases["import"]["allocated"] >= 100 * 1024
+    assert phases["import"]["top_sites"][0]["site"].endswith("test_memprofile.py:34")
+    assert phases["command"]["top_sites"][0]["site"].endswith("test_memprofile.py:35")
+    assert phases["render"]["peak_traced"] > 0
+    assert report["peak_rss"] > 0
+    del imported
+
+
+def test_memprofile_write_report_json(tmp_path):
+    """
+    Tests that the report is written as JSON to the given path.
+    """
+
+    path = str(tmp_path / "report.json")
+    memprofile.enable(path)
+
+    assert memprofile.write_report() == path
+    with open(path) as file:
+        report = json.load(file)
+    assert report["phases"][0]["phase"] == "command"
+
+
+def test_memprofile_write_report_summary(capsys):
+    """
+    Tests that the report is printed as a summary to stderr when the path is -.
+    """
+
+    memprofile.enable("-")
+    with memprofile.phase("render"):
+        rendered = ["x" * 100 for _ in range(1000)]
+
+    assert memprofile.write_report() == "-"
+    err = capsys.readouterr().err
+    assert "render: peak traced" in err
+    assert "test_memprofile.py:73" in err
+    del rendered
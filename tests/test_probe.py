@@ -0,0 +1,253 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from aiohttp import web
+from asgiref.sync import async_to_sync
+from fractal.cli import probe
+from fractal.cli.controllers.auth import AuthController
+from fractal.cli.utils import read_user_data, write_user_data
+
+
+@contextmanager
+def _serve(app: web.Application):
+    """
+    Runs app on a background thread, so it can be reached from async_to_sync.
+    """
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+@pytest.fixture
+def versions_server():
+    """
+    Serves /versions and an authenticated whoami on a background thread.
+    """
+
+    async def versions(request):
+        return web.json_response({"versions": ["v1.1"]})
+
+    async def whoami(request):
+        if request.headers.get("Authorization") != "Bearer test-token":
+            return web.json_response({"errcode": "M_UNKNOWN_TOKEN"}, status=401)
+        return web.json_response({"user_id": "@test:localhost"})
+
+    app = web.Application()
+    app.router.add_get("/_matrix/client/versions", versions)
+    app.router.add_get("/_matrix/client/v3/account/whoami", whoami)
+    with _serve(app) as url:
+        yield url
+
+
+def test_diagnose_times_every_phase(versions_server):
+    phases = async_to_sync(probe.diagnose)(versions_server, access_token="test-token", count=2)
+
+    assert list(phases) == ["dns", "tcp connect", "versions", "whoami"]
+    for result in phases.values():
+        assert len(result["timings"]) == 2
+        assert not result["errors"]
+
+
+def test_diagnose_records_errors(versions_server):
+    phases = async_to_sync(probe.diagnose)(versions_server, access_token="wrong-token", count=2)
+
+    assert phases["whoami"]["errors"] == ["401 Unauthorized", "401 Unauthorized"]
+    summary = probe.summarize_phases(phases)
+    whoami = next(row for row in summary if row["phase"] == "whoami")
+    assert whoami["median"] is None
+    assert whoami["errors"] == 2
+
+
+def test_summarize_phases_and_dominant_phase():
+    summary = probe.summarize_phases(
+        {
+            "dns": {"timings": [0.01, 0.03, 0.02], "errors": []},
+            "versions": {"timings": [0.2, 0.1, 0.3], "errors": ["timeout"]},
+        }
+    )
+    assert summary[0] == {
+        "phase": "dns",
+        "min": 0.01,
+        "median": 0.02,
+        "max": 0.03,
+        "errors": 0,
+        "error": "",
+    }
+    assert summary[1]["error"] == "timeout"
+    assert probe.dominant_phase(summary)["phase"] == "versions"  # type: ignore
+
+
+def test_doctor_uses_stored_credentials(versions_server, capsys):
+    write_user_data(
+        {
+            "access_token": "test-token",
+            "homeserver_url": versions_server,
+            "matrix_id": "@test:localhost",
+        },
+        AuthController.TOKEN_FILE,
+    )
+    # skip the .well-known lookup, there is no discovery endpoint on the test server
+    summary = AuthController().doctor(homeserver_url=versions_server, count="2", format="plain")
+
+    phases = [row["phase"] for row in summary]
+    assert phases == ["dns", "tcp connect", "versions", "whoami"]
+    assert "dominates" in capsys.readouterr().out
+
+
+def test_doctor_watch(versions_server, capsys):
+    with patch("fractal.cli.fmt.time.sleep", side_effect=[None, KeyboardInterrupt()]):
+        AuthController().doctor(
+            homeserver_url=versions_server, count="1", format="ndjson", watch=1
+        )
+
+    phases = [json.loads(line)["phase"] for line in capsys.readouterr().out.splitlines()]
+    assert phases == ["dns", "tcp connect", "versions"] * 2
+
+
+def test_doctor_not_logged_in(capsys):
+    with pytest.raises(SystemExit):
+        AuthController().doctor()
+    assert "You are not logged in" in capsys.readouterr().err
+
+
+@pytest.fixture
+def unhealthy_server():
+    """
+    Serves a /versions endpoint that always fails.
+    """
+
+    async def versions(request):
+        return web.json_response({"errcode": "M_UNKNOWN"}, status=502)
+
+    app = web.Application()
+    app.router.add_get("/_matrix/client/versions", versions)
+    with _serve(app) as url:
+        yield url
+
+
+def test_fastest_homeserver_without_candidates():
+    assert async_to_sync(probe.fastest_homeserver)("@test:localhost") is None
+
+
+def test_fastest_homeserver_picks_healthy_candidate(versions_server, unhealthy_server):
+    write_user_data({"localhost": [unhealthy_server, versions_server]}, probe.HOMESERVERS_FILE)
+
+    assert async_to_sync(probe.fastest_homeserver)("@test:localhost") == versions_server
+
+    rankings, _ = read_user_data(probe.HOMESERVER_RANKING_FILE)
+    assert [ranked["homeserver_url"] for ranked in rankings["localhost"]["ranking"]] == [
+        versions_server
+    ]
+
+
+def test_fastest_homeserver_uses_cached_ranking(versions_server, unhealthy_server):
+    write_user_data({"localhost": [unhealthy_server, versions_server]}, probe.HOMESERVERS_FILE)
+    async_to_sync(probe.fastest_homeserver)("@test:localhost")
+
+    with patch("fractal.cli.probe.rank_homeservers") as mock_rank:
+        assert async_to_sync(probe.fastest_homeserver)("@test:localhost") == versions_server
+    mock_rank.assert_not_called()
+
+    # an expired ranking is probed again
+    with patch.object(probe, "HOMESERVER_RANKING_TTL", 0):
+        with patch("fractal.cli.probe.rank_homeservers", new_callable=AsyncMock) as mock_rank:
+            mock_rank.return_value = [(unhealthy_server, 0.01)]
+            assert async_to_sync(probe.fastest_homeserver)("@test:localhost") == unhealthy_server
+    mock_rank.assert_called_once()
+
+
+def test_fastest_homeserver_candidates_from_env(monkeypatch, unhealthy_server):
+    monkeypatch.setenv(
+        probe.HOMESERVER_CANDIDATES_ENV, f"example.com={unhealthy_server},{unhealthy_server}/"
+    )
+    # no healthy candidate, fall back to discovery
+    assert async_to_sync(probe.fastest_homeserver)("@test:example.com") is None
+
+
+def test_homeserver_candidates_scoped_to_server_name(monkeypatch):
+    """
+    Tests that candidates are only used for the server name they are configured for.
+    """
+    monkeypatch.setenv(
+        probe.HOMESERVER_CANDIDATES_ENV,
+        "example.com=https://edge1.example.com,https://edge2.example.com;other.com=https://other.com",
+    )
+    assert probe.homeserver_candidates("example.com") == [
+        "https://edge1.example.com",
+        "https://edge2.example.com",
+    ]
+    assert probe.homeserver_candidates("other.com") == ["https://other.com"]
+    assert probe.homeserver_candidates("matrix.org") == []
+    assert async_to_sync(probe.fastest_homeserver)("@me:matrix.org") is None
+
+
+def _unreachable_url() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+def test_login_fails_over_when_cached_winner_is_down(fake_homeserver):
+    """
+    Tests that login moves on to the next ranked candidate when the cached fastest
+    candidate can't be connected to, and drops the cached ranking.
+    """
+    unreachable = _unreachable_url()
+    write_user_data({"localhost": [unreachable, fake_homeserver.url]}, probe.HOMESERVERS_FILE)
+    write_user_data(
+        {
+            "localhost": {
+                "candidates": [unreachable, fake_homeserver.url],
+                "checked": time.time(),
+                "ranking": [
+                    {"homeserver_url": unreachable, "latency": 0.001},
+                    {"homeserver_url": fake_homeserver.url, "latency": 0.002},
+                ],
+            }
+        },
+        probe.HOMESERVER_RANKING_FILE,
+    )
+
+    AuthController().login("@admin:localhost", password="admin", silent=True)
+
+    data, _ = read_user_data(AuthController.TOKEN_FILE)
+    assert data["homeserver_url"] == fake_homeserver.url
+    rankings, _ = read_user_data(probe.HOMESERVER_RANKING_FILE)
+    assert "localhost" not in (rankings or {})
+
+
+def test_login_with_candidate_checks_apex(versions_server):
+    """
+    Tests that the homeserver apex check runs when a candidate homeserver is picked.
+    """
+    write_user_data({"localhost": [versions_server]}, probe.HOMESERVERS_FILE)
+
+    with patch(
+        "fractal.cli.controllers.auth.get_homeserver_for_matrix_id", new_callable=AsyncMock
+    ) as mock_get_homeserver:
+        mock_get_homeserver.return_value = ("https://new-apex.example.com", True)
+        with patch("builtins.input", return_value="n") as mock_input:
+            with pytest.raises(SystemExit):
+                AuthController().login("@test:localhost", password="password", silent=True)
+
+    mock_get_homeserver.assert_called_once()
+    mock_input.assert_called_once()
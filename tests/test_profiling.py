@@ -0,0 +1,89 @@
+import pstats
+import sys
+from unittest.mock import patch
+
+import pytest
+from asgiref.sync import async_to_sync
+from fractal.cli import profiling
+from fractal.cli.__main__ import main
+
+
+@pytest.fixture(autouse=True)
+def stop_profiling():
+    yield
+    profiling.stop()
+
+
+def busy_loop():
+    return sum(i * i for i in range(20000))
+
+
+async def async_busy_loop():
+    return busy_loop()
+
+
+def _function_names(stats: pstats.Stats) -> set[str]:
+    return {name for _, _, name in stats.stats}  # type: ignore
+
+
+def test_profiling_disabled():
+    """
+    Tests that stopping and writing the profile do nothing when profiling is not
+    enabled.
+    """
+
+    assert not profiling.is_enabled()
+    assert profiling.stop() is None
+    assert profiling.write_profile() is None
+
+
+def test_profiling_includes_async_to_sync_threads(tmp_path):
+    """
+    Tests that the profile includes the coroutines async_to_sync runs on its own
+    thread.
+    """
+
+    path = str(tmp_path / "out.prof")
+    profiling.enable(path)
+    async_to_sync(async_busy_loop)()
+
+    assert profiling.write_profile() == path
+    assert not profiling.is_enabled()
+    # the coroutine ran on the thread async_to_sync started
+    assert "async_busy_loop" in _function_names(pstats.Stats(path))
+
+
+def test_profiling_collapsed_stacks(tmp_path):
+    """
+    Tests that a .folded profile is written as collapsed stacks with the time
+    spent in every stack in microseconds.
+    """
+
+    path = str(tmp_path / "out.folded")
+    profiling.enable(path)
+    busy_loop()
+    profiling.write_profile()
+
+    with open(path) as file:
+        lines = file.read().splitlines()
+    stack, microseconds = next(line for line in lines if "<genexpr>" in line).rsplit(" ", 1)
+    frames = stack.split(";")
+    assert frames[-1].startswith("<genexpr> (test_profiling.py:")
+    assert frames[-2] == "<built-in method builtins.sum>"
+    assert frames[-3].startswith("busy_loop (test_profiling.py:")
+    assert int(microseconds) > 0
+
+
+def test_profiling_main_profile_option(tmp_path):
+    """
+    Tests that the --profile global option profiles the whole command, including
+    loading the plugins.
+    """
+
+    path = str(tmp_path / "out.prof")
+    with patch.object(sys, "argv", ["fractal", "--profile", path, "--help"]):
+        with pytest.raises(SystemExit):
+            main()
+
+    # plugins are loaded (imported) while profiling
+    assert "__init__" in _function_names(pstats.Stats(path))
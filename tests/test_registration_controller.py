@@ -1,7 +1,7 @@
 import secrets
 import asyncio
 from hashlib import sha256
-from unittest.mock import patch, MagicMock, AsyncMock
+from unittest.mock import ANY, patch, MagicMock, AsyncMock
 
 import pytest
 from fractal.cli.controllers.registration import (
@@ -39,6 +39,7 @@ async def test_registration_controller_register_local_error_getting_homeserver_c
     mock_print.assert_called_with(f"No synapse server running locally: .")
 
 
+@pytest.mark.synapse
 async def test_registration_controller_register_local_successful_registration(
     test_homeserver_url,
 ):
@@ -64,6 +65,7 @@ async def test_registration_controller_register_local_successful_registration(
     assert homeserver_url is not None
 
 
+@pytest.mark.synapse
 async def test_registration_controller_register_local_user_id_already_taken(test_homeserver_url):
     """
     Tests that an exception is raised if an attempt is made to register a user with the
@@ -114,6 +116,7 @@ async def test_registration_controller_register_local_user_id_already_taken(test
     )
 
 
+@pytest.mark.synapse
 async def test_registration_controller_register_local_no_homeserver(test_homeserver_url):
     """
     Tests that get_homeserver_for_matrix_id is called if no homeserver_url is passed to
@@ -158,6 +161,7 @@ async def test_registration_controller_register_True_local(
     with patch(
         "fractal.cli.controllers.registration.RegistrationController._register_local"
     ) as mock_register_local:
+        mock_register_local.return_value = ("test_access_token", test_homeserver_url)
         # patch get_homeserver_for_matrix_id to make sure it was not called
         with patch(
             "fractal.cli.controllers.registration.get_homeserver_for_matrix_id"
@@ -194,7 +198,7 @@ async def test_registration_controller_register_existing_homeserver(
     with patch(
         "fractal.cli.controllers.registration.get_homeserver_for_matrix_id"
     ) as mock_get_homeserver:
-        _, homeserver_url = await test_registration_controller._register(
+        _, homeserver_url, _ = await test_registration_controller._register(
             matrix_id=matrix_id,
             password=password,
             registration_token=test_registration_token,
@@ -228,7 +232,7 @@ async def test_registration_controller_register_no_homeserver(
         "fractal.cli.controllers.registration.get_homeserver_for_matrix_id"
     ) as mock_get_homeserver:
         mock_get_homeserver.return_value = [test_homeserver_url, False]
-        _, homeserver_url = await test_registration_controller._register(
+        _, homeserver_url, _ = await test_registration_controller._register(
             matrix_id=matrix_id,
             password=password,
             registration_token=test_registration_token,
@@ -254,7 +258,7 @@ def test_registration_controller_register_cli_method(test_registration_token):
     with patch(
         "fractal.cli.controllers.registration.RegistrationController._register"
     ) as mock_register:
-        mock_register.return_value = ["test", "value"]
+        mock_register.return_value = ["test", "value", matrix_id]
         test_registration_controller.register(
             matrix_id=matrix_id,
             password=password,
@@ -310,6 +314,7 @@ def test_registration_controller_token_cases():
 
 
 # @pytest.skip(reason='Error on registration due to user id already being taken.')
+@pytest.mark.synapse
 def test_registration_controller_register_remote_functional_test(
     test_homeserver_url, test_registration_token, test_alternate_homeserver_url,
 ):
@@ -366,3 +371,105 @@ def test_registration_controller_register_remote_functional_test(
         registration_token=test_registration_token,
         homeserver_url=test_alternate_homeserver_url
     )
+
+
+def test_registration_controller_register_remote_targets(tmp_path):
+    """
+    Tests that register_remote prompts for the password once and registers the user on
+    every homeserver listed in the targets file.
+    """
+
+    matrix_id = "@admin:localhost"
+    password = "test_password"
+    homeservers = ["https://edge1.example.com", "https://edge2.example.com"]
+
+    # write a targets file where only the first target has its own registration token
+    targets_file = tmp_path / "targets.yaml"
+    targets_file.write_text(
+        f"- homeserver_url: {homeservers[0]}\n"
+        "  registration_token: target_token\n"
+        f"- homeserver_url: {homeservers[1]}\n"
+    )
+
+    # create a RegistrationController object for a logged in user
+    test_registration_controller = RegistrationController()
+    test_registration_controller.access_token = "test_access_token"
+    test_registration_controller.matrix_id = matrix_id
+    test_registration_controller._register = AsyncMock()
+    test_registration_controller._register.return_value = ["test_token", "unused", "unused"]
+
+    with patch(
+        "fractal.cli.controllers.registration.getpass", new_callable=MagicMock()
+    ) as mock_getpass:
+        mock_getpass.return_value = password
+        with patch("fractal.cli.controllers.registration.display_data") as mock_display:
+            results = test_registration_controller.register_remote(
+                registration_token="default_token", targets=str(targets_file)
+            )
+
+    # verify that the password was only prompted for once and the results were displayed
+    mock_getpass.assert_called_once()
+    mock_display.assert_called_once()
+
+    # verify that every target was registered with its derived creds and token
+    assert [result["homeserver_url"] for result in results] == homeservers
+    assert all(result["status"] == "registered" for result in results)
+    for homeserver_url, token in zip(homeservers, ["target_token", "default_token"]):
+        unique = sha256(f"{matrix_id}{homeserver_url}".encode("utf-8")).hexdigest()[:4]
+        test_registration_controller._register.assert_any_call(
+            matrix_id=f"{matrix_id}-{unique}",
+            password=sha256(f"{password}{homeserver_url}".encode("utf-8")).hexdigest(),
+            registration_token=token,
+            homeserver_url=homeserver_url,
+            session=ANY,
+        )
+
+
+def test_registration_controller_register_remote_targets_failed(tmp_path):
+    """
+    Tests that register_remote displays the results and exits with an error when
+    registering on any of the targets failed.
+    """
+
+    targets_file = tmp_path / "targets.yaml"
+    targets_file.write_text(
+        "- homeserver_url: https://edge1.example.com\n"
+        "- homeserver_url: https://edge2.example.com\n"
+    )
+
+    # create a RegistrationController object for a logged in user
+    test_registration_controller = RegistrationController()
+    test_registration_controller.access_token = "test_access_token"
+    test_registration_controller.matrix_id = "@admin:localhost"
+    test_registration_controller._register = AsyncMock(
+        side_effect=[["test_token", "unused", "unused"], Exception("Registration failed")]
+    )
+
+    with patch("fractal.cli.controllers.registration.getpass", return_value="test_password"):
+        with patch("fractal.cli.controllers.registration.display_data") as mock_display:
+            with pytest.raises(SystemExit) as e:
+                test_registration_controller.register_remote(
+                    registration_token="token", targets=str(targets_file)
+                )
+
+    assert e.value.code == 1
+    results = mock_display.call_args[0][0]
+    assert sorted(result["status"] for result in results) == ["failed", "registered"]
+
+
+def test_registration_controller_register_remote_requires_homeserver_or_targets():
+    """
+    Tests that register_remote exits with an error when neither a homeserver url
+    and registration token nor targets are given.
+    """
+
+    test_registration_controller = RegistrationController()
+    test_registration_controller.access_token = "test_access_token"
+    test_registration_controller.matrix_id = "@admin:localhost"
+
+    with patch("fractal.cli.controllers.registration.getpass") as mock_getpass:
+        with pytest.raises(SystemExit) as e:
+            test_registration_controller.register_remote(registration_token="token")
+
+    assert e.value.code == 1
+    mock_getpass.assert_not_called()
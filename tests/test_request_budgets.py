@@ -0,0 +1,127 @@
+"""
+Budgets for the number of HTTP requests each command makes, so that redundant
+round trips (such as a whoami for an already known user) don't creep back in.
+"""
+
+import pytest
+from fractal.cli.controllers.auth import AuthController
+from fractal.cli.controllers.registration import RegistrationController
+from fractal.cli.utils import read_user_data
+
+
+@pytest.fixture
+def admin_logged_in(fake_homeserver):
+    """
+    Logs in as the admin user with an access token.
+    """
+    AuthController().login(
+        "@admin:localhost",
+        homeserver_url=fake_homeserver.url,
+        access_token=fake_homeserver.issue_access_token("@admin:localhost"),
+        silent=True,
+    )
+
+
+def test_login_with_password_budget(fake_homeserver, request_budget):
+    """
+    Tests that logging in with a password makes a single request.
+    """
+    with request_budget(1):
+        AuthController().login(
+            "@admin:localhost", password="admin", homeserver_url=fake_homeserver.url, silent=True
+        )
+
+
+def test_login_with_access_token_budget(fake_homeserver, request_budget):
+    """
+    Tests that logging in with an access token only makes the whoami request.
+    """
+    access_token = fake_homeserver.issue_access_token("@admin:localhost")
+    with request_budget(1):
+        AuthController().login(
+            "@admin:localhost",
+            homeserver_url=fake_homeserver.url,
+            access_token=access_token,
+            silent=True,
+        )
+
+
+def test_whoami_budget(admin_logged_in, request_budget):
+    """
+    Tests that whoami reads the logged in user without making a request.
+    """
+    with request_budget(0):
+        AuthController().whoami()
+
+
+def test_logout_budget(admin_logged_in, request_budget):
+    """
+    Tests that logging out makes a single request.
+    """
+    with request_budget(1):
+        AuthController().logout()
+
+
+def test_token_create_budget(admin_logged_in, request_budget):
+    """
+    Tests that creating a registration token makes a single request.
+    """
+    with request_budget(1):
+        RegistrationController().token("create")
+
+
+def test_register_budget(fake_homeserver, request_budget, capsys):
+    """
+    Tests that registering logs in as the registered user without a whoami.
+    """
+    registration_token = fake_homeserver.create_registration_token()
+
+    # user interactive authentication: start, registration token and dummy stages
+    with request_budget(3) as requests:
+        RegistrationController().register(
+            "@budget:localhost",
+            registration_token=registration_token,
+            password="password",
+            homeserver_url=fake_homeserver.url,
+        )
+
+    # the registered user is logged in without another whoami
+    assert all(path.endswith("/register") for _, path, _ in requests)
+    assert "Successfully logged in as @budget:localhost" in capsys.readouterr().out
+    data, _ = read_user_data(AuthController.TOKEN_FILE)
+    assert data["matrix_id"] == "@budget:localhost"
+    assert fake_homeserver.access_tokens[data["access_token"]] == "@budget:localhost"
+
+
+def test_register_mixed_case_budget(fake_homeserver, request_budget, capsys):
+    """
+    Tests that registering a mixed case matrix ID saves the ID the homeserver registered.
+    """
+    registration_token = fake_homeserver.create_registration_token()
+
+    with request_budget(3):
+        RegistrationController().register(
+            "@MixedCase:localhost",
+            registration_token=registration_token,
+            password="password",
+            homeserver_url=fake_homeserver.url,
+        )
+
+    assert "Successfully logged in as @mixedcase:localhost" in capsys.readouterr().out
+    data, _ = read_user_data(AuthController.TOKEN_FILE)
+    assert data["matrix_id"] == "@mixedcase:localhost"
+    assert fake_homeserver.access_tokens[data["access_token"]] == "@mixedcase:localhost"
+
+
+def test_request_budget_exceeded(fake_homeserver, request_budget):
+    """
+    Tests that the request_budget fixture fails when the budget is exceeded.
+    """
+    with pytest.raises(AssertionError, match="2 HTTP requests made, the budget is 1"):
+        with request_budget(1):
+            AuthController().login(
+                "@admin:localhost", password="admin", homeserver_url=fake_homeserver.url, silent=True
+            )
+            AuthController().login(
+                "@admin:localhost", password="admin", homeserver_url=fake_homeserver.url, silent=True
+            )
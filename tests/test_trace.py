@@ -0,0 +1,159 @@
+import asyncio
+import json
+
+import aiohttp
+import pytest
+from aiohttp import web
+from fractal.cli import trace
+from fractal.cli.__main__ import pop_option
+
+
+@pytest.fixture
+def tracing(tmp_path):
+    """
+    Enables tracing for the duration of a test.
+    """
+    path = str(tmp_path / "trace.json")
+    trace.enable(path)
+    yield path
+    trace._events = None
+    trace._trace_path = None
+
+
+def _spans():
+    return [event for event in trace._events if event["ph"] == "X"]  # type: ignore
+
+
+def test_trace_span_disabled_is_noop():
+    """
+    Tests that spans record nothing and no trace is written when tracing is
+    not enabled.
+    """
+
+    assert not trace.is_enabled()
+    with trace.span("nothing"):
+        pass
+    assert trace.write_trace() is None
+
+
+def test_trace_span_records_complete_event(tracing):
+    """
+    Tests that nested spans are recorded as complete events with their
+    category, arguments and timings.
+    """
+
+    with trace.span("outer", "test", key="value"):
+        with trace.span("inner"):
+            pass
+
+    inner, outer = _spans()
+    assert inner["name"] == "inner"
+    assert outer["name"] == "outer"
+    assert outer["cat"] == "test"
+    assert outer["args"] == {"key": "value"}
+    assert outer["ts"] <= inner["ts"]
+    assert outer["dur"] >= inner["dur"]
+
+
+def test_trace_span_records_error(tracing):
+    """
+    Tests that a span records the type of the exception raised in it.
+    """
+
+    with pytest.raises(ValueError):
+        with trace.span("failing"):
+            raise ValueError("boom")
+
+    assert _spans()[0]["args"] == {"error": "ValueError"}
+
+
+def test_trace_traced_decorator_sync_and_async(tracing):
+    """
+    Tests that traced records spans for both sync and async functions, named
+    after the function unless a name is given.
+    """
+
+    @trace.traced()
+    def sync_func():
+        return 1
+
+    @trace.traced("async func")
+    async def async_func():
+        return 2
+
+    assert sync_func() == 1
+    assert asyncio.run(async_func()) == 2
+    names = [event["name"] for event in _spans()]
+    assert names == [
+        "test_trace_traced_decorator_sync_and_async.<locals>.sync_func",
+        "async func",
+    ]
+
+
+def test_trace_write_trace_chrome_format(tracing):
+    """
+    Tests that the trace is written in the Chrome trace event format.
+    """
+
+    with trace.span("written"):
+        pass
+
+    assert trace.write_trace() == tracing
+    with open(tracing) as file:
+        data = json.load(file)
+    assert data["displayTimeUnit"] == "ms"
+    assert data["traceEvents"][0]["ph"] == "M"
+    assert data["traceEvents"][-1]["name"] == "written"
+
+
+def test_trace_http_requests_are_traced(tracing):
+    """
+    Tests that aiohttp requests are recorded as spans with their status and
+    without their query string.
+    """
+
+    async def whoami(request):
+        return web.json_response({"user_id": "@test:localhost"})
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/_matrix/client/v3/account/whoami", whoami)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # type: ignore
+        try:
+            async with aiohttp.ClientSession() as session:
+                url = f"http://127.0.0.1:{port}/_matrix/client/v3/account/whoami?access_token=secret"
+                async with session.get(url) as response:
+                    await response.json()
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+    request = next(event for event in _spans() if event["name"].startswith("GET"))
+    assert request["name"] == "GET /_matrix/client/v3/account/whoami"
+    assert request["cat"] == "http"
+    assert request["args"]["status"] == 200
+    assert "secret" not in json.dumps(trace._events)
+
+
+def test_trace_pop_option():
+    """
+    Tests that pop_option removes a global option and its value from argv in
+    both the separate and the --option=value forms.
+    """
+
+    argv = ["fractal", "--trace", "out.json", "auth", "whoami"]
+    assert pop_option(argv, "--trace") == "out.json"
+    assert argv == ["fractal", "auth", "whoami"]
+
+    argv = ["fractal", "--trace=out.json", "auth", "whoami"]
+    assert pop_option(argv, "--trace") == "out.json"
+    assert argv == ["fractal", "auth", "whoami"]
+
+    argv = ["fractal", "auth", "whoami"]
+    assert pop_option(argv, "--trace") is None
+    assert argv == ["fractal", "auth", "whoami"]
@@ -5,7 +5,16 @@ from uuid import uuid4
 import pytest
 import yaml
 from fractal.cli import FRACTAL_DATA_DIR
-from fractal.cli.utils import InvalidMatrixIdException, read_user_data, write_user_data
+from asgiref.sync import async_to_sync
+from fractal.cli.utils import (
+    InvalidMatrixIdException,
+    get_data_dir,
+    is_db_initialized_cached,
+    normalize_homeserver_url,
+    read_user_data,
+    use_data_dir,
+    write_user_data,
+)
 
 
 def test_utils_write_yamlerror(test_yaml_dict):
@@ -115,3 +124,102 @@ def test_utils_read_verify_read(test_yaml_dict):
 
     # verify that the yaml file that is read matches what was expected
     assert yaml_file == test_yaml_dict
+
+
+def test_utils_is_db_initialized_cached_no_project(monkeypatch):
+    """
+    Tests that the database is not initialized, without checking with fractal-database,
+    when there is no local project.
+    """
+
+    monkeypatch.delenv("FRACTAL_PROJECT_NAME", raising=False)
+    monkeypatch.delenv("DJANGO_SETTINGS_MODULE", raising=False)
+
+    with patch("fractal_database.utils.is_db_initialized", create=True) as mock_initialized:
+        assert not is_db_initialized_cached()
+
+    mock_initialized.assert_not_called()
+
+
+def test_utils_is_db_initialized_cached_keyed_by_db_file(monkeypatch):
+    """
+    Tests that the database state is cached until the database file changes.
+    """
+
+    # create a local project with a database file
+    monkeypatch.setenv("FRACTAL_PROJECT_NAME", "test_project")
+    db_file = os.path.join(FRACTAL_DATA_DIR, "test_project", "db.sqlite3")
+    os.makedirs(os.path.dirname(db_file))
+    with open(db_file, "w") as file:
+        file.write("db")
+
+    with patch(
+        "fractal_database.utils.is_db_initialized", create=True, return_value=True
+    ) as mock_initialized:
+        # the first check asks fractal-database, the second one is cached
+        assert is_db_initialized_cached()
+        assert is_db_initialized_cached()
+        mock_initialized.assert_called_once()
+
+        # writing to the database invalidates the cache
+        with open(db_file, "a") as file:
+            file.write("more")
+        assert is_db_initialized_cached()
+        assert mock_initialized.call_count == 2
+
+
+def test_utils_normalize_homeserver_url():
+    """
+    Tests that homeserver urls without a scheme default to https.
+    """
+
+    assert normalize_homeserver_url("matrix.org") == "https://matrix.org"
+    assert normalize_homeserver_url("http://localhost:8008") == "http://localhost:8008"
+    assert normalize_homeserver_url("https://matrix.org") == "https://matrix.org"
+
+
+def test_utils_data_dir_from_env(monkeypatch, tmp_path):
+    """
+    Tests that FRACTAL_DATA_DIR is read whenever the data directory is used.
+    """
+    assert get_data_dir() == FRACTAL_DATA_DIR
+
+    monkeypatch.setenv("FRACTAL_DATA_DIR", str(tmp_path))
+    write_user_data({"key": "value"}, "env.yaml")
+
+    assert os.path.exists(tmp_path / "env.yaml")
+    assert not os.path.exists(FRACTAL_DATA_DIR)
+
+
+def test_utils_use_data_dir(isolated_data_dir):
+    """
+    Tests that use_data_dir overrides the data directory, including in the
+    threads async_to_sync runs coroutines on.
+    """
+
+    async def read():
+        return read_user_data("isolated.yaml")
+
+    write_user_data({"key": "value"}, "isolated.yaml")
+    data, path = async_to_sync(read)()
+
+    assert data == {"key": "value"}
+    assert path == os.path.join(isolated_data_dir, "isolated.yaml")
+    assert not os.path.exists(FRACTAL_DATA_DIR)
+
+    with use_data_dir(FRACTAL_DATA_DIR):
+        assert get_data_dir() == FRACTAL_DATA_DIR
+    assert get_data_dir() == isolated_data_dir
+
+
+def test_utils_fractal_data_dir_follows_use_data_dir(isolated_data_dir):
+    """
+    Tests that fractal.cli.FRACTAL_DATA_DIR is resolved on access, so it follows
+    use_data_dir and FRACTAL_DATA_DIR like get_data_dir.
+    """
+    import fractal.cli
+
+    assert fractal.cli.FRACTAL_DATA_DIR == isolated_data_dir
+
+    with use_data_dir(FRACTAL_DATA_DIR):
+        assert fractal.cli.FRACTAL_DATA_DIR == FRACTAL_DATA_DIR
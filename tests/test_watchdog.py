@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import pytest
+from asgiref.sync import async_to_sync
+from fractal.cli import trace, watchdog
+
+
+@pytest.fixture
+def watching():
+    """
+    Watches event loops created during a test with a 50ms threshold.
+    """
+    watchdog.enable(0.05)
+    yield
+    watchdog.disable()
+    watchdog.reports.clear()
+
+
+def blocking_call():
+    time.sleep(0.2)
+
+
+async def blocks_the_loop():
+    await asyncio.sleep(0.01)
+    blocking_call()
+    await asyncio.sleep(0.01)
+
+
+async def does_not_block():
+    for _ in range(10):
+        await asyncio.sleep(0.02)
+
+
+def test_watchdog_reports_blocking_call_with_stack(watching, capsys):
+    """
+    Tests that a blocking call on the event loop is reported with how long it
+    blocked and the stack of the blocking call.
+    """
+
+    asyncio.run(blocks_the_loop())
+
+    [report] = watchdog.reports
+    assert 0.1 < report["blocked"] < 0.3
+    assert "in blocking_call" in report["stack"]
+    assert "Event loop blocked for" in capsys.readouterr().err
+
+
+def test_watchdog_watches_async_to_sync_loops(watching):
+    """
+    Tests that the event loops async_to_sync runs coroutines on are watched.
+    """
+
+    async_to_sync(blocks_the_loop)()
+
+    [report] = watchdog.reports
+    assert "in blocks_the_loop" in report["stack"]
+
+
+def test_watchdog_no_report_without_blocking(watching):
+    """
+    Tests that nothing is reported when the event loop is never blocked.
+    """
+
+    asyncio.run(does_not_block())
+
+    assert watchdog.reports == []
+
+
+def test_watchdog_loop_not_running_is_not_blocking(watching):
+    """
+    Tests that blocking between two runs of an event loop isn't reported.
+    """
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(asyncio.sleep(0.01))
+        # blocking while the loop isn't running doesn't stall anything
+        blocking_call()
+        loop.run_until_complete(asyncio.sleep(0.01))
+    finally:
+        loop.close()
+
+    assert watchdog.reports == []
+
+
+def test_watchdog_disabled_does_not_watch():
+    """
+    Tests that event loops aren't watched when the watchdog is not enabled.
+    """
+
+    assert not watchdog.is_enabled()
+    asyncio.run(blocks_the_loop())
+
+    assert watchdog.reports == []
+
+
+def test_watchdog_stall_recorded_as_span(watching, tmp_path):
+    """
+    Tests that a blocked event loop is recorded as a span when tracing.
+    """
+
+    trace.enable(str(tmp_path / "trace.json"))
+    try:
+        asyncio.run(blocks_the_loop())
+        [stall] = [event for event in trace._events if event.get("cat") == "loop"]  # type: ignore
+    finally:
+        trace._events = None
+        trace._trace_path = None
+
+    assert stall["name"] == "event loop blocked"
+    assert stall["dur"] > 100_000